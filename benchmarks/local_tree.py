@@ -0,0 +1,72 @@
+"""
+Benchmark for building the local backend's directory tree over a synthetic drop box.
+
+Usage: python -m benchmarks.local_tree [--fan-out N] [--depth N] [--files-per-dir N] [--runs N]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import statistics
+import tempfile
+import time
+
+from bento_drop_box_service.backends.local import LocalBackend
+from bento_drop_box_service.config import Config
+
+
+def generate_tree(root: pathlib.Path, fan_out: int, depth: int, files_per_dir: int) -> int:
+    """Generate a synthetic drop box with fan_out sub-directories per level; returns the number of files created."""
+    n_files = 0
+    for i in range(files_per_dir):
+        (root / f"file_{i:05d}.vcf").write_bytes(b"x" * (i % 128))
+        n_files += 1
+    if depth > 0:
+        for d in range(fan_out):
+            sub = root / f"dir_{d:03d}"
+            sub.mkdir()
+            n_files += generate_tree(sub, fan_out, depth - 1, files_per_dir)
+    return n_files
+
+
+def count_entries(tree) -> int:
+    return sum(1 + count_entries(e.get("contents", ())) for e in tree)
+
+
+async def bench(backend: LocalBackend, runs: int) -> list[float]:
+    timings: list[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await backend.get_directory_tree()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fan-out", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as td:
+        n_files = generate_tree(pathlib.Path(td), args.fan_out, args.depth, args.files_per_dir)
+
+        os.environ.setdefault("BENTO_AUTHZ_SERVICE_URL", "https://skip")
+        config = Config(service_data=td, bento_authz_enabled=False)
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.ERROR)
+        backend = LocalBackend(config, logger)
+
+        n_entries = count_entries(asyncio.run(backend.get_directory_tree()))
+        timings = asyncio.run(bench(backend, args.runs))
+
+    print(f"files: {n_files}  tree entries: {n_entries}  runs: {args.runs}")
+    print(f"min: {min(timings):.3f}s  median: {statistics.median(timings):.3f}s  max: {max(timings):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
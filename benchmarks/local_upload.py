@@ -0,0 +1,104 @@
+"""
+Benchmark for streaming large uploads into the local backend, with the request body delivered in ASGI-sized chunks.
+Pass --baseline to also time a naive per-chunk aiofiles write of the same body, for comparison.
+
+Usage: python -m benchmarks.local_upload [--size-mb N] [--chunk-kb N] [--buffer-mb N] [--fsync POLICY] [--runs N]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import aiofiles
+from fastapi.requests import Request
+
+from bento_drop_box_service.backends.local import LocalBackend
+from bento_drop_box_service.config import Config
+
+
+def make_request(size: int, chunk_size: int) -> Request:
+    chunk = os.urandom(chunk_size)
+    remaining = size
+
+    async def receive():
+        nonlocal remaining
+        n = min(chunk_size, remaining)
+        remaining -= n
+        return {"type": "http.request", "body": chunk[:n], "more_body": remaining > 0}
+
+    return Request({"type": "http", "method": "PUT", "headers": []}, receive)
+
+
+async def naive_upload(request: Request, path: str) -> None:
+    async with aiofiles.open(path, "wb") as f:
+        async for chunk in request.stream():
+            await f.write(chunk)
+
+
+async def bench(backend: LocalBackend, td: str, size: int, chunk_size: int, runs: int, baseline: bool):
+    timings: list[float] = []
+    baseline_timings: list[float] = []
+
+    for i in range(runs):
+        start = time.perf_counter()
+        await backend.upload_to_path(make_request(size, chunk_size), f"upload_{i}.bin", size)
+        timings.append(time.perf_counter() - start)
+        os.unlink(os.path.join(td, f"upload_{i}.bin"))
+
+        if baseline:
+            start = time.perf_counter()
+            await naive_upload(make_request(size, chunk_size), os.path.join(td, f"baseline_{i}.bin"))
+            baseline_timings.append(time.perf_counter() - start)
+            os.unlink(os.path.join(td, f"baseline_{i}.bin"))
+
+    return timings, baseline_timings
+
+
+def report(label: str, size: int, timings: list[float]) -> None:
+    mib = size / (1024 * 1024)
+    print(
+        f"{label:>9}: min: {min(timings):.3f}s  median: {statistics.median(timings):.3f}s  max: {max(timings):.3f}s  "
+        f"({mib / statistics.median(timings):.0f} MiB/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    parser.add_argument("--buffer-mb", type=int, default=4)
+    parser.add_argument("--fsync", choices=("none", "file", "file_and_directory"), default="none")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--baseline", action="store_true")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCH_DIR")) as td:
+        os.environ.setdefault("BENTO_AUTHZ_SERVICE_URL", "https://skip")
+        config = Config(
+            service_data=td,
+            bento_authz_enabled=False,
+            local_upload_buffer_size=args.buffer_mb * 1024 * 1024,
+            local_upload_fsync=args.fsync,
+        )
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.ERROR)
+        backend = LocalBackend(config, logger)
+
+        timings, baseline_timings = asyncio.run(
+            bench(backend, td, size, args.chunk_kb * 1024, args.runs, args.baseline)
+        )
+
+    print(f"size: {args.size_mb} MiB  chunk: {args.chunk_kb} KiB  buffer: {args.buffer_mb} MiB  fsync: {args.fsync}")
+    report("buffered", size, timings)
+    if baseline_timings:
+        report("baseline", size, baseline_timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Benchmark suite driving the application in-process through its HTTP routes (tree listings, archives, downloads,
+uploads, resumable uploads and deletes), against the local backend and/or the S3 backend with an in-process S3
+stand-in. Results (throughput and latency percentiles per backend and scenario) are written as JSON, and can be
+compared against the results of a previous run.
+
+Usage: python -m benchmarks.routes [--backend {local,s3,both}] [--fan-out N] [--depth N] [--files-per-dir N]
+                                   [--file-size-kb N] [--upload-size-mb N] [--requests N] [--concurrency N]
+                                   [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+import httpx
+
+os.environ.setdefault("BENTO_AUTHZ_SERVICE_URL", "https://skip")
+os.environ.setdefault("BENTO_AUTHZ_ENABLED", "False")  # read when the application module is first imported
+
+from bento_drop_box_service.app import application
+from bento_drop_box_service.backends.base import DropBoxBackend
+from bento_drop_box_service.backends.dependency import get_backend
+from bento_drop_box_service.backends.local import LocalBackend
+from bento_drop_box_service.backends.s3 import S3Backend
+from bento_drop_box_service.config import Config, get_config
+from tests.fake_s3 import FakeS3Client
+
+MiB = 1024 * 1024
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Makes the i-th request, returning the number of payload bytes transferred (for throughput in MiB/s)
+    request: Callable[[httpx.AsyncClient, int], Awaitable[int]]
+    setup: Callable[[httpx.AsyncClient, int], Awaitable[None]] | None = None  # called with the number of requests
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already-sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, n_requests: int, concurrency: int) -> dict:
+    if scenario.setup is not None:
+        await scenario.setup(client, n_requests)
+
+    latencies: list[float] = []
+    n_bytes = 0
+    next_request = 0
+
+    async def _worker():
+        nonlocal n_bytes, next_request
+        while next_request < n_requests:
+            i = next_request
+            next_request += 1
+            start = time.perf_counter()
+            n_bytes += await scenario.request(client, i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": n_requests,
+        "seconds": elapsed,
+        "requests_per_second": n_requests / elapsed,
+        "mib_per_second": n_bytes / MiB / elapsed,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+    }
+
+
+def _check(res: httpx.Response, *expected: int) -> httpx.Response:
+    if res.status_code not in expected:
+        raise RuntimeError(f"{res.request.method} {res.request.url} -> {res.status_code}: {res.text[:200]}")
+    return res
+
+
+def build_scenarios(file_size: int, upload_size: int, files_per_dir: int) -> list[Scenario]:
+    upload_body = os.urandom(upload_size)
+    small_body = b"x" * file_size
+
+    async def tree(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree"), 200).content)
+
+    async def tree_ndjson(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree", params={"format": "ndjson"}), 200).content)
+
+    async def tree_compact(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree", params={"format": "compact"}), 200).content)
+
+    async def tree_filtered(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree", params={"include": ".vcf"}), 200).content)
+
+    async def listing_page(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree/dir_000", params={"depth": 1, "limit": 100}), 200).content)
+
+    async def subtree_archive(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/tree/dir_000", params={"format": "tar"}), 200).content)
+
+    async def download(client: httpx.AsyncClient, i: int) -> int:
+        return len(_check(await client.get(f"/objects/file_{i % files_per_dir:05d}.vcf"), 200).content)
+
+    async def download_range(client: httpx.AsyncClient, i: int) -> int:
+        res = await client.get(f"/objects/file_{i % files_per_dir:05d}.vcf", headers={"Range": "bytes=0-63"})
+        return len(_check(res, 206).content)
+
+    async def download_post(client: httpx.AsyncClient, i: int) -> int:
+        res = await client.post(f"/objects/file_{i % files_per_dir:05d}.vcf", data={"token": "bench"})
+        return len(_check(res, 200).content)
+
+    async def upload(client: httpx.AsyncClient, i: int) -> int:
+        _check(await client.put(f"/objects/bench_upload/{i:06d}.bin", content=upload_body), 204)
+        return len(upload_body)
+
+    async def resumable_upload(client: httpx.AsyncClient, i: int) -> int:
+        session = _check(
+            await client.post("/uploads", json={"path": f"bench_resumable/{i:06d}.bin", "size": len(upload_body)}),
+            201,
+        ).json()
+        for offset in range(0, len(upload_body), session["partSize"]):
+            part = upload_body[offset : offset + session["partSize"]]
+            _check(await client.put(f"/uploads/{session['id']}", params={"offset": offset}, content=part), 204)
+        _check(await client.get(f"/uploads/{session['id']}"), 200)
+        _check(await client.post(f"/uploads/{session['id']}/complete"), 204)
+        return len(upload_body)
+
+    async def delete_setup(client: httpx.AsyncClient, n_requests: int) -> None:
+        for i in range(n_requests):
+            _check(await client.put(f"/objects/bench_delete/{i:06d}.vcf", content=small_body), 204)
+
+    async def delete(client: httpx.AsyncClient, i: int) -> int:
+        _check(await client.delete(f"/objects/bench_delete/{i:06d}.vcf"), 204)
+        return 0
+
+    async def batch_delete_setup(client: httpx.AsyncClient, n_requests: int) -> None:
+        for i in range(n_requests):
+            for j in range(files_per_dir):
+                _check(await client.put(f"/objects/bench_batch/{i:06d}/{j:05d}.vcf", content=small_body), 204)
+
+    async def batch_delete(client: httpx.AsyncClient, i: int) -> int:
+        _check(await client.post("/delete", json={"prefix": f"bench_batch/{i:06d}"}), 200)
+        return 0
+
+    async def metrics(client: httpx.AsyncClient, _i: int) -> int:
+        return len(_check(await client.get("/metrics"), 200).content)
+
+    return [
+        Scenario("tree", tree),
+        Scenario("tree_ndjson", tree_ndjson),
+        Scenario("tree_compact", tree_compact),
+        Scenario("tree_filtered", tree_filtered),
+        Scenario("listing_page", listing_page),
+        Scenario("subtree_archive", subtree_archive),
+        Scenario("download", download),
+        Scenario("download_range", download_range),
+        Scenario("download_post", download_post),
+        Scenario("upload", upload),
+        Scenario("resumable_upload", resumable_upload),
+        Scenario("delete", delete, delete_setup),
+        Scenario("batch_delete", batch_delete, batch_delete_setup),
+        Scenario("metrics", metrics),
+    ]
+
+
+def generate_paths(fan_out: int, depth: int, files_per_dir: int, prefix: str = "") -> list[str]:
+    """Paths of a synthetic drop box with fan_out sub-directories per level, laid out like benchmarks.local_tree."""
+    paths = [f"{prefix}file_{i:05d}.vcf" for i in range(files_per_dir)]
+    if depth > 0:
+        for d in range(fan_out):
+            paths.extend(generate_paths(fan_out, depth - 1, files_per_dir, f"{prefix}dir_{d:03d}/"))
+    return paths
+
+
+def make_backend(kind: str, td: str, args: argparse.Namespace) -> tuple[DropBoxBackend, Config, int]:
+    config = Config(
+        service_data=td,
+        bento_authz_enabled=False,
+        resumable_upload_part_size=5 * MiB,
+        s3_endpoint="s3.local" if kind == "s3" else "",
+        s3_bucket="bench",
+    )
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.ERROR)
+
+    paths = generate_paths(args.fan_out, args.depth, args.files_per_dir)
+    body = b"x" * args.file_size_kb * 1024
+
+    if kind == "local":
+        for path in paths:
+            (pathlib.Path(td) / path).parent.mkdir(parents=True, exist_ok=True)
+            (pathlib.Path(td) / path).write_bytes(body)
+        return LocalBackend(config, logger), config, len(paths)
+
+    s3_client = FakeS3Client()
+    for path in paths:
+        s3_client.put(path, body)
+    backend = S3Backend(config, logger)
+    backend._s3_client = s3_client  # in-process stand-in instead of a real client connection pool
+    return backend, config, len(paths)
+
+
+async def bench_backend(kind: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCH_DIR")) as td:
+        backend, config, n_files = make_backend(kind, td, args)
+        application.dependency_overrides[get_config] = lambda: config
+        application.dependency_overrides[get_backend] = lambda: backend
+
+        results = {"files": n_files, "scenarios": {}}
+        transport = httpx.ASGITransport(app=application)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for scenario in build_scenarios(
+                    args.file_size_kb * 1024, args.upload_size_mb * MiB, args.files_per_dir
+                ):
+                    n_requests = args.requests if scenario.name not in ("upload", "resumable_upload") else args.uploads
+                    result = await run_scenario(client, scenario, n_requests, args.concurrency)
+                    results["scenarios"][scenario.name] = result
+                    print(
+                        f"{kind:>5} {scenario.name:<17} {result['requests_per_second']:9.1f} req/s "
+                        f"{result['mib_per_second']:9.1f} MiB/s  p50: {result['latency_seconds']['p50'] * 1000:8.2f}ms  "
+                        f"p99: {result['latency_seconds']['p99'] * 1000:8.2f}ms"
+                    )
+        finally:
+            application.dependency_overrides.pop(get_config, None)
+            application.dependency_overrides.pop(get_backend, None)
+
+        return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Prints the change in throughput and median latency of each scenario relative to a previous run."""
+    print("\nchange vs. baseline (throughput / p50 latency):")
+    for kind, backend_results in results["backends"].items():
+        for name, result in backend_results["scenarios"].items():
+            if (base := baseline.get("backends", {}).get(kind, {}).get("scenarios", {}).get(name)) is None:
+                continue
+            throughput = result["requests_per_second"] / base["requests_per_second"] - 1
+            p50 = result["latency_seconds"]["p50"] / base["latency_seconds"]["p50"] - 1
+            print(f"{kind:>5} {name:<17} {throughput:+8.1%} {p50:+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("local", "s3", "both"), default="both")
+    parser.add_argument("--fan-out", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--files-per-dir", type=int, default=50)
+    parser.add_argument("--file-size-kb", type=int, default=4)
+    parser.add_argument("--upload-size-mb", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--uploads", type=int, default=10, help="requests for the upload scenarios")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", type=pathlib.Path, help="write results as JSON to this file")
+    parser.add_argument("--compare", type=pathlib.Path, help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    logging.getLogger("bento_drop_box_service.logger").setLevel(logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    kinds = ("local", "s3") if args.backend == "both" else (args.backend,)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "parameters": {k: (str(v) if isinstance(v, pathlib.Path) else v) for k, v in vars(args).items()},
+        },
+        "backends": {kind: asyncio.run(bench_backend(kind, args)) for kind in kinds},
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
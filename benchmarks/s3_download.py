@@ -0,0 +1,124 @@
+"""
+Benchmark for streaming S3 downloads through the S3 backend, against the in-process S3 stand-in from the tests with
+latency injected: a delay before each get_object response (time to first byte), and for each body read, a fixed delay
+plus the time its bytes take at a per-connection bandwidth. The client side also takes a fixed delay plus time at its
+own bandwidth to send each chunk, so fetching and sending only overlap if the backend pipelines them.
+
+Compares a baseline without read-ahead (fixed-size chunks, fetched and sent in turn) against read-ahead with growing
+chunks, and against parallel ranged GETs.
+
+Usage: python -m benchmarks.s3_download [--size-mb N] [--first-byte-ms N] [--read-ms N] [--connection-mbps N]
+                                        [--send-ms N] [--client-mbps N] [--runs N]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+from bento_drop_box_service.backends.s3 import S3Backend
+from bento_drop_box_service.config import Config
+from tests.fake_s3 import FakeS3Client, FakeStreamingBody
+
+MiB = 1024 * 1024
+KEY = "run/reads.bam"
+
+
+class LatencyStreamingBody:
+    def __init__(self, body: FakeStreamingBody, read_latency: float, bandwidth: float):
+        self._body = body
+        self._read_latency = read_latency
+        self._bandwidth = bandwidth
+
+    async def read(self, amt: int | None = None) -> bytes:
+        chunk = await self._body.read(amt)
+        await asyncio.sleep(self._read_latency + len(chunk) / self._bandwidth)
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self._body.__aexit__(*args)
+
+
+class LatencyS3Client(FakeS3Client):
+    def __init__(self, first_byte_latency: float, read_latency: float, bandwidth: float):
+        super().__init__()
+        self._first_byte_latency = first_byte_latency
+        self._read_latency = read_latency
+        self._bandwidth = bandwidth
+
+    async def get_object(self, *args, **kwargs):
+        await asyncio.sleep(self._first_byte_latency)
+        res = await super().get_object(*args, **kwargs)
+        res["Body"] = LatencyStreamingBody(res["Body"], self._read_latency, self._bandwidth)
+        return res
+
+
+async def download(backend: S3Backend, send_latency: float, client_bandwidth: float) -> int:
+    n_bytes = 0
+    async for chunk in backend._stream_full_object(KEY, await backend._get_object(KEY)):
+        await asyncio.sleep(send_latency + len(chunk) / client_bandwidth)
+        n_bytes += len(chunk)
+    return n_bytes
+
+
+async def bench(backend: S3Backend, size: int, send_latency: float, client_bandwidth: float, runs: int) -> list[float]:
+    timings: list[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        assert await download(backend, send_latency, client_bandwidth) == size
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label: str, size: int, timings: list[float]) -> None:
+    print(
+        f"{label:>10}: min: {min(timings):.3f}s  median: {statistics.median(timings):.3f}s  max: {max(timings):.3f}s  "
+        f"({size / MiB / statistics.median(timings):.0f} MiB/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--first-byte-ms", type=float, default=20)
+    parser.add_argument("--read-ms", type=float, default=0.2)
+    parser.add_argument("--connection-mbps", type=float, default=100, help="S3 bandwidth per connection, in MiB/s")
+    parser.add_argument("--send-ms", type=float, default=0.2)
+    parser.add_argument("--client-mbps", type=float, default=250, help="client bandwidth, in MiB/s")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mb * MiB
+    s3_client = LatencyS3Client(args.first_byte_ms / 1000, args.read_ms / 1000, args.connection_mbps * MiB)
+    s3_client.put(KEY, os.urandom(size))
+
+    os.environ.setdefault("BENTO_AUTHZ_SERVICE_URL", "https://skip")
+    base_config = Config(s3_endpoint="s3.local", s3_bucket="bench", bento_authz_enabled=False, log_level="warning")
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.ERROR)
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    scenarios = {
+        "baseline": {"s3_read_ahead_chunks": 0, "s3_max_chunk_size": base_config.s3_chunk_size},
+        "read-ahead": {},
+        "parallel": {"s3_parallel_download_threshold": 1},
+    }
+
+    print(
+        f"size: {args.size_mb} MiB  first byte: {args.first_byte_ms} ms  read: {args.read_ms} ms  "
+        f"connection: {args.connection_mbps} MiB/s  send: {args.send_ms} ms  client: {args.client_mbps} MiB/s"
+    )
+    for label, config_update in scenarios.items():
+        backend = S3Backend(base_config.model_copy(update=config_update), logger)
+        backend._s3_client = s3_client  # use the latency-injecting stand-in instead of a real client
+        timings = asyncio.run(bench(backend, size, args.send_ms / 1000, args.client_mbps * MiB, args.runs))
+        report(label, size, timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark for assembling the S3 backend's directory tree from a flat list of synthetic object keys.
+
+Usage: python -m benchmarks.s3_tree [--keys N] [--files-per-dir N] [--runs N]
+"""
+
+import argparse
+import statistics
+import time
+
+from bento_drop_box_service.backends.base import DropBoxEntry
+from bento_drop_box_service.backends.s3 import S3Backend
+
+
+def generate_entries(n_keys: int, files_per_dir: int) -> list[DropBoxEntry]:
+    """Generate entries shaped like a sequencing run's outputs: run/sample_XXXXX/file_Y.fastq.gz"""
+    entries: list[DropBoxEntry] = []
+    for i in range(n_keys):
+        key = f"run/sample_{i // files_per_dir:06d}/file_{i % files_per_dir}.fastq.gz"
+        entries.append(
+            {
+                "name": key.rsplit("/", 1)[-1],
+                "filePath": key,
+                "relativePath": key,
+                "size": i,
+                "lastModified": 0.0,
+                "lastMetadataChange": 0.0,
+                "uri": f"/objects/{key}",
+            }
+        )
+    entries.sort(key=lambda e: e["filePath"])  # S3 lists keys in lexicographic order
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--files-per-dir", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    entries = generate_entries(args.keys, args.files_per_dir)
+
+    timings: list[float] = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        S3Backend.create_directory_tree(entries)
+        timings.append(time.perf_counter() - start)
+
+    print(f"keys: {args.keys}  files per directory: {args.files_per_dir}  runs: {args.runs}")
+    print(f"min: {min(timings):.3f}s  median: {statistics.median(timings):.3f}s  max: {max(timings):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from bento_lib.apps.fastapi import BentoFastAPI
 from bento_lib.service_info.types import BentoExtraServiceInfo
 
 from . import __version__
 from .authz import authz_middleware
+from .backends.base import DropBoxBackend
+from .backends.dependency import get_backend
 from .config import get_config
 from .constants import BENTO_SERVICE_KIND, SERVICE_TYPE
 from .logger import get_logger
+from .metrics import MetricsMiddleware
 from .routes import drop_box_router
 
 __all__ = [
@@ -22,8 +28,64 @@ BENTO_SERVICE_INFO: BentoExtraServiceInfo = {
 config_for_setup = get_config()
 logger = get_logger(config_for_setup)
 
-application = BentoFastAPI(authz_middleware, config_for_setup, logger, BENTO_SERVICE_INFO, SERVICE_TYPE, __version__)
+
+async def cleanup_expired_uploads_periodically(backend: DropBoxBackend) -> None:
+    while True:
+        await asyncio.sleep(config_for_setup.resumable_upload_cleanup_interval)
+        try:
+            if n_cleaned := await backend.cleanup_expired_uploads():
+                logger.info(f"Cleaned up {n_cleaned} expired upload(s)")
+        except Exception:  # keep cleaning up periodically, even if a single pass fails
+            logger.exception("Error cleaning up expired uploads")
+
+
+async def detect_changes_periodically(backend: DropBoxBackend) -> None:
+    # The first pass records the current state of the tree, which later passes are compared against
+    while True:
+        try:
+            if n_changes := await backend.detect_changes():
+                logger.debug(f"Detected {n_changes} outside change(s)")
+        except Exception:  # keep detecting changes periodically, even if a single pass fails
+            logger.exception("Error detecting changes")
+        await asyncio.sleep(config_for_setup.change_detection_interval)
+
+
+async def update_checksums_periodically(backend: DropBoxBackend) -> None:
+    while True:
+        try:
+            if n_updated := await backend.update_checksums():
+                logger.info(f"Computed or loaded checksums for {n_updated} file(s)")
+        except Exception:  # keep updating checksums periodically, even if a single pass fails
+            logger.exception("Error updating checksums")
+        await asyncio.sleep(config_for_setup.checksum_scan_interval)
+
+
+@asynccontextmanager
+async def lifespan(_app: BentoFastAPI):
+    # Long-lived backend resources (e.g., the S3 client connection pool) are created at startup and shared by requests
+    backend = get_backend(config_for_setup, logger)
+    await backend.startup()
+    tasks = [asyncio.create_task(cleanup_expired_uploads_periodically(backend))]
+    if config_for_setup.change_detection_interval:
+        tasks.append(asyncio.create_task(detect_changes_periodically(backend)))
+    if config_for_setup.checksum_algorithms and config_for_setup.checksum_scan_interval:
+        tasks.append(asyncio.create_task(update_checksums_periodically(backend)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        await backend.shutdown()
+
+
+application = BentoFastAPI(
+    authz_middleware, config_for_setup, logger, BENTO_SERVICE_INFO, SERVICE_TYPE, __version__, lifespan=lifespan
+)
 application.include_router(drop_box_router)
+# Added last, so that request latencies include time spent in other middleware (e.g., authorization checks)
+application.add_middleware(MetricsMiddleware, backend="s3" if config_for_setup.use_s3_backend else "local")
 
 # Backend init logs
 logger.info(f"Using {'S3' if config_for_setup.use_s3_backend else 'local'} storage backend")
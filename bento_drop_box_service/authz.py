@@ -1,14 +1,152 @@
+import base64
+import binascii
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import Any
+
 from bento_lib.auth.middleware.fastapi import FastApiAuthMiddleware
+from bento_lib.auth.permissions import Permission
+from bento_lib.auth.types import EvaluationResultMatrix
 
 from .config import get_config
 from .logger import get_logger
+from .metrics import AUTHZ_CACHE_REQUESTS
 
 __all__ = [
+    "AuthzDecisionCache",
+    "CachingFastApiAuthMiddleware",
     "authz_middleware",
 ]
 
+AuthzCacheKey = tuple[bytes, tuple[Permission, ...], str]  # (token digest, permissions, resources)
+
+
+def _token_expiry(authorization: str) -> float | None:
+    """
+    Returns the expiry (exp claim, as a Unix timestamp) of a bearer JWT, or None if it cannot be read. The token is
+    not verified here - the expiry only bounds how long a decision made by the authorization service is re-used.
+    """
+
+    try:
+        payload = authorization.removeprefix("Bearer ").split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        exp = claims.get("exp") if isinstance(claims, dict) else None
+    except (IndexError, ValueError, binascii.Error):
+        return None
+    return float(exp) if isinstance(exp, int | float) else None
+
+
+class AuthzDecisionCache:
+    """
+    Bounded LRU cache of authorization decisions (evaluation result matrices), keyed by a digest of the Authorization
+    header value (raw tokens are never stored), the permissions evaluated, and the resources. Entries are kept for at
+    most `ttl` seconds, and never past the expiry of the token they were made for; decisions for tokens without a
+    readable expiry are not cached. Requests without a token are cached under an empty digest, since they all get the
+    same decision.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        # key -> (result matrix, expires at)
+        self._entries: OrderedDict[AuthzCacheKey, tuple[EvaluationResultMatrix, float]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0 and self._ttl > 0
+
+    @staticmethod
+    def make_key(
+        authorization: str | None, permissions: tuple[Permission, ...], resources: tuple[dict, ...]
+    ) -> AuthzCacheKey:
+        digest = hashlib.sha256(authorization.encode()).digest() if authorization else b""
+        return digest, permissions, json.dumps(resources, sort_keys=True)
+
+    def get(self, key: AuthzCacheKey) -> EvaluationResultMatrix | None:
+        if (entry := self._entries.get(key)) is None:
+            return None
+        result, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: AuthzCacheKey, authorization: str | None, result: EvaluationResultMatrix) -> None:
+        ttl = self._ttl
+        if authorization:
+            if (exp := _token_expiry(authorization)) is None:
+                return
+            ttl = min(ttl, exp - time.time())
+            if ttl <= 0:
+                return
+
+        self._entries[key] = (result, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CachingFastApiAuthMiddleware(FastApiAuthMiddleware):
+    """
+    Authorization middleware which re-uses recent decisions from the authorization service for the same token,
+    permissions and resources, so that clients making many requests in a row (e.g., a workflow fetching thousands of
+    files) don't cost an authorization service round trip each. The cache sits in front of async_evaluate, which the
+    route dependencies and async_check_authz_evaluate go through, and delegates to it on a miss.
+    """
+
+    def __init__(self, *args, decision_cache: AuthzDecisionCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decision_cache = decision_cache
+
+    async def async_evaluate(
+        self,
+        request: Any,
+        resources: Iterable[dict],
+        permissions: Iterable[Permission],
+        require_token: bool = False,
+        headers_getter: Callable[[Any], dict[str, str]] | None = None,
+        mark_authz_done: bool = False,
+    ) -> EvaluationResultMatrix:
+        resources, permissions = tuple(resources), tuple(permissions)  # consumed once, in case they are generators
+        if not self.decision_cache.enabled:
+            return await super().async_evaluate(
+                request, resources, permissions, require_token, headers_getter, mark_authz_done
+            )
+
+        if headers_getter is not None:
+            authorization = headers_getter(request).get("Authorization")
+        else:
+            authorization = self.get_authz_header_value(request)
+            self.check_require_token(require_token, authorization)  # missing tokens are rejected before any lookup
+        key = self.decision_cache.make_key(authorization, permissions, resources)
+
+        if (result := self.decision_cache.get(key)) is not None:
+            AUTHZ_CACHE_REQUESTS.labels("hit").inc()
+            if mark_authz_done:
+                self.mark_authz_done(request)
+            return result
+
+        AUTHZ_CACHE_REQUESTS.labels("miss").inc()
+        result = await super().async_evaluate(
+            request, resources, permissions, require_token, headers_getter, mark_authz_done
+        )
+        self.decision_cache.put(key, authorization, result)
+        return result
+
+
 # TODO: Find a way to DI this
 config = get_config()
 
 # Non-standard middleware setup so that we can import the instance and use it for dependencies too
-authz_middleware = FastApiAuthMiddleware.build_from_pydantic_config(config, get_logger(config))
+authz_middleware = CachingFastApiAuthMiddleware.build_from_pydantic_config(
+    config,
+    get_logger(config),
+    decision_cache=AuthzDecisionCache(config.authz_cache_size, config.authz_cache_ttl),
+)
@@ -0,0 +1,122 @@
+import tarfile
+import time
+import zipfile
+from collections.abc import AsyncIterator
+
+from .base import DropBoxEntry
+
+__all__ = [
+    "ARCHIVE_MEDIA_TYPES",
+    "ArchiveMember",
+    "ArchiveSizeMismatch",
+    "stream_tar",
+    "stream_zip",
+]
+
+ARCHIVE_MEDIA_TYPES = {
+    "tar": "application/x-tar",
+    "zip": "application/zip",
+}
+
+ZIP_EPOCH = 315532800  # 1980-01-01T00:00:00Z
+
+# (name in the archive, tree entry, contents - None for directory entries)
+ArchiveMember = tuple[str, DropBoxEntry, AsyncIterator[bytes] | None]
+
+
+class ArchiveSizeMismatch(Exception):
+    pass
+
+
+async def _checked_contents(arcname: str, entry: DropBoxEntry, contents: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Passes through a file's contents, checking they match the size listed in the tree. Archive members are written
+    from the listed size, so a file changing while being archived can't be papered over; the stream is cut off instead.
+    """
+    size = 0
+    async for chunk in contents:
+        size += len(chunk)
+        if size > entry["size"]:
+            break
+        yield chunk
+    if size != entry["size"]:
+        raise ArchiveSizeMismatch(f"{arcname} changed size while being archived ({entry['size']} -> {size} bytes)")
+
+
+async def stream_tar(members: AsyncIterator[ArchiveMember]) -> AsyncIterator[bytes]:
+    """
+    Generates a (PAX format, uncompressed) tar archive on the fly: each member is a header built from its tree entry,
+    followed by its contents as they are read, so only one chunk of one file is held in memory at a time.
+    """
+
+    async for arcname, entry, contents in members:
+        info = tarfile.TarInfo(arcname)
+        if contents is None:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = int(time.time())
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            continue
+
+        info.size = entry["size"]
+        info.mode = 0o644
+        info.mtime = int(entry["lastModified"])
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+        async for chunk in _checked_contents(arcname, entry, contents):
+            yield chunk
+
+        if remainder := info.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+    # End-of-archive marker: two empty blocks, padded to a whole record like tarfile does
+    yield tarfile.NUL * tarfile.RECORDSIZE
+
+
+class _ZipSink:
+    """
+    Non-seekable file-like object collecting what zipfile writes, to be drained after each write. zipfile detects that
+    it can't seek and writes sizes and CRCs in data descriptors after each member instead of going back to patch them.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_zip(members: AsyncIterator[ArchiveMember]) -> AsyncIterator[bytes]:
+    """
+    Generates a zip archive on the fly, with members stored without compression (drop box contents are typically
+    already-compressed genomic files, so deflating them would mostly cost CPU time) and ZIP64 extensions so that
+    files over 4 GiB can be included.
+    """
+
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        async for arcname, entry, contents in members:
+            if contents is None:
+                zf.mkdir(arcname)
+            else:
+                # Zip timestamps can't go back further than 1980
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(max(entry["lastModified"], ZIP_EPOCH))[:6])
+                info.file_size = entry["size"]
+                with zf.open(info, mode="w", force_zip64=True) as member:
+                    async for chunk in _checked_contents(arcname, entry, contents):
+                        member.write(chunk)
+                        if data := sink.drain():
+                            yield data
+            if data := sink.drain():
+                yield data
+
+    yield sink.drain()  # central directory
@@ -1,12 +1,27 @@
+import asyncio
+import base64
+import hashlib
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import NotRequired, TypedDict
+from collections.abc import AsyncIterator, Iterable
+from typing import Literal, NotRequired, TypedDict
 
+import orjson
 from fastapi import HTTPException, Request, Response, status
 
 from ..config import Config
+from ..metrics import instrument_backend_operation
+from .changes import ChangeFeed
+from .checksums import ChecksumCache, ChecksumHasher, Checksums
+from .filters import TreeFilter
+from .search import SearchQuery
 
-__all__ = ["DropBoxEntry", "DropBoxBackend"]
+__all__ = ["DropBoxEntry", "UploadSession", "DeleteResult", "DropBoxChange", "CompactDropBoxTree", "DropBoxBackend"]
+
+# S3 limits multipart uploads to 10,000 parts; resumable uploads of any backend are held to the same limit, so clients
+# see the same part sizes regardless of the storage backend.
+MAX_UPLOAD_PARTS = 10000
 
 
 class DropBoxEntry(TypedDict):
@@ -18,14 +33,71 @@ class DropBoxEntry(TypedDict):
     size: NotRequired[int]
     lastModified: NotRequired[float]
     lastMetadataChange: NotRequired[float]
+    checksums: NotRequired[Checksums]  # known checksums of the file's current contents, by algorithm (hexadecimal)
     # directory entries:
     contents: NotRequired[list["DropBoxEntry"]]
+    truncated: NotRequired[bool]  # if True, contents were not listed since the directory is past the requested depth
+
+
+class UploadSession(TypedDict):
+    id: str
+    path: str  # Destination path, relative to the root of the drop box
+    size: int  # Total length of the upload, in bytes
+    partSize: int  # Every part must be exactly this long (except the last), and start at a multiple of this offset
+    expires: float  # Timestamp after which the session may be cleaned up if it has not been completed
+    # upload status:
+    receivedOffsets: NotRequired[list[int]]  # Offsets of the parts received so far
+    bytesReceived: NotRequired[int]
+
+
+class DeleteResult(TypedDict):
+    path: str
+    status: int  # HTTP status code the path would have had as a single delete request (204 if deleted)
+    detail: NotRequired[str]  # Error details, if the path was not deleted
+
+
+class DropBoxChange(TypedDict):
+    change: Literal["added", "modified", "removed"]
+    relativePath: str
+    entry: NotRequired[DropBoxEntry]  # current file entry; not present for removed files
+
+
+class CompactDropBoxTree(TypedDict):
+    """
+    Columnar form of a directory tree: one element per entry in each array, in depth-first order (so every entry comes
+    after its parent directory). The relative path of an entry is built from the names of its ancestors, under root;
+    URIs and file paths are that relative path (without a leading slash) appended to uriPrefix and filePathPrefix.
+    """
+
+    root: str  # relative path of the directory containing the top-level entries, without slashes ("" for the root)
+    uriPrefix: str | None  # None if there are no files in the tree
+    filePathPrefix: str
+    names: list[str]
+    parents: list[int]  # index of the entry's parent directory, or -1 for top-level entries
+    sizes: list[int | None]  # None for directories
+    lastModified: list[float | None]
+    lastMetadataChange: list[float | None]
+    checksums: list[Checksums | None]  # None for directories, and for files without known checksums
 
 
 class DropBoxBackend(ABC):
+    metrics_name: str = ""  # backend label for metrics, e.g. "local" for LocalBackend
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every backend operation (i.e., every abstract method implemented by the subclass) is timed, with its errors
+        # counted, under the subclass's metrics label.
+        cls.metrics_name = cls.__name__.removesuffix("Backend").lower()
+        for name in DropBoxBackend.__abstractmethods__:
+            if (fn := cls.__dict__.get(name)) is not None and not getattr(fn, "__isabstractmethod__", False):
+                setattr(cls, name, instrument_backend_operation(cls.metrics_name, name, fn))
+
     def __init__(self, config: Config, logger: logging.Logger):
         self._config = config
         self._logger = logger
+        self._changes = ChangeFeed(config.change_feed_size)
+        self._checksum_algorithms: tuple[str, ...] = tuple(dict.fromkeys(config.checksum_algorithms))
+        self._checksums = ChecksumCache(config.checksum_cache_size)
 
     @property
     def config(self) -> Config:
@@ -35,39 +107,384 @@ class DropBoxBackend(ABC):
     def logger(self) -> logging.Logger:
         return self._logger
 
+    async def startup(self) -> None:
+        """
+        Acquires any long-lived resources the backend needs (e.g., client connection pools).
+        Called once from the application lifespan, before requests are served.
+        """
+
+    async def shutdown(self) -> None:
+        """
+        Releases any long-lived resources acquired by the backend. Called once from the application lifespan.
+        """
+
     @abstractmethod
     async def get_directory_tree(
         self,
         sub_path: str | None = None,
-        ignore: list[str] | None = None,
-        include: list[str] | None = None,
+        filters: TreeFilter | None = None,
     ) -> tuple[DropBoxEntry, ...]:  # pragma: no cover
         pass
 
+    @abstractmethod
+    def iter_directory_entries(
+        self,
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> AsyncIterator[DropBoxEntry]:  # pragma: no cover
+        """
+        Yields the same entries as get_directory_tree, flattened and in depth-first order, as they are listed from the
+        storage backend (so the whole tree is never held in memory). Directory entries have no contents; their children
+        follow them, with relative paths under theirs.
+        """
+
+    @abstractmethod
+    async def get_directory_listing(
+        self,
+        sub_path: str | None = None,
+        depth: int | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:  # pragma: no cover
+        """
+        Lists the contents of a directory down to a given depth (1 = direct children only), paginating through its
+        direct children. Directories past the requested depth have empty contents and are marked as truncated.
+        Returns the page of entries and a cursor for the next page, if there may be more entries.
+        """
+
+    @abstractmethod
+    async def search(
+        self, query: SearchQuery, limit: int, cursor: str | None = None
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:  # pragma: no cover
+        """
+        Finds the files in the tree matching a search query, in path order (i.e., sorted by relative path string).
+        Returns a page of up to limit file entries and a cursor for the next page, if there are more matches.
+        Cursors hold the path of the last file on the page (see encode_cursor), which the next page starts after.
+        """
+
+    @abstractmethod
+    def iter_file_contents(
+        self, entries: AsyncIterator[DropBoxEntry]
+    ) -> AsyncIterator[tuple[DropBoxEntry, AsyncIterator[bytes] | None]]:  # pragma: no cover
+        """
+        Pairs each entry from an entry iterator (e.g., iter_directory_entries) with an iterator over the file's
+        contents, or None for directory entries. Each file's contents must be read before moving on to the next entry;
+        backends may start fetching the following files' contents ahead of time.
+        """
+
     @abstractmethod
     async def upload_to_path(self, request: Request, path: str, content_length: int) -> Response:  # pragma: no cover
         pass
 
     @abstractmethod
-    async def retrieve_from_path(self, path: str) -> Response:  # pragma: no cover
+    async def retrieve_from_path(self, request: Request, path: str) -> Response:  # pragma: no cover
         pass
 
     @abstractmethod
     async def delete_at_path(self, path: str) -> None:  # pragma: no cover
         pass
 
+    @abstractmethod
+    async def delete_paths(
+        self, paths: list[str] | None = None, prefix: str | None = None
+    ) -> list[DeleteResult]:  # pragma: no cover
+        """
+        Deletes a batch of files, given either a list of paths or a directory prefix (all files under which are
+        deleted). Failures for individual paths don't stop the rest of the batch; the outcome of each is returned.
+        """
+
+    @staticmethod
+    def normalize_delete_prefix(prefix: str) -> str:
+        """
+        Normalizes a batch delete prefix into a directory path without leading or trailing slashes, refusing to delete
+        everything in the drop box at once.
+        """
+        if not (normalized := prefix.strip("/")):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot delete the whole drop box")
+        return normalized
+
+    @abstractmethod
+    async def create_upload(self, path: str, size: int) -> UploadSession:  # pragma: no cover
+        """
+        Starts a resumable upload session for a file of the given size, which is uploaded as parts at fixed offsets
+        (possibly in parallel, and possibly more than once) and only written to its destination path once completed.
+        """
+
+    @abstractmethod
+    async def upload_part(
+        self, upload_id: str, offset: int, request: Request, content_length: int
+    ) -> None:  # pragma: no cover
+        """
+        Writes the request body as the part of an upload session starting at the given offset. Re-uploading a part
+        replaces it.
+        """
+
+    @abstractmethod
+    async def get_upload_status(self, upload_id: str) -> UploadSession:  # pragma: no cover
+        """
+        Returns an upload session along with the parts received so far, e.g. to work out which parts are left to send
+        after resuming an interrupted upload.
+        """
+
+    @abstractmethod
+    async def complete_upload(self, upload_id: str) -> None:  # pragma: no cover
+        """
+        Assembles the parts of an upload session into the destination file, once every part has been received.
+        """
+
+    @abstractmethod
+    async def abort_upload(self, upload_id: str) -> None:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    async def cleanup_expired_uploads(self) -> int:  # pragma: no cover
+        """
+        Discards upload sessions older than the configured TTL, along with any parts received for them.
+        Returns the number of sessions cleaned up.
+        """
+
+    def upload_part_size(self, size: int) -> int:
+        """
+        Returns the part size for a resumable upload of the given size: the configured part size, raised (to a whole
+        number of MiB) if needed to fit the upload into MAX_UPLOAD_PARTS parts.
+        """
+        min_part_size = -(-size // MAX_UPLOAD_PARTS)
+        if min_part_size <= self.config.resumable_upload_part_size:
+            return self.config.resumable_upload_part_size
+        return -(-min_part_size // (1024 * 1024)) * 1024 * 1024
+
+    @staticmethod
+    def check_upload_not_expired(session: UploadSession) -> None:
+        """
+        Treats upload sessions past their expiry time as if they had already been cleaned up.
+        """
+        if session["expires"] < time.time():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
     @staticmethod
-    def is_passing_filter(entry: str, included_extensions: list[str] | None, ignored_extensions: list[str] | None):
-        if included_extensions:
-            return any(entry.endswith(ext) for ext in included_extensions)
-        elif ignored_extensions:
-            return not any(entry.endswith(ext) for ext in ignored_extensions)
-        else:
-            return True
+    def upload_part_length(session: UploadSession, offset: int, content_length: int) -> int:
+        """
+        Validates the offset and length of an upload part against its session, returning the expected length.
+        """
+
+        size, part_size = session["size"], session["partSize"]
+
+        if offset < 0 or offset >= size or offset % part_size != 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Part offset must be a multiple of the part size ({part_size}) within the upload size ({size})",
+            )
+
+        expected_length = min(part_size, size - offset)
+        if content_length != expected_length:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Part at offset {offset} must be {expected_length} bytes long",
+            )
+
+        return expected_length
 
     @staticmethod
-    def validate_filters(include: list[str] | None, ignore: list[str] | None):
-        if ignore and include:
+    def missing_upload_offsets(session: UploadSession, received_offsets: list[int]) -> list[int]:
+        received = set(received_offsets)
+        return [o for o in range(0, session["size"], session["partSize"]) if o not in received]
+
+    @property
+    def changes_token(self) -> str:
+        """Token for the current position in the change feed, to get the changes made after this point later."""
+        return self._changes.token
+
+    def get_changes(self, token: str) -> list[DropBoxChange]:
+        if (changes := self._changes.since(token)) is None:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Include only a single type of filter query parameter"
+                status_code=status.HTTP_410_GONE, detail="Changes token is invalid or has expired; re-fetch the tree"
             )
+        return changes
+
+    async def detect_changes(self) -> int:
+        """
+        Lists the whole tree to record changes made from outside the service in the change feed (the first call only
+        records the current state). Returns the number of changes detected.
+        """
+        return await self._changes.detect(self.iter_directory_entries())
+
+    def _new_checksum_hasher(self) -> ChecksumHasher | None:
+        return ChecksumHasher(self._checksum_algorithms) if self._checksum_algorithms else None
+
+    def _add_checksums(self, entry: DropBoxEntry) -> DropBoxEntry:
+        """
+        Adds the known checksums (if any) of a file entry's current contents to the entry, and returns it.
+        """
+        if self._checksum_algorithms and (
+            checksums := self._checksums.get(entry["relativePath"].strip("/"), entry["size"], entry["lastModified"])
+        ):
+            entry["checksums"] = checksums
+        return entry
+
+    def _configured_checksums(self, stored: dict) -> Checksums | None:
+        """
+        Picks the checksums for the configured algorithms out of stored checksums, or returns None if any are missing
+        (e.g., if they were stored before an algorithm was added to the configuration).
+        """
+        if all(isinstance(stored.get(algorithm), str) for algorithm in self._checksum_algorithms):
+            return {algorithm: stored[algorithm] for algorithm in self._checksum_algorithms}
+        return None
+
+    async def _load_checksums(self, entry: DropBoxEntry) -> Checksums | None:
+        """
+        Reads the checksums stored with a file by the backend, if there are any for all configured algorithms and they
+        are for the file's current contents.
+        """
+
+    async def _store_checksums(self, entry: DropBoxEntry, checksums: Checksums) -> None:
+        """
+        Stores checksums computed by update_checksums with the file, if the backend can do so cheaply.
+        """
+
+    async def update_checksums(self) -> int:
+        """
+        Lists the whole tree to find files without known checksums (e.g., files added from outside the service, or
+        through resumable uploads), and loads their stored checksums or reads them to compute checksums. Returns the
+        number of files whose checksums became known.
+        """
+
+        if not self._checksum_algorithms:
+            return 0
+
+        n_updated = 0
+
+        async def _entries_to_read() -> AsyncIterator[DropBoxEntry]:
+            nonlocal n_updated
+            async for entry in self.iter_directory_entries():
+                if "uri" not in entry or "checksums" in entry:
+                    continue
+                if (checksums := await self._load_checksums(entry)) is not None:
+                    self._checksums.put(
+                        entry["relativePath"].strip("/"), entry["size"], entry["lastModified"], checksums
+                    )
+                    n_updated += 1
+                    continue
+                yield entry
+
+        async for entry, chunks in self.iter_file_contents(_entries_to_read()):
+            if chunks is None:
+                continue
+            hasher = ChecksumHasher(self._checksum_algorithms)
+            n_bytes = 0
+            async for chunk in chunks:
+                await asyncio.to_thread(hasher.update, chunk)
+                n_bytes += len(chunk)
+            if n_bytes != entry["size"]:  # modified while it was being read; picked up by the next pass
+                continue
+            checksums = hasher.hexdigests()
+            self._checksums.put(entry["relativePath"].strip("/"), entry["size"], entry["lastModified"], checksums)
+            await self._store_checksums(entry, checksums)
+            n_updated += 1
+
+        return n_updated
+
+    @staticmethod
+    def tree_etag(tree: tuple[DropBoxEntry, ...]) -> str:
+        """
+        Computes a (weak) ETag for a directory tree from the path, size, timestamps and checksums of its entries, without
+        serializing it.
+        """
+
+        h = hashlib.blake2b(digest_size=16)
+
+        def _update(entries: Iterable[DropBoxEntry]) -> None:
+            for entry in entries:
+                if "contents" in entry:
+                    h.update(f"{entry['relativePath']}/{entry.get('truncated', '')}\0".encode())
+                    _update(entry["contents"])
+                    h.update(b"\1")
+                else:
+                    h.update(
+                        f"{entry['relativePath']}:{entry['size']}:{entry['lastModified']}:"
+                        f"{entry['lastMetadataChange']}:{','.join(entry.get('checksums', {}).values())}\0".encode()
+                    )
+
+        _update(tree)
+        return f'W/"{h.hexdigest()}"'
+
+    @staticmethod
+    def compact_tree(tree: tuple[DropBoxEntry, ...]) -> CompactDropBoxTree:
+        """
+        Converts a directory tree to its columnar form, which leaves out the per-entry copies of the entry's path (file
+        path, relative path and URI) and key names, making it much faster to serialize and smaller to send.
+        """
+
+        names: list[str] = []
+        parents: list[int] = []
+        sizes: list[int | None] = []
+        last_modified: list[float | None] = []
+        last_metadata_change: list[float | None] = []
+        checksums: list[Checksums | None] = []
+        prefix_sample: DropBoxEntry | None = None  # a file entry (if any) to derive URI/file path prefixes from
+
+        stack: list[tuple[int, Iterable[DropBoxEntry]]] = [(-1, iter(tree))]
+        while stack:
+            parent, entries = stack[-1]
+            if (entry := next(entries, None)) is None:
+                stack.pop()
+                continue
+
+            index = len(names)
+            names.append(entry["name"])
+            parents.append(parent)
+            if "contents" in entry:
+                sizes.append(None)
+                last_modified.append(None)
+                last_metadata_change.append(None)
+                checksums.append(None)
+                stack.append((index, iter(entry["contents"])))
+            else:
+                sizes.append(entry["size"])
+                last_modified.append(entry["lastModified"])
+                last_metadata_change.append(entry["lastMetadataChange"])
+                checksums.append(entry.get("checksums"))
+                prefix_sample = prefix_sample or entry
+
+        root = tree[0]["relativePath"].strip("/").rpartition("/")[0] if tree else ""
+        sample = prefix_sample or (tree[0] if tree else None)
+        sample_path = sample["relativePath"].strip("/") if sample else ""
+        return {
+            "root": root,
+            "uriPrefix": prefix_sample["uri"].removesuffix(sample_path) if prefix_sample else None,
+            "filePathPrefix": sample["filePath"].removesuffix(sample_path) if sample else "",
+            "names": names,
+            "parents": parents,
+            "sizes": sizes,
+            "lastModified": last_modified,
+            "lastMetadataChange": last_metadata_change,
+            "checksums": checksums,
+        }
+
+    def get_tree_etag(
+        self,
+        tree: tuple[DropBoxEntry, ...],
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> str:
+        """
+        Returns the ETag for a tree returned by get_directory_tree; backends caching trees can re-use computed ETags.
+        """
+        return self.tree_etag(tree)
+
+    @staticmethod
+    def encode_cursor(name: str, is_directory: bool) -> str:
+        """
+        Encodes the name of the last entry of a directory listing page into an opaque cursor for the next page.
+        """
+        return base64.urlsafe_b64encode(orjson.dumps([name, is_directory])).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[str, bool]:
+        try:
+            name, is_directory = orjson.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if not isinstance(name, str) or not isinstance(is_directory, bool):
+                raise TypeError("invalid cursor contents")
+            return name, is_directory
+        except (ValueError, TypeError, orjson.JSONDecodeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
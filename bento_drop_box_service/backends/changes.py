@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import uuid
+from collections import deque
+from collections.abc import AsyncIterator
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # the backend base module creates change feeds, so it can't be imported from here at runtime
+    from .base import DropBoxChange, DropBoxEntry
+
+__all__ = [
+    "ChangeFeed",
+]
+
+_FileState = tuple[int, float]  # (size, last modified)
+
+
+def _path_key(relative_path: str) -> str:
+    return relative_path.strip("/")
+
+
+class ChangeFeed:
+    """
+    In-memory journal of file changes (added, modified, removed), for clients to sync a copy of the tree by polling for
+    changes since their last sync rather than re-fetching the whole tree.
+
+    Changes are recorded by the service's own writes, and by detect(), which diffs a full listing against the last
+    known state of every file to pick up changes made from outside the service. Tokens identify a position in the
+    journal; since only the last max_changes changes are kept (and the journal does not survive restarts), tokens can
+    expire, in which case clients need to re-fetch the tree.
+    """
+
+    def __init__(self, max_changes: int):
+        self._epoch = uuid.uuid4().hex[:16]  # distinguishes tokens from previous runs
+        self._seq = 0
+        self._changes: deque[tuple[int, DropBoxChange]] = deque(maxlen=max_changes)
+        self._files: dict[str, _FileState] | None = None  # None until the first detection pass sets a baseline
+
+    @property
+    def token(self) -> str:
+        return f"{self._epoch}.{self._seq}"
+
+    def _append(self, change: DropBoxChange) -> None:
+        self._seq += 1
+        self._changes.append((self._seq, change))
+
+    def record_file(self, entry: DropBoxEntry) -> None:
+        path = _path_key(entry["relativePath"])
+        existed = self._files is not None and path in self._files
+        if self._files is not None:
+            self._files[path] = (entry["size"], entry["lastModified"])
+        self._append({"change": "modified" if existed else "added", "relativePath": f"/{path}", "entry": entry})
+
+    def record_removed(self, relative_path: str) -> None:
+        if self._files is not None:
+            self._files.pop(_path_key(relative_path), None)
+        self._append({"change": "removed", "relativePath": f"/{_path_key(relative_path)}"})
+
+    def since(self, token: str) -> list[DropBoxChange] | None:
+        """
+        Returns the changes since a token, coalesced to one change per file (in order of each file's last change), or
+        None if the token is invalid or has expired.
+        """
+
+        epoch, _, seq_str = token.partition(".")
+        if epoch != self._epoch or not seq_str.isdigit() or (seq := int(seq_str)) > self._seq:
+            return None
+        if seq < self._seq and (not self._changes or self._changes[0][0] > seq + 1):
+            return None  # some changes since the token have already been dropped from the journal
+
+        first_changes: dict[str, str] = {}
+        latest: dict[str, DropBoxChange] = {}
+        for change_seq, change in self._changes:
+            if change_seq <= seq:
+                continue
+            path = change["relativePath"]
+            first_changes.setdefault(path, change["change"])
+            latest.pop(path, None)  # re-insert, so files are ordered by their last change
+            latest[path] = change
+
+        changes: list[DropBoxChange] = []
+        for path, change in latest.items():
+            first = first_changes[path]
+            if change["change"] == "removed":
+                if first != "added":  # files both added and removed since the token were never seen by the client
+                    changes.append(change)
+            elif first == "added":
+                changes.append({**change, "change": "added"})
+            elif first == "removed":
+                changes.append({**change, "change": "modified"})  # replaced
+            else:
+                changes.append(change)
+        return changes
+
+    async def detect(self, entries: AsyncIterator[DropBoxEntry]) -> int:
+        """
+        Diffs a full listing of the tree (e.g., from iter_directory_entries) against the last known state of each file,
+        recording changes. Files changed by the service itself while listing are left to what was recorded for them.
+        The first pass only sets the baseline. Returns the number of changes detected.
+        """
+
+        start_seq = self._seq
+        listed: dict[str, DropBoxEntry] = {}
+        async for entry in entries:
+            if "uri" in entry:  # files only; directories are implied by file paths
+                listed[_path_key(entry["relativePath"])] = entry
+
+        if self._files is None:
+            self._files = {path: (e["size"], e["lastModified"]) for path, e in listed.items()}
+            return 0
+
+        recorded_meanwhile = {
+            _path_key(change["relativePath"]) for change_seq, change in self._changes if change_seq > start_seq
+        }
+        n_changes = 0
+
+        for path in [p for p in self._files if p not in listed and p not in recorded_meanwhile]:
+            self.record_removed(path)
+            n_changes += 1
+
+        for path, entry in listed.items():
+            if path in recorded_meanwhile:
+                continue
+            if self._files.get(path) != (entry["size"], entry["lastModified"]):
+                self.record_file(entry)
+                n_changes += 1
+
+        return n_changes
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Literal
+
+__all__ = [
+    "ChecksumAlgorithm",
+    "Checksums",
+    "ChecksumHasher",
+    "ChecksumCache",
+    "repr_digest_header",
+]
+
+ChecksumAlgorithm = Literal["md5", "sha1", "sha256", "sha512"]
+Checksums = dict[str, str]  # algorithm -> hexadecimal digest
+
+# Names of the algorithms in the HTTP digest algorithm registry (RFC 9530)
+_HTTP_DIGEST_ALGORITHMS: dict[str, str] = {"md5": "md5", "sha1": "sha", "sha256": "sha-256", "sha512": "sha-512"}
+
+
+class ChecksumHasher:
+    """
+    Computes the checksums of a stream for several algorithms in a single pass. hashlib releases the GIL while hashing
+    large buffers, so updates can be run in worker threads without holding up the event loop.
+    """
+
+    def __init__(self, algorithms: Iterable[str]):
+        self._hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def update(self, data: bytes | bytearray | memoryview) -> None:
+        for h in self._hashes.values():
+            h.update(data)
+
+    def hexdigests(self) -> Checksums:
+        return {algorithm: h.hexdigest() for algorithm, h in self._hashes.items()}
+
+
+def repr_digest_header(checksums: Checksums) -> str:
+    """
+    Formats checksums as a Repr-Digest header value (RFC 9530), e.g. sha-256=:<base64 digest>:
+    """
+    return ", ".join(
+        f"{_HTTP_DIGEST_ALGORITHMS[algorithm]}=:{base64.b64encode(bytes.fromhex(digest)).decode('ascii')}:"
+        for algorithm, digest in checksums.items()
+    )
+
+
+class ChecksumCache:
+    """
+    Bounded LRU cache of file checksums, keyed by path relative to the root of the drop box (without a leading slash).
+    Each entry is only valid for the size and modification time the file had when its checksums were computed, so
+    checksums of a file which has been modified since are never returned.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[int, float, Checksums]] = OrderedDict()
+
+    def get(self, path: str, size: int, last_modified: float) -> Checksums | None:
+        if (entry := self._entries.get(path)) is None:
+            return None
+        entry_size, entry_last_modified, checksums = entry
+        # (entries may be looked up from worker threads too, so they may be gone by now)
+        if entry_size != size or entry_last_modified != last_modified:
+            self._entries.pop(path, None)
+            return None
+        try:
+            self._entries.move_to_end(path)
+        except KeyError:
+            pass
+        return checksums
+
+    def put(self, path: str, size: int, last_modified: float, checksums: Checksums) -> None:
+        self._entries[path] = (size, last_modified, checksums)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, path: str) -> None:
+        self._entries.pop(path, None)
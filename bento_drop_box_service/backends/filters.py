@@ -0,0 +1,94 @@
+from .predicates import MetadataPredicates, compile_globs, glob_literal_prefixes, is_glob, narrow_listing_prefix
+
+__all__ = [
+    "TreeFilter",
+]
+
+
+class TreeFilter(MetadataPredicates):
+    """
+    Directory tree filter, compiled once per request. Include and ignore patterns containing glob characters (*, ? or
+    [) are matched against the entry's path relative to the root of the drop box (without a leading slash; * also
+    matches /), and other patterns are file name suffixes (e.g., .vcf.gz). A file passes the filter if it matches any
+    include pattern (if there are any), no ignore pattern, and the metadata predicates (see MetadataPredicates).
+
+    Directories are only part of a filtered tree if something inside them passes the filter. Backends can also skip
+    listing directories altogether when nothing inside them could pass (see skips_directory): directories outside the
+    literal start of every include glob (if there are only include globs), or matching an ignore glob of the form
+    "<directory pattern>/*".
+    """
+
+    def __init__(
+        self,
+        include: list[str] | None = None,
+        ignore: list[str] | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+    ):
+        super().__init__(min_size, max_size, modified_after, modified_before)
+        self.include = tuple(include or ())
+        self.ignore = tuple(ignore or ())
+
+        include_globs = tuple(p.lstrip("/") for p in self.include if is_glob(p))
+        ignore_globs = tuple(p.lstrip("/") for p in self.ignore if is_glob(p))
+
+        # Suffixes are matched all at once with str.endswith, globs with a single combined regular expression each
+        self._include_suffixes = tuple(p for p in self.include if not is_glob(p))
+        self._include_re = compile_globs(include_globs)
+        self._ignore_suffixes = tuple(p for p in self.ignore if not is_glob(p))
+        self._ignore_re = compile_globs(ignore_globs)
+
+        # Every path passing include globs starts with the literal start of one of them; with any include suffix, a
+        # file could pass from anywhere in the tree, so directories can't be skipped on that basis.
+        self._include_prefixes = (
+            glob_literal_prefixes(include_globs) if include_globs and not self._include_suffixes else None
+        )
+        # Everything inside a directory matching the directory part of a "<directory pattern>/*" ignore glob is ignored
+        self._ignore_directory_re = compile_globs(g[:-2] for g in ignore_globs if g.endswith("/*"))
+
+    def __bool__(self) -> bool:
+        # False for a filter letting everything through, so "if filters:" works for both None and empty filters
+        return bool(self.include or self.ignore or self.has_metadata_predicates)
+
+    @property
+    def key(self) -> tuple:
+        """Hashable representation of the filter, e.g. for caching filtered trees."""
+        return self.include, self.ignore, *self.metadata_key
+
+    def matches_path(self, path: str) -> bool:
+        """
+        Checks a file's path (relative to the root of the drop box, without a leading slash) against the include and
+        ignore patterns. Done before the metadata predicates, so files failing it don't need to be stat-ed.
+        """
+        return (
+            not self.include
+            or (self._include_suffixes and path.endswith(self._include_suffixes))
+            or (self._include_re is not None and self._include_re.match(path) is not None)
+        ) and not (
+            (self._ignore_suffixes and path.endswith(self._ignore_suffixes))
+            or (self._ignore_re is not None and self._ignore_re.match(path) is not None)
+        )
+
+    def skips_directory(self, path: str) -> bool:
+        """
+        Whether nothing inside a directory (path relative to the root of the drop box, without leading or trailing
+        slashes) can pass the filter, so that it does not need to be listed at all.
+        """
+
+        if self._include_prefixes is not None:
+            directory_prefix = f"{path}/"
+            if not any(
+                p.startswith(directory_prefix) or directory_prefix.startswith(p) for p in self._include_prefixes
+            ):
+                return True
+        return self._ignore_directory_re is not None and self._ignore_directory_re.match(path) is not None
+
+    def listing_prefix(self, prefix: str) -> str | None:
+        """
+        Narrows a key prefix to list (for backends listing keys by prefix) to the longest one which every file passing
+        the include globs must have. None if nothing under the prefix can pass.
+        """
+
+        return narrow_listing_prefix(prefix, self._include_prefixes or ())
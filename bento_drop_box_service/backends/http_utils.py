@@ -0,0 +1,139 @@
+from collections.abc import Callable, Mapping, Sequence
+from datetime import UTC, datetime
+from email.utils import format_datetime, parsedate
+
+from starlette.responses import MalformedRangeHeader, RangeNotSatisfiable
+
+__all__ = [
+    "MAX_RANGES",
+    "http_date",
+    "is_not_modified",
+    "should_use_range",
+    "parse_range_header",
+    "multipart_byteranges",
+]
+
+# Same limit as Starlette's FileResponse; past this many ranges, the whole object is sent instead.
+MAX_RANGES = 100
+
+
+def http_date(dt: datetime) -> str:
+    """Formats a datetime as an HTTP-date (RFC 9110), e.g. 'Sun, 06 Nov 1994 08:49:37 GMT'."""
+    return format_datetime(dt.astimezone(UTC), usegmt=True)
+
+
+def is_not_modified(response_headers: Mapping[str, str], request_headers: Mapping[str, str]) -> bool:
+    """
+    Given the response and request headers, returns True if a 304 Not Modified response can be sent instead.
+    If-None-Match takes precedence over If-Modified-Since, matching Starlette's StaticFiles behaviour.
+    """
+
+    if if_none_match := request_headers.get("if-none-match"):
+        if if_none_match.strip() == "*":
+            return True
+        if (etag := response_headers.get("etag")) is None:
+            return False
+        return etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("last-modified")
+    if if_modified_since and last_modified:
+        if_modified_since_date = parsedate(if_modified_since)
+        last_modified_date = parsedate(last_modified)
+        if if_modified_since_date is not None and last_modified_date is not None:
+            return if_modified_since_date >= last_modified_date
+
+    return False
+
+
+def should_use_range(if_range: str | None, response_headers: Mapping[str, str]) -> bool:
+    """
+    Returns whether a Range header should be honoured given the request's If-Range header (if any): ranges only apply
+    if If-Range strongly matches the current ETag or Last-Modified value. Otherwise, the full object is sent.
+    """
+    if if_range is None:
+        return True
+    if if_range.startswith("W/"):
+        return False
+    return if_range in (response_headers.get("etag"), response_headers.get("last-modified"))
+
+
+def parse_range_header(http_range: str, size: int) -> list[tuple[int, int]]:
+    """
+    Parses a Range header into a list of [start, end) byte ranges, with overlapping ranges merged. Follows the same
+    rules as Starlette's FileResponse, so both backends respond to ranges in the same way:
+     - raises MalformedRangeHeader (-> 400) for non-byte units, no valid ranges, or ranges with start >= end;
+     - raises RangeNotSatisfiable (-> 416) if any range starts past the end of the object;
+     - returns an empty list (-> send the whole object) if more than MAX_RANGES ranges are requested.
+    """
+
+    try:
+        units, range_ = http_range.split("=", 1)
+    except ValueError:
+        raise MalformedRangeHeader()
+
+    if units.strip().lower() != "bytes":
+        raise MalformedRangeHeader("Only support bytes range")
+
+    if range_.count(",") + 1 > MAX_RANGES:
+        return []
+
+    ranges: list[tuple[int, int]] = []
+
+    for part in range_.split(","):
+        start_str, sep, end_str = part.strip().partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+
+        if not sep or not (start_str or end_str):
+            # Empty ranges, single dashes, and ranges without a dash are ignored
+            continue
+
+        try:
+            start = int(start_str) if start_str else max(size - int(end_str), 0)
+            end = int(end_str) + 1 if start_str and end_str and int(end_str) < size else size
+        except ValueError:
+            # Non-numeric ranges are ignored
+            continue
+
+        ranges.append((start, end))
+
+    if not ranges:
+        raise MalformedRangeHeader("Range header: range must be requested")
+
+    if any(not (0 <= start < size) for start, _ in ranges):
+        raise RangeNotSatisfiable(size)
+
+    if any(start >= end for start, end in ranges):
+        raise MalformedRangeHeader("Range header: start must be less than end")
+
+    # Merge overlapping ranges
+    ranges.sort()
+    merged: list[tuple[int, int]] = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def multipart_byteranges(
+    ranges: Sequence[tuple[int, int]], boundary: str, size: int, content_type: str
+) -> tuple[int, Callable[[int, int], bytes]]:
+    """
+    Returns the total Content-Length of a multipart/byteranges body for the given ranges, along with a function which
+    generates the part header preceding each range's content. Each range's content must be followed by CRLF, and the
+    body must end with --{boundary}--.
+    """
+
+    def _part_header(start: int, end: int) -> bytes:
+        return (
+            f"--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n\r\n"
+        ).encode("latin-1")
+
+    content_length = sum(len(_part_header(start, end)) + (end - start) + 2 for start, end in ranges)
+    content_length += len(boundary) + 4
+
+    return content_length, _part_header
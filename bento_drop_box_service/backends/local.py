@@ -1,100 +1,295 @@
+import asyncio
+import contextlib
+import logging
 import os
 import pathlib
+import re
+import shutil
+import stat
+import time
+import uuid
+from collections.abc import AsyncIterator
+from typing import NamedTuple
 
 import aiofiles
 import aiofiles.os
 import aiofiles.ospath
+import orjson
 from fastapi import status
 from fastapi.exceptions import HTTPException
 from fastapi.requests import Request
 from fastapi.responses import FileResponse
 from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse
 from werkzeug.utils import secure_filename
 
-from .base import DropBoxBackend, DropBoxEntry
+from ..config import Config
+from .base import DeleteResult, DropBoxBackend, DropBoxEntry, UploadSession
+from .checksums import ChecksumHasher, Checksums, repr_digest_header
+from .filters import TreeFilter
+from .http_utils import is_not_modified
+from .local_index import IndexedEntry, LocalMetadataIndex
+from .search import SearchQuery
+from .tree_cache import DirectoryMTimes, DirectoryTreeCache, TreeCacheKey
+
+UPLOAD_STAGING_DIR = ".uploads"
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# Extended attribute holding a file's checksums, along with the size and modification time they were computed for
+CHECKSUMS_XATTR = "user.bento_drop_box.checksums"
+
+
+class _ScannedEntry(NamedTuple):
+    name: str
+    is_directory: bool
+    stat: os.stat_result | None  # only populated for file entries
 
 
 class LocalBackend(DropBoxBackend):
+    def __init__(self, config: Config, logger: logging.Logger):
+        super().__init__(config, logger)
+        self._tree_cache = DirectoryTreeCache(config.tree_cache_size, config.tree_cache_staleness)
+        # Caps the number of directory scans (i.e., worker threads doing filesystem metadata calls) in flight at once
+        self._scan_semaphore = asyncio.Semaphore(config.traversal_concurrency)
+
+        # Optional persistent metadata index; until it has been built once, requests are served from the filesystem
+        self._index = LocalMetadataIndex(config.local_index_path) if config.local_index_path else None
+        self._index_ready = False
+        self._index_lock = asyncio.Lock()  # one reconciliation pass at a time
+        self._index_reconciled_at: float | None = None
+        self._index_task: asyncio.Task | None = None
+
+    async def startup(self) -> None:
+        if self._index is None:
+            return
+        await asyncio.to_thread(self._index.open)
+        # An index left by a previous run is served right away, while it is reconciled with changes made since
+        self._index_ready = not await asyncio.to_thread(self._index.is_empty)
+        self._index_task = asyncio.create_task(self._maintain_index())
+
+    async def shutdown(self) -> None:
+        if self._index_task is not None:
+            self._index_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._index_task
+            self._index_task = None
+        if self._index is not None:
+            async with self._index_lock:
+                await asyncio.to_thread(self._index.close)
+            self._index_ready = False
+
+    def _scan_directory(
+        self,
+        current_dir: pathlib.Path,
+        relative_dir: str = "",
+        filters: TreeFilter | None = None,
+        directory_mtimes: DirectoryMTimes | None = None,
+    ) -> list[_ScannedEntry]:
+        """
+        Synchronously scans a single directory, returning the entries which should be part of the directory tree.
+        The entry type comes from the cached DirEntry data, and file stats are collected in the same pass, so the whole
+        directory costs a single executor round trip when called through asyncio.to_thread.
+        Filters are applied as entries are scanned (relative_dir being the directory's path relative to the root of the
+        drop box): directories nothing in which could pass are left out, and files are only stat-ed if their path does.
+        If directory_mtimes is passed, the directory's modification time is recorded in it for cache validation.
+        """
+
+        scanned: list[_ScannedEntry] = []
+
+        if directory_mtimes is not None:
+            # Stat before scanning, so a change made mid-scan shows up as a changed mtime later on
+            directory_mtimes[str(current_dir)] = os.stat(current_dir).st_mtime_ns
+
+        path_prefix = f"{relative_dir}/" if relative_dir else ""
+
+        with os.scandir(current_dir) as it:
+            for dir_entry in it:
+                entry_name = dir_entry.name
+
+                if entry_name[0] == ".":
+                    # skip dotfiles & hidden directories
+                    continue
+
+                if "/" in entry_name:
+                    self.logger.warning(f"Skipped entry with a '/' in its name: {entry_name}")
+                    continue
+
+                if dir_entry.is_dir():
+                    if not (filters and filters.skips_directory(path_prefix + entry_name)):
+                        scanned.append(_ScannedEntry(entry_name, True, None))
+                    continue
+
+                if filters and not filters.matches_path(path_prefix + entry_name):
+                    # Filtered-out files don't need to be stat-ed at all
+                    continue
+
+                try:
+                    entry_stat = dir_entry.stat()
+                except FileNotFoundError:  # e.g., a broken symlink or a file removed mid-scan
+                    self.logger.warning(f"Skipped entry which could not be stat-ed: {entry_name}")
+                    continue
+
+                if filters and not filters.matches_metadata(entry_stat.st_size, entry_stat.st_mtime):
+                    continue
+
+                scanned.append(_ScannedEntry(entry_name, False, entry_stat))
+
+        scanned.sort(key=lambda e: e.name)
+
+        return scanned
+
+    async def _scan(
+        self,
+        current_dir: pathlib.Path,
+        relative_dir: str,
+        filters: TreeFilter | None,
+        directory_mtimes: DirectoryMTimes | None = None,
+    ) -> list[_ScannedEntry]:
+        async with self._scan_semaphore:
+            return await asyncio.to_thread(self._scan_directory, current_dir, relative_dir, filters, directory_mtimes)
+
+    def _make_entry(self, current_dir: pathlib.Path, sub_path_str: str, scanned: _ScannedEntry) -> DropBoxEntry:
+        """
+        Creates a directory tree entry (without contents, for directories) from a scanned directory entry.
+        """
+
+        entry_name = scanned.name
+        relative_path = (f"/{sub_path_str}" if sub_path_str else "") + f"/{entry_name}"
+
+        # info for all entries
+        entry: DropBoxEntry = {
+            "name": entry_name,
+            "filePath": str(current_dir / entry_name),  # Actual path on file system
+            "relativePath": relative_path,  # Path relative to root of drop box (/)
+        }
+
+        if not scanned.is_directory:  # file entry
+            entry_path_stat = scanned.stat
+            entry.update(
+                {
+                    "size": entry_path_stat.st_size,
+                    "lastModified": entry_path_stat.st_mtime,
+                    "lastMetadataChange": entry_path_stat.st_ctime,
+                    "uri": self.config.service_url_base_path + f"/objects{relative_path}",
+                }
+            )
+            self._add_checksums(entry)
+
+        return entry
+
     async def _get_directory_tree(
         self,
         root_path: pathlib.Path,
         sub_path: tuple[str, ...],
         level: int = 0,
-        ignore: list[str] | None = None,
-        include: list[str] | None = None,
+        filters: TreeFilter | None = None,
+        directory_mtimes: DirectoryMTimes | None = None,
+        depth: int | None = None,
     ) -> list[DropBoxEntry]:
-        self.validate_filters(include, ignore)
-
         traversal_limit = self.config.traversal_limit
 
+        if level > traversal_limit:
+            # Check the limit before listing, so we don't scan directories whose contents would be discarded anyway
+            self.logger.warning(f"Exceeded traversal limit of {traversal_limit} generating directory tree")
+            return []
+
         root_path = root_path.absolute()
-        entries: list[DropBoxEntry] = []
         sub_path_str: str = "/".join(sub_path)
         current_dir = (root_path / sub_path_str).absolute() if sub_path_str else root_path.absolute()
 
-        for entry_name in await aiofiles.os.listdir(current_dir):
-            entry_path = current_dir / entry_name
-            relative_path = (f"/{sub_path_str}" if sub_path_str else "") + f"/{entry_name}"
+        scanned_entries = await self._scan(current_dir, sub_path_str, filters, directory_mtimes)
+        entries = [self._make_entry(current_dir, sub_path_str, scanned) for scanned in scanned_entries]
+        directories = [entry for entry, scanned in zip(entries, scanned_entries, strict=True) if scanned.is_directory]
 
-            if level > traversal_limit:
-                self.logger.warning(f"Exceeded traversal limit of {traversal_limit} generating directory tree")
-                continue
+        # recurse if directory (and not past the requested depth, if any)
+        if depth is not None and level + 1 >= depth:
+            for entry in directories:
+                entry["contents"] = []
+                entry["truncated"] = True
+        elif directories:
+            # Sibling directories are walked concurrently; the number of directory scans in flight at once is capped by
+            # the traversal_concurrency semaphore. Results are assigned in scan order, so the output stays sorted.
+            contents = await asyncio.gather(
+                *(
+                    self._get_directory_tree(
+                        root_path,
+                        (*sub_path, entry["name"]),
+                        level=level + 1,
+                        filters=filters,
+                        directory_mtimes=directory_mtimes,
+                        depth=depth,
+                    )
+                    for entry in directories
+                )
+            )
+            for entry, entry_contents in zip(directories, contents, strict=True):
+                entry["contents"] = entry_contents
 
-            if entry_name[0] == ".":
-                # skip dotfiles & hidden directories
-                continue
+            if filters:
+                # if filtering, skip empty directories
+                entries = [entry for entry in entries if "contents" not in entry or entry["contents"]]
 
-            if "/" in entry_name:
-                self.logger.warning(f"Skipped entry with a '/' in its name: {entry_name}")
-                continue
+        return entries
 
-            is_directory = await aiofiles.ospath.isdir(entry_path)
+    def _tree_from_index(self, sub_path: str, filters: TreeFilter | None) -> tuple[DropBoxEntry, ...] | None:
+        """
+        Synchronously builds a directory tree from the metadata index, with the same shape, ordering and limits as one
+        built from the filesystem. Returns None if the index can't answer (e.g., for a sub path which isn't indexed).
+        """
 
-            if not (is_directory or self.is_passing_filter(entry_name, include, ignore)):
-                # If neither of these conditions is true, we should skip this entry in the tree
-                continue
+        traversal_limit = self.config.traversal_limit
+        base_depth = sub_path.count("/") + 1 if sub_path else 0
 
-            # info for all entries
-            entry: DropBoxEntry = {
-                "name": entry_name,
-                "filePath": str(entry_path),  # Actual path on file system
-                "relativePath": relative_path,  # Path relative to root of drop box (/)
-            }
+        if sub_path and ((node := self._index.get(sub_path)) is None or not node.is_directory):
+            return None
 
-            # recurse if directory
-            if is_directory:
-                entry["contents"] = await self._get_directory_tree(
-                    root_path, (*sub_path, entry_name), level=level + 1, ignore=ignore, include=include
-                )
+        # Only directories down to the traversal limit (counted from the root) are indexed, so deeper sub trees need to
+        # be walked on the filesystem - if there is anything down there at all.
+        max_depth = base_depth + traversal_limit + 1
+        if max_depth > traversal_limit + 1 and self._index.has_directories_at_depth(sub_path, traversal_limit + 1):
+            return None
 
-                # if using ignore or include, skip empty directories
-                if not entry["contents"] and bool(ignore or include):
-                    continue
+        root_path = self._get_root_path().absolute()
+        contents: dict[str, list[DropBoxEntry]] = {sub_path: []}
 
-            # else file entry
-            else:
-                entry_path_stat = await aiofiles.os.stat(entry_path)
+        # Rows come ordered by parent and then by name, so each directory's contents end up sorted like in a scan
+        for row in self._index.subtree(sub_path, max_depth):
+            relative_path = f"/{row.path}"
+            entry: DropBoxEntry = {
+                "name": row.name,
+                "filePath": str(root_path / row.path),
+                "relativePath": relative_path,
+            }
+            if row.is_directory:
+                if filters and filters.skips_directory(row.path):
+                    continue  # its descendants are left out too, since they are never attached to the tree
+                entry["contents"] = contents.setdefault(row.path, [])
+            elif not filters or (
+                filters.matches_path(row.path) and filters.matches_metadata(row.size, row.last_modified)
+            ):
                 entry.update(
                     {
-                        "size": entry_path_stat.st_size,
-                        "lastModified": entry_path_stat.st_mtime,
-                        "lastMetadataChange": entry_path_stat.st_ctime,
+                        "size": row.size,
+                        "lastModified": row.last_modified,
+                        "lastMetadataChange": row.last_metadata_change,
                         "uri": self.config.service_url_base_path + f"/objects{relative_path}",
                     }
                 )
+                self._add_checksums(entry)
+            else:
+                continue
+            contents.setdefault(row.parent, []).append(entry)
 
-            entries.append(entry)
-
-        entries.sort(key=lambda e: e["name"])
+        def _prune(entries: list[DropBoxEntry]) -> list[DropBoxEntry]:
+            # if filtering, skip empty directories
+            for entry in entries:
+                if "contents" in entry:
+                    entry["contents"] = _prune(entry["contents"])
+            return [entry for entry in entries if "contents" not in entry or entry["contents"]]
 
-        return entries
+        tree = contents[sub_path]
+        return tuple(_prune(tree) if filters else tree)
 
-    async def get_directory_tree(
-        self,
-        sub_path: str | None = None,
-        ignore: list[str] | None = None,
-        include: list[str] | None = None,
-    ) -> tuple[DropBoxEntry, ...]:
+    def _get_root_path(self) -> pathlib.Path:
         root_path: pathlib.Path = pathlib.Path(self.config.service_data)
 
         if not str(root_path.absolute()).startswith(self.config.service_data):
@@ -102,82 +297,980 @@ class LocalBackend(DropBoxBackend):
             self.logger.warning(f"attempted to get directory tree outside of drop box data volume: {root_path}")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot inspect provided sub tree")
 
-        return tuple(
-            await self._get_directory_tree(
-                root_path,
-                tuple(sub_path.split("/")) if sub_path else (),
-                include=include,
-                ignore=ignore,
+        return root_path
+
+    async def _resolve_sub_path(self, root_path: pathlib.Path, sub_path: str | None) -> tuple[str, ...]:
+        """
+        Splits a directory tree sub-path into its components, checking that it is a directory which is part of the
+        tree, with the same visibility rules as for single nodes: empty components, "." / ".." and hidden directories
+        are not found, and the path must stay under the root of the drop box (symlinks are followed, like in the tree).
+        """
+
+        sub_path_parts = tuple(sub_path.strip("/").split("/")) if sub_path and sub_path.strip("/") else ()
+        not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No directory found at specified path")
+
+        if any(not part or part[0] == "." for part in sub_path_parts):
+            raise not_found
+
+        sub_dir = root_path.joinpath(*sub_path_parts).absolute()
+        if not sub_dir.is_relative_to(root_path.absolute()):  # pragma: no cover (ruled out by the component check)
+            self.logger.warning(f"attempted to get directory tree outside of drop box: {sub_dir}")
+            raise not_found
+        if not await aiofiles.ospath.isdir(sub_dir):
+            raise not_found
+
+        return sub_path_parts
+
+    async def get_directory_tree(
+        self,
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> tuple[DropBoxEntry, ...]:
+        root_path = self._get_root_path()
+        sub_path_parts = await self._resolve_sub_path(root_path, sub_path)
+
+        if self._index_ready:
+            # The index is kept up to date on its own, so its trees bypass the (mtime-validated) tree cache
+            tree = await asyncio.to_thread(self._tree_from_index, "/".join(sub_path_parts), filters)
+            if tree is not None:
+                return tree
+
+        async def _build(directory_mtimes: DirectoryMTimes) -> tuple[DropBoxEntry, ...]:
+            return tuple(
+                await self._get_directory_tree(
+                    root_path,
+                    sub_path_parts,
+                    filters=filters,
+                    directory_mtimes=directory_mtimes,
+                )
+            )
+
+        return await self._tree_cache.get_or_build(self._tree_cache_key(sub_path, filters), _build)
+
+    @staticmethod
+    def _tree_cache_key(sub_path: str | None, filters: TreeFilter | None) -> TreeCacheKey:
+        return sub_path or "", filters.key if filters else ()
+
+    def get_tree_etag(
+        self,
+        tree: tuple[DropBoxEntry, ...],
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> str:
+        # Cached trees only have their ETag computed once
+        return self._tree_cache.get_etag(self._tree_cache_key(sub_path, filters), tree, self.tree_etag)
+
+    async def get_directory_listing(
+        self,
+        sub_path: str | None = None,
+        depth: int | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:
+        root_path = self._get_root_path().absolute()
+
+        sub_path_parts = await self._resolve_sub_path(root_path, sub_path)
+        sub_path_str = "/".join(sub_path_parts)
+        current_dir = root_path / sub_path_str if sub_path_str else root_path
+
+        # Only the requested directory is scanned; sub-directories are only scanned for entries on this page, and only
+        # down to the requested depth.
+        scanned_entries = await self._scan(current_dir, sub_path_str, filters)
+
+        if cursor is not None:
+            after_name, _ = self.decode_cursor(cursor)
+            scanned_entries = [e for e in scanned_entries if e.name > after_name]
+
+        has_more = limit is not None and len(scanned_entries) > limit
+        if limit is not None:
+            scanned_entries = scanned_entries[:limit]
+
+        entries = [self._make_entry(current_dir, sub_path_str, scanned) for scanned in scanned_entries]
+        directories = [entry for entry, scanned in zip(entries, scanned_entries, strict=True) if scanned.is_directory]
+
+        if depth is not None and depth <= 1:
+            for entry in directories:
+                entry["contents"] = []
+                entry["truncated"] = True
+        elif directories:
+            contents = await asyncio.gather(
+                *(
+                    self._get_directory_tree(
+                        root_path,
+                        (*sub_path_parts, entry["name"]),
+                        level=1,
+                        filters=filters,
+                        depth=depth,
+                    )
+                    for entry in directories
+                )
+            )
+            for entry, entry_contents in zip(directories, contents, strict=True):
+                entry["contents"] = entry_contents
+
+            if filters:
+                # if filtering, skip empty (fully-listed) directories, like in the full tree
+                entries = [entry for entry in entries if "contents" not in entry or entry["contents"]]
+
+        next_cursor = None
+        if has_more:
+            last = scanned_entries[-1]
+            next_cursor = self.encode_cursor(last.name, last.is_directory)
+
+        return tuple(entries), next_cursor
+
+    async def iter_directory_entries(
+        self,
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> AsyncIterator[DropBoxEntry]:
+        root_path = self._get_root_path().absolute()
+        sub_path_parts = await self._resolve_sub_path(root_path, sub_path)
+
+        traversal_limit = self.config.traversal_limit
+        filtering = bool(filters)
+
+        # When filtering, empty directories are left out of the tree, so directory entries are held back until a file
+        # inside them passes the filter. This is a stack of the current directory's not-yet-emitted ancestors.
+        pending_directories: list[DropBoxEntry] = []
+
+        async def _walk(sub_path_parts: tuple[str, ...], level: int) -> AsyncIterator[DropBoxEntry]:
+            if level > traversal_limit:
+                self.logger.warning(f"Exceeded traversal limit of {traversal_limit} generating directory tree")
+                return
+
+            sub_path_str = "/".join(sub_path_parts)
+            current_dir = root_path / sub_path_str if sub_path_str else root_path
+
+            for scanned in await self._scan(current_dir, sub_path_str, filters):
+                entry = self._make_entry(current_dir, sub_path_str, scanned)
+
+                if not scanned.is_directory:
+                    for directory_entry in pending_directories:
+                        yield directory_entry
+                    pending_directories.clear()
+                    yield entry
+                    continue
+
+                if filtering:
+                    pending_directories.append(entry)
+                else:
+                    yield entry
+
+                async for child_entry in _walk((*sub_path_parts, scanned.name), level + 1):
+                    yield child_entry
+
+                if pending_directories and pending_directories[-1] is entry:
+                    # Nothing in this directory passed the filter
+                    pending_directories.pop()
+
+        async for e in _walk(sub_path_parts, 0):
+            yield e
+
+    def _search_index(self, query: SearchQuery, prefix: str, after: str, limit: int) -> list[DropBoxEntry]:
+        """
+        Synchronously searches the metadata index, fetching candidate files in batches until limit + 1 files match.
+        """
+
+        root_path = self._get_root_path().absolute()
+        batch_size = max(limit + 1, 1000)
+        results: list[DropBoxEntry] = []
+
+        while True:
+            rows = self._index.search_files(query, prefix, after, batch_size)
+            for row in rows:
+                if query.matches(row.path, row.size, row.last_modified):
+                    results.append(self._indexed_file_entry(root_path, row))
+                    if len(results) > limit:
+                        return results
+            if len(rows) < batch_size:
+                return results
+            after = rows[-1].path
+
+    def _search_directories(self, query: SearchQuery, prefix: str, after: str, limit: int) -> list[DropBoxEntry]:
+        """
+        Synchronously walks the directories which could hold matching files, until limit + 1 files match. Entries are
+        visited in path order (i.e., with directories sorted as if their names ended with a slash), so the walk can
+        stop as soon as the page is full, and skip every directory sorting wholly before the cursor.
+        """
+
+        root_path = self._get_root_path().absolute()
+        traversal_limit = self.config.traversal_limit
+        results: list[DropBoxEntry] = []
+
+        start_parts = prefix.rpartition("/")[0].split("/") if "/" in prefix else []
+        if any(not part or part[0] == "." for part in start_parts):
+            return results  # hidden directories are never part of the tree
+
+        def _walk(dir_path: str, level: int) -> bool:
+            if level > traversal_limit:
+                return False
+
+            current_dir = root_path / dir_path if dir_path else root_path
+            try:
+                scanned_entries = self._scan_directory(current_dir)
+            except (FileNotFoundError, NotADirectoryError):
+                return False
+
+            path_prefix = f"{dir_path}/" if dir_path else ""
+            for scanned in sorted(scanned_entries, key=lambda e: f"{e.name}/" if e.is_directory else e.name):
+                path = path_prefix + scanned.name
+                if scanned.is_directory:
+                    directory_prefix = f"{path}/"
+                    if not (directory_prefix.startswith(prefix) or prefix.startswith(directory_prefix)):
+                        continue  # nothing in here can have the prefix
+                    if directory_prefix < after and not after.startswith(directory_prefix):
+                        continue  # everything in here sorts before the cursor
+                    if _walk(path, level + 1):
+                        return True
+                elif (
+                    path > after
+                    and path.startswith(prefix)
+                    and query.matches(path, scanned.stat.st_size, scanned.stat.st_mtime)
+                ):
+                    results.append(self._make_entry(current_dir, dir_path, scanned))
+                    if len(results) > limit:
+                        return True
+
+            return False
+
+        _walk("/".join(start_parts), len(start_parts))
+        return results
+
+    async def search(
+        self, query: SearchQuery, limit: int, cursor: str | None = None
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:
+        after = self.decode_cursor(cursor)[0] if cursor is not None else ""
+
+        if (prefix := query.listing_prefix) is None:
+            return (), None
+
+        search_fn = self._search_index if self._index_ready else self._search_directories
+        async with self._scan_semaphore:
+            results = await asyncio.to_thread(search_fn, query, prefix, after, limit)
+
+        if len(results) > limit:
+            return tuple(results[:limit]), self.encode_cursor(results[limit - 1]["relativePath"].lstrip("/"), False)
+        return tuple(results), None
+
+    async def _read_file_chunks(self, file_path: str) -> AsyncIterator[bytes]:
+        chunk_size = self.config.archive_chunk_size
+        async with aiofiles.open(file_path, "rb") as f:
+            while chunk := await f.read(chunk_size):
+                yield chunk
+
+    async def iter_file_contents(
+        self, entries: AsyncIterator[DropBoxEntry]
+    ) -> AsyncIterator[tuple[DropBoxEntry, AsyncIterator[bytes] | None]]:
+        async for entry in entries:
+            yield entry, (self._read_file_chunks(entry["filePath"]) if "uri" in entry else None)
+
+    def _reconcile_index(self, modified_since: float | None) -> int:
+        """
+        Synchronously brings the metadata index in line with the filesystem: directories whose mtime changed since they
+        were last scanned are re-scanned (and new directories scanned in turn), and files which were recently modified
+        as of when they were indexed are re-stat-ed, since writing to a file doesn't change its directory's mtime.
+        Returns the number of directories scanned.
+        """
+
+        root_path = pathlib.Path(self.config.service_data).absolute()
+        traversal_limit = self.config.traversal_limit
+
+        # Directories past the traversal limit are indexed as entries, but never listed, like in the directory tree
+        to_scan: list[str] = []
+        indexed_directories = self._index.directories()
+        for path, indexed_mtime_ns in indexed_directories or [("", None)]:
+            if path.count("/") + 1 > traversal_limit and path:
+                continue
+            try:
+                directory_stat = os.stat(root_path / path)
+            except (FileNotFoundError, NotADirectoryError):
+                self._index.remove(path)  # the parent's scan will pick up whatever replaced it, if anything
+                continue
+            if directory_stat.st_mtime_ns != indexed_mtime_ns:
+                to_scan.append(path)
+
+        n_scanned = 0
+        while to_scan:
+            path = to_scan.pop()
+            directory = root_path / path
+            directory_mtimes: DirectoryMTimes = {}
+            try:
+                scanned_entries = self._scan_directory(directory, directory_mtimes=directory_mtimes)
+            except (FileNotFoundError, NotADirectoryError):
+                if not path:
+                    raise
+                self._index.remove(path)
+                continue
+            new_directories = self._index.replace_directory(
+                path,
+                directory_mtimes[str(directory)],
+                [(e.name, e.stat) for e in scanned_entries if not e.is_directory],
+                [e.name for e in scanned_entries if e.is_directory],
             )
+            to_scan.extend(d for d in new_directories if d.count("/") + 1 <= traversal_limit)
+            n_scanned += 1
+
+        if modified_since is not None:
+            for path in self._index.files_modified_since(modified_since):
+                try:
+                    self._index.put_file(path, os.stat(root_path / path))
+                except (FileNotFoundError, NotADirectoryError):
+                    self._index.remove(path)
+
+        return n_scanned
+
+    async def reconcile_index(self) -> int:
+        """
+        Runs a reconciliation pass over the metadata index (see _reconcile_index), after which the index is used to
+        serve requests. Returns the number of directories scanned.
+        """
+
+        async with self._index_lock:
+            started_at = time.time()
+            # Files modified shortly before the previous pass started may have been indexed mid-write
+            modified_since = self._index_reconciled_at
+            if modified_since is not None:
+                modified_since -= self.config.local_index_rescan_interval
+            n_scanned = await asyncio.to_thread(self._reconcile_index, modified_since)
+            self._index_reconciled_at = started_at
+            self._index_ready = True
+
+        return n_scanned
+
+    async def _maintain_index(self) -> None:
+        interval = self.config.local_index_rescan_interval
+        while True:
+            try:
+                start = time.perf_counter()
+                n_scanned = await self.reconcile_index()
+                self.logger.debug(
+                    f"Reconciled metadata index: scanned {n_scanned} directories in {time.perf_counter() - start:.3f}s"
+                )
+            except Exception:  # keep reconciling periodically, even if a single pass fails
+                self.logger.exception("Error reconciling metadata index")
+            await asyncio.sleep(interval)
+
+    def _tree_relative_path(self, file_path: str) -> str | None:
+        """
+        Returns the path of a file relative to the root of the drop box (without a leading slash, as in the metadata
+        index), or None if the file wouldn't be part of the tree.
+        """
+        path = os.path.relpath(file_path, os.path.realpath(self.config.service_data))
+        parts = path.split(os.sep)
+        if any(part.startswith(".") for part in parts) or len(parts) - 1 > self.config.traversal_limit:
+            return None
+        return "/".join(parts)
+
+    async def _record_upload(self, file_path: str, checksums: Checksums | None = None) -> None:
+        """
+        Records a newly-published file (with its checksums, if they were computed during the upload) in the checksum
+        cache, the metadata index (if enabled) and the change feed.
+        """
+
+        if (path := self._tree_relative_path(file_path)) is None:
+            return
+
+        try:
+            file_stat = await aiofiles.os.stat(file_path)
+            if checksums:
+                self._checksums.put(path, file_stat.st_size, file_stat.st_mtime, checksums)
+            if self._index is not None:
+                await asyncio.to_thread(self._index.put_file, path, file_stat)
+        except Exception:  # the next reconciliation pass / change detection will pick the file up
+            self.logger.exception(f"Error recording upload of {path}")
+            return
+
+        parent, _, name = path.rpartition("/")
+        root_path = pathlib.Path(self.config.service_data).absolute()
+        self._changes.record_file(
+            self._make_entry(root_path / parent if parent else root_path, parent, _ScannedEntry(name, False, file_stat))
         )
 
-    async def upload_to_path(self, request: Request, path: str, content_length: int) -> Response:
-        sd = self.config.service_data
+    async def _record_removal(self, relative_path: str) -> None:
+        self._checksums.discard(relative_path.strip("/"))
+        if self._index is not None:
+            await asyncio.to_thread(self._index.remove, relative_path.strip("/"))
+        self._changes.record_removed(relative_path)
+
+    async def _get_upload_path(self, path: str) -> str:
+        sd = os.path.realpath(self.config.service_data)
+
+        if any(part.startswith(".") for part in path.split("/")):
+            # Covers "." and "..", as well as hidden directories (e.g., resumable upload staging) which are never part
+            # of the tree and must not be writable through it.
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot upload to a hidden path")
 
-        # TODO: This might not be secure (ok for now due to permissions check)
         upload_path = os.path.realpath(os.path.join(sd, os.path.dirname(path), secure_filename(os.path.basename(path))))
-        if not (rp := os.path.realpath(os.path.join(sd, path))).startswith(os.path.realpath(sd)):
+        if os.path.commonpath((sd, upload_path)) != sd:
             # TODO: Mark against user
-            self.logger.warning(f"attempted upload to path outside of drop box: {rp}")
+            self.logger.warning(f"attempted upload to path outside of drop box: {upload_path}")
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot upload outside of the drop box")
 
         if await aiofiles.ospath.exists(upload_path):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot upload to an existing path")
 
+        return upload_path
+
+    @staticmethod
+    async def _make_upload_dirs(upload_path: str) -> None:
         try:
             await aiofiles.os.makedirs(os.path.dirname(upload_path), exist_ok=True)
         except FileNotFoundError:  # blank dirname
             pass
 
-        async with aiofiles.open(upload_path, "wb") as f:
-            async for chunk in request.stream():
-                await f.write(chunk)
+    async def upload_to_path(self, request: Request, path: str, content_length: int) -> Response:
+        upload_path = await self._get_upload_path(path)
+        await self._make_upload_dirs(upload_path)
+
+        # Write to a temporary dotfile next to the final path, so partial uploads are never visible in the tree or
+        # retrievable, and so the final rename stays on the same filesystem (and is therefore atomic).
+        upload_dir, upload_name = os.path.split(upload_path)
+        temp_path = os.path.join(upload_dir, f".{upload_name[:200]}.{uuid.uuid4().hex}.upload")  # stay under NAME_MAX
+
+        fd = await asyncio.to_thread(os.open, temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        published = False
+        hasher = self._new_checksum_hasher()
+        checksums: Checksums | None = None
+
+        try:
+            try:
+                bytes_received = await self._write_request_body(request, fd, content_length, hasher=hasher)
+
+                if bytes_received != content_length:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Received {bytes_received} bytes, but Content-Length was {content_length}",
+                    )
+
+                if hasher is not None:
+                    # Stored before publishing, so the file never appears without its checksums
+                    checksums = hasher.hexdigests()
+                    await asyncio.to_thread(self._write_checksums_xattr, fd, checksums)
+
+                if self.config.local_upload_fsync != "none":
+                    await asyncio.to_thread(os.fsync, fd)
+            finally:
+                await asyncio.to_thread(os.close, fd)
+
+            await asyncio.to_thread(self._publish_upload, temp_path, upload_path)
+            published = True
+            await self._record_upload(upload_path, checksums)
+        finally:
+            if not published:
+                with contextlib.suppress(FileNotFoundError):
+                    await aiofiles.os.remove(temp_path)
+            # Make new files visible to tree requests right away
+            self._tree_cache.clear()
 
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    async def get_node_at_path(self, path: str, verb: str = "retrieve") -> DropBoxEntry:
-        root_path: pathlib.Path = pathlib.Path(self.config.service_data).absolute()
-        directory_items: tuple[DropBoxEntry, ...] = await self.get_directory_tree()
+    @staticmethod
+    def _write_all(fd: int, data: bytes | bytearray, offset: int, hasher: ChecksumHasher | None = None) -> None:
+        if hasher is not None:
+            hasher.update(data)
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
 
-        # Manually crawl through the tree to only return items which are explicitly in the tree.
+    async def _write_request_body(
+        self, request: Request, fd: int, max_length: int, offset: int = 0, hasher: ChecksumHasher | None = None
+    ) -> int:
+        """
+        Writes a request body to a file descriptor starting at the given offset, coalescing ASGI chunks (typically
+        ~64 KB) into large buffers so there is one worker thread round trip per buffer rather than per chunk. While one
+        buffer is being written, the next one is filled from the request stream. Nothing past max_length bytes is ever
+        written. If a hasher is given, each buffer is also hashed in the worker thread writing it (buffers are written
+        one after the other, so they are hashed in order). Returns the number of bytes received.
+        """
 
-        # TODO: Deal with slashes in file names
-        path_parts: list[str] = path.removeprefix(str(root_path)).strip("/").split("/")
+        buffer_size = self.config.local_upload_buffer_size
+        buffer = bytearray()
+        bytes_received = 0
+        pending_write: asyncio.Future | None = None
 
-        while True:
-            part = path_parts[0]
-            path_parts = path_parts[1:]
+        def _check_length():
+            if bytes_received > max_length:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Received more than the expected {max_length} bytes",
+                )
+
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                bytes_received += len(chunk)
+                if len(buffer) >= buffer_size:
+                    _check_length()
+                    if pending_write is not None:
+                        await pending_write
+                    pending_write = asyncio.ensure_future(
+                        asyncio.to_thread(self._write_all, fd, buffer, offset + bytes_received - len(buffer), hasher)
+                    )
+                    buffer = bytearray()
+
+            _check_length()
+            if pending_write is not None:
+                await pending_write
+                pending_write = None
+            if buffer:
+                await asyncio.to_thread(self._write_all, fd, buffer, offset + bytes_received - len(buffer), hasher)
+        finally:
+            if pending_write is not None and not pending_write.done():
+                # Don't let the descriptor be closed while a write is still running on it
+                await asyncio.shield(asyncio.wait([pending_write]))
+
+        return bytes_received
+
+    def _write_checksums_xattr(
+        self, target: str | int, checksums: Checksums, expected: tuple[int, float] | None = None
+    ) -> None:
+        """
+        Stores checksums in an extended attribute of a file (given by path or open file descriptor), along with the
+        file's current size and modification time, unless the file no longer has the expected (size, mtime). On
+        filesystems (or platforms) without extended attribute support, checksums are only kept in memory.
+        """
+
+        try:
+            file_stat = os.stat(target)
+            if expected is not None and (file_stat.st_size, file_stat.st_mtime) != expected:
+                return  # modified since the checksums were computed
+            os.setxattr(
+                target,
+                CHECKSUMS_XATTR,
+                orjson.dumps({"size": file_stat.st_size, "mtimeNs": file_stat.st_mtime_ns, "checksums": checksums}),
+            )
+        except (OSError, AttributeError) as e:  # os.setxattr only exists on Linux
+            self.logger.debug(f"Could not store checksums in an extended attribute: {e!r}")
+
+    def _read_checksums_xattr(self, file_path: str, size: int, last_modified: float) -> Checksums | None:
+        """
+        Reads the checksums stored in a file's extended attribute, if the file still has the given size and
+        modification time, and the checksums were stored for that state of the file.
+        """
+
+        try:
+            file_stat = os.stat(file_path)
+            stored = orjson.loads(os.getxattr(file_path, CHECKSUMS_XATTR))
+        except (OSError, AttributeError, orjson.JSONDecodeError):  # no stored checksums, or no xattr support
+            return None
+
+        if (
+            (file_stat.st_size, file_stat.st_mtime) != (size, last_modified)
+            or not isinstance(stored, dict)
+            or (stored.get("size"), stored.get("mtimeNs")) != (file_stat.st_size, file_stat.st_mtime_ns)
+            or not isinstance(checksums := stored.get("checksums"), dict)
+        ):
+            return None
+        return self._configured_checksums(checksums)
+
+    async def _load_checksums(self, entry: DropBoxEntry) -> Checksums | None:
+        return await asyncio.to_thread(
+            self._read_checksums_xattr, entry["filePath"], entry["size"], entry["lastModified"]
+        )
+
+    async def _store_checksums(self, entry: DropBoxEntry, checksums: Checksums) -> None:
+        await asyncio.to_thread(
+            self._write_checksums_xattr, entry["filePath"], checksums, (entry["size"], entry["lastModified"])
+        )
 
-            if part not in {item["name"] for item in directory_items}:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+    async def update_checksums(self) -> int:
+        if n_updated := await super().update_checksums():
+            self._tree_cache.clear()  # cached trees don't have the new checksums
+        return n_updated
 
+    def _publish_upload(self, temp_path: str, upload_path: str) -> None:
+        """
+        Moves a fully-written temporary upload file to its final path, without ever overwriting an existing file.
+        """
+
+        existing_path_error = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot upload to an existing path"
+        )
+
+        try:
+            # link() fails instead of overwriting if something was created at the final path during the upload
+            os.link(temp_path, upload_path)
+        except FileExistsError:
+            raise existing_path_error
+        except OSError:
+            # Filesystem without hard link support; fall back to a (still atomic, but clobbering) rename
+            if os.path.lexists(upload_path):
+                raise existing_path_error
+            os.rename(temp_path, upload_path)
+        else:
+            os.unlink(temp_path)
+
+        if self.config.local_upload_fsync == "file_and_directory":
+            # Persist the new directory entry as well as the file contents
+            dir_fd = os.open(os.path.dirname(upload_path), os.O_RDONLY)
             try:
-                node = next(item for item in directory_items if item["name"] == part)
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
 
-                if not path_parts:  # End of the path
-                    if "contents" in node:
-                        raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot {verb} a directory"
-                        )
+    # Resumable uploads are staged in a hidden directory at the root of the drop box (so they are never part of the
+    # tree, and the assembled file can be moved into place within the same filesystem) with one directory per session:
+    #  - session.json: the session; its destination is re-derived from the session's path (and checked again) when the
+    #    upload is completed, rather than being stored as an absolute path
+    #  - data: the file being assembled, which parts are positionally written into
+    #  - parts/{offset}: empty markers for the parts which have been fully written
 
-                    return node
+    def _get_staging_dir(self, upload_id: str | None = None) -> str:
+        uploads_dir = os.path.join(os.path.realpath(self.config.service_data), UPLOAD_STAGING_DIR)
+        if upload_id is None:
+            return uploads_dir
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+        return os.path.join(uploads_dir, upload_id)
 
-                if "contents" not in node:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST, detail=f"{node['name']} is not a directory"
-                    )
+    @staticmethod
+    def _create_upload_staging(staging_dir: str, session: UploadSession) -> None:
+        os.makedirs(os.path.join(staging_dir, "parts"))
+        with open(os.path.join(staging_dir, "data"), "wb") as f:
+            f.truncate(session["size"])  # sparse, until parts are written
+        with open(os.path.join(staging_dir, "session.json"), "wb") as f:
+            f.write(orjson.dumps(session))
+
+    async def _load_upload(self, upload_id: str, include_expired: bool = False) -> tuple[UploadSession, str]:
+        staging_dir = self._get_staging_dir(upload_id)
+        try:
+            async with aiofiles.open(os.path.join(staging_dir, "session.json"), "rb") as f:
+                session: UploadSession = orjson.loads(await f.read())
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+        if not include_expired:
+            self.check_upload_not_expired(session)
+        return session, staging_dir
 
-                directory_items = tuple(node["contents"])
-                # Go around another iteration, nesting into this directory
+    async def create_upload(self, path: str, size: int) -> UploadSession:
+        upload_path = await self._get_upload_path(path)
+        upload_id = uuid.uuid4().hex
 
-            except StopIteration:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+        session: UploadSession = {
+            "id": upload_id,
+            "path": os.path.relpath(upload_path, os.path.realpath(self.config.service_data)),
+            "size": size,
+            "partSize": self.upload_part_size(size),
+            "expires": time.time() + self.config.resumable_upload_ttl,
+        }
 
-    async def retrieve_from_path(self, path: str) -> Response:
+        await asyncio.to_thread(self._create_upload_staging, self._get_staging_dir(upload_id), session)
+        self.logger.debug(f"Created upload {upload_id} for {upload_path} ({size} bytes)")
+
+        return session
+
+    async def upload_part(self, upload_id: str, offset: int, request: Request, content_length: int) -> None:
+        session, staging_dir = await self._load_upload(upload_id)
+        part_length = self.upload_part_length(session, offset, content_length)
+
+        try:
+            fd = await asyncio.to_thread(os.open, os.path.join(staging_dir, "data"), os.O_WRONLY)
+        except FileNotFoundError:  # aborted or completed in the meantime
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+        try:
+            bytes_received = await self._write_request_body(request, fd, part_length, offset)
+            if bytes_received != part_length:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Received {bytes_received} bytes, but the part is {part_length} bytes long",
+                )
+            if self.config.local_upload_fsync != "none":
+                await asyncio.to_thread(os.fsync, fd)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+        # Only mark the part as received once all of it has been written
+        try:
+            async with aiofiles.open(os.path.join(staging_dir, "parts", str(offset)), "wb"):
+                pass
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    async def _received_upload_offsets(self, staging_dir: str) -> list[int]:
+        try:
+            return sorted(int(name) for name in await aiofiles.os.listdir(os.path.join(staging_dir, "parts")))
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    async def get_upload_status(self, upload_id: str) -> UploadSession:
+        session, staging_dir = await self._load_upload(upload_id)
+        received_offsets = await self._received_upload_offsets(staging_dir)
+        return {
+            **session,
+            "receivedOffsets": received_offsets,
+            "bytesReceived": sum(min(session["partSize"], session["size"] - o) for o in received_offsets),
+        }
+
+    async def complete_upload(self, upload_id: str) -> None:
+        session, staging_dir = await self._load_upload(upload_id)
+
+        if missing_offsets := self.missing_upload_offsets(session, await self._received_upload_offsets(staging_dir)):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Upload is missing {len(missing_offsets)} part(s), starting at offset {missing_offsets[0]}",
+            )
+
+        # Checked again, since the tree may have changed since the upload was created
+        upload_path = await self._get_upload_path(session["path"])
+        await self._make_upload_dirs(upload_path)
+
+        try:
+            await asyncio.to_thread(self._publish_upload, os.path.join(staging_dir, "data"), upload_path)
+            await self._record_upload(upload_path)
+        finally:
+            self._tree_cache.clear()
+
+        await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
+        self.logger.debug(f"Completed upload {upload_id} to {upload_path}")
+
+    async def abort_upload(self, upload_id: str) -> None:
+        await self._load_upload(upload_id)  # 404 if the upload doesn't exist
+        await asyncio.to_thread(shutil.rmtree, self._get_staging_dir(upload_id), ignore_errors=True)
+
+    async def cleanup_expired_uploads(self) -> int:
+        uploads_dir = self._get_staging_dir()
+        now = time.time()
+        n_cleaned = 0
+
+        try:
+            upload_ids = await aiofiles.os.listdir(uploads_dir)
+        except FileNotFoundError:  # no resumable uploads yet
+            return 0
+
+        for upload_id in upload_ids:
+            try:
+                session, staging_dir = await self._load_upload(upload_id, include_expired=True)
+                upload_path, expires = session["path"], session["expires"]
+            except HTTPException:
+                # Not a session directory, or one left without a session file (e.g., by a crash during creation);
+                # fall back to the directory's modification time.
+                staging_dir, upload_path = os.path.join(uploads_dir, upload_id), "?"
+                try:
+                    expires = (await aiofiles.os.stat(staging_dir)).st_mtime + self.config.resumable_upload_ttl
+                except FileNotFoundError:
+                    continue
+            if expires < now:
+                self.logger.info(f"Cleaning up expired upload {upload_id} for {upload_path}")
+                await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
+                n_cleaned += 1
+
+        return n_cleaned
+
+    def _resolve_node(self, root_path: pathlib.Path, path_parts: list[str], verb: str) -> DropBoxEntry:
+        """
+        Synchronously resolves a path to a file entry, checking only the path components it walks, with the same
+        visibility rules as the directory tree: dotfiles/hidden directories and empty components are not found, and
+        nothing past the traversal limit is reachable. Symlinks are followed, like when building the tree.
+        """
+
+        not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+
+        if len(path_parts) - 1 > self.config.traversal_limit:
+            # The directory tree does not go this deep, so nothing at this path would be in it
+            raise not_found
+
+        current_path = root_path
+
+        for i, part in enumerate(path_parts):
+            if not part or part[0] == ".":
+                # Covers "", ".", "..", and dotfiles - none of which are ever in the tree
+                raise not_found
+
+            current_path = current_path / part
+
+            try:
+                part_stat = os.lstat(current_path)
+                if stat.S_ISLNK(part_stat.st_mode):
+                    part_stat = os.stat(current_path)
+            except (FileNotFoundError, NotADirectoryError):
+                raise not_found
+
+            is_directory = stat.S_ISDIR(part_stat.st_mode)
+
+            if i < len(path_parts) - 1:
+                if not is_directory:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{part} is not a directory")
+                continue
+
+            # End of the path
+            if is_directory:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot {verb} a directory")
+
+            relative_path = "/" + "/".join(path_parts)
+            return self._add_checksums(
+                {
+                    "name": part,
+                    "filePath": str(current_path),
+                    "relativePath": relative_path,
+                    "size": part_stat.st_size,
+                    "lastModified": part_stat.st_mtime,
+                    "lastMetadataChange": part_stat.st_ctime,
+                    "uri": self.config.service_url_base_path + f"/objects{relative_path}",
+                }
+            )
+
+        raise not_found  # pragma: no cover
+
+    def _indexed_file_entry(self, root_path: pathlib.Path, row: IndexedEntry) -> DropBoxEntry:
+        relative_path = f"/{row.path}"
+        return self._add_checksums(
+            {
+                "name": row.name,
+                "filePath": str(root_path / row.path),
+                "relativePath": relative_path,
+                "size": row.size,
+                "lastModified": row.last_modified,
+                "lastMetadataChange": row.last_metadata_change,
+                "uri": self.config.service_url_base_path + f"/objects{relative_path}",
+            }
+        )
+
+    def _node_from_index(self, root_path: pathlib.Path, path_parts: list[str], verb: str) -> DropBoxEntry | None:
+        """
+        Synchronously looks up a file entry in the metadata index. Returns None if the path isn't indexed (i.e., it was
+        created since the last reconciliation pass, or doesn't exist), so it can be resolved on the filesystem instead.
+        """
+
+        if len(path_parts) - 1 > self.config.traversal_limit or any(not p or p[0] == "." for p in path_parts):
+            return None
+
+        row: IndexedEntry | None = self._index.get("/".join(path_parts))
+        if row is None:
+            return None
+        if row.is_directory:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot {verb} a directory")
+
+        return self._indexed_file_entry(root_path, row)
+
+    async def get_node_at_path(self, path: str, verb: str = "retrieve") -> DropBoxEntry:
+        root_path: pathlib.Path = pathlib.Path(self.config.service_data).absolute()
+
+        # Only look at the components of the requested path, rather than building the whole directory tree; we still
+        # only return items which would explicitly be in the tree.
+
+        # TODO: Deal with slashes in file names
+        path_parts: list[str] = path.removeprefix(str(root_path)).strip("/").split("/")
+
+        if self._index_ready and (node := await asyncio.to_thread(self._node_from_index, root_path, path_parts, verb)):
+            return node
+
+        return await asyncio.to_thread(self._resolve_node, root_path, path_parts, verb)
+
+    async def _current_checksums(self, entry: DropBoxEntry, file_stat: os.stat_result) -> Checksums | None:
+        path = entry["relativePath"].strip("/")
+        if (checksums := self._checksums.get(path, file_stat.st_size, file_stat.st_mtime)) is None:
+            checksums = await asyncio.to_thread(
+                self._read_checksums_xattr, entry["filePath"], file_stat.st_size, file_stat.st_mtime
+            )
+            if checksums is not None:
+                self._checksums.put(path, file_stat.st_size, file_stat.st_mtime, checksums)
+        return checksums
+
+    async def retrieve_from_path(self, request: Request, path: str) -> Response:
         node = await self.get_node_at_path(path)
-        return FileResponse(node["filePath"], media_type="application/octet-stream", filename=node["name"])
+        try:
+            file_stat = await aiofiles.os.stat(node["filePath"])
+        except FileNotFoundError:  # removed since it was indexed
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+        response = FileResponse(
+            node["filePath"],
+            media_type="application/octet-stream",
+            filename=node["name"],
+            stat_result=file_stat,
+        )
+        if self._checksum_algorithms and (checksums := await self._current_checksums(node, file_stat)):
+            response.headers["Repr-Digest"] = repr_digest_header(checksums)
+        # FileResponse handles Range/If-Range itself, but not conditional requests:
+        if is_not_modified(response.headers, request.headers):
+            return NotModifiedResponse(response.headers)
+        return response
 
     async def delete_at_path(self, path: str) -> Response:
         node = await self.get_node_at_path(path, verb="delete")
-        await aiofiles.os.remove(node["filePath"])
+        try:
+            await aiofiles.os.remove(node["filePath"])
+        except FileNotFoundError:  # removed since it was indexed
+            await self._record_removal(node["relativePath"])
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+        await self._record_removal(node["relativePath"])
+        self._tree_cache.clear()
         return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    def _delete_file(self, root_path: pathlib.Path, path: str) -> DeleteResult:
+        try:
+            node = self._resolve_node(root_path, path.strip("/").split("/"), "delete")
+            os.remove(node["filePath"])
+        except HTTPException as e:
+            return {"path": path, "status": e.status_code, "detail": e.detail}
+        except FileNotFoundError:  # removed in the meantime
+            return {"path": path, "status": status.HTTP_404_NOT_FOUND, "detail": "Nothing found at specified path"}
+        return {"path": path, "status": status.HTTP_204_NO_CONTENT}
+
+    def _delete_under_prefix(self, root_path: pathlib.Path, prefix: str) -> list[DeleteResult]:
+        """
+        Deletes every file in the tree under a directory (i.e., with the same visibility rules as the directory tree;
+        directories themselves are left in place, like for single deletes).
+        """
+
+        prefix_parts = prefix.split("/")
+        if any(not part or part[0] == "." for part in prefix_parts):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+
+        prefix_dir = root_path.joinpath(*prefix_parts)
+        if not prefix_dir.is_dir():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No directory found at specified prefix")
+
+        traversal_limit = self.config.traversal_limit
+        results: list[DeleteResult] = []
+
+        def _walk(current_dir: pathlib.Path, relative_path: str, level: int) -> None:
+            if level > traversal_limit:
+                return
+            for scanned in self._scan_directory(current_dir):
+                entry_path = f"{relative_path}/{scanned.name}"
+                if scanned.is_directory:
+                    _walk(current_dir / scanned.name, entry_path, level + 1)
+                    continue
+                try:
+                    os.remove(current_dir / scanned.name)
+                    results.append({"path": entry_path, "status": status.HTTP_204_NO_CONTENT})
+                except OSError as e:
+                    results.append(
+                        {"path": entry_path, "status": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": str(e)}
+                    )
+
+        _walk(prefix_dir, prefix, len(prefix_parts))
+        return results
+
+    def _delete_paths(self, paths: list[str] | None, prefix: str | None) -> list[DeleteResult]:
+        root_path = pathlib.Path(self.config.service_data).absolute()
+        if prefix is not None:
+            results = self._delete_under_prefix(root_path, prefix)
+        else:
+            results = [self._delete_file(root_path, path) for path in paths or ()]
+        for result in results:
+            if result["status"] in (status.HTTP_204_NO_CONTENT, status.HTTP_404_NOT_FOUND):
+                self._checksums.discard(result["path"].strip("/"))
+                if self._index is not None:
+                    self._index.remove(result["path"].strip("/"))
+        return results
+
+    async def delete_paths(self, paths: list[str] | None = None, prefix: str | None = None) -> list[DeleteResult]:
+        if prefix is not None:
+            prefix = self.normalize_delete_prefix(prefix)
+
+        # The whole batch is deleted in a single worker thread round trip, and the tree cache is only cleared once.
+        try:
+            results = await asyncio.to_thread(self._delete_paths, paths, prefix)
+        finally:
+            self._tree_cache.clear()
+
+        for result in results:
+            if result["status"] == status.HTTP_204_NO_CONTENT:
+                self._changes.record_removed(result["path"])
+        return results
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+from typing import NamedTuple
+
+from .search import SearchQuery
+
+__all__ = [
+    "IndexedEntry",
+    "LocalMetadataIndex",
+]
+
+# Paths in the index are relative to the root of the drop box, without leading or trailing slashes; the root directory
+# itself is stored with the empty path. Directories also record the mtime they had when they were last scanned, so a
+# rescan only needs to list directories whose mtime has changed since.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    is_directory INTEGER NOT NULL,
+    size INTEGER,
+    last_modified REAL,
+    last_metadata_change REAL,
+    directory_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_by_parent ON entries (parent, name);
+CREATE INDEX IF NOT EXISTS entries_by_last_modified ON entries (last_modified) WHERE NOT is_directory;
+"""
+
+
+class IndexedEntry(NamedTuple):
+    path: str
+    parent: str
+    name: str
+    depth: int  # number of path components, i.e. 1 for entries at the root of the drop box
+    is_directory: bool
+    size: int | None
+    last_modified: float | None
+    last_metadata_change: float | None
+    directory_mtime_ns: int | None  # None for files, and for directories which have not been scanned yet
+
+
+def _under(path: str) -> tuple[str, str]:
+    """Bounds of the key range holding every path strictly under a directory path."""
+    if not path:
+        return "", "\U0010ffff"
+    return f"{path}/", f"{path}0"  # "0" is the character after "/"
+
+
+def _split(path: str) -> tuple[str, str, int]:
+    """Splits a path into its parent path, name and depth (0 for the root directory)."""
+    if not path:
+        return "", "", 0
+    parent, _, name = path.rpartition("/")
+    return parent, name, path.count("/") + 1
+
+
+class LocalMetadataIndex:
+    """
+    Persistent SQLite index of the entries of a local drop box (path, type, size and timestamps). All methods are
+    synchronous and thread-safe; callers on the event loop should run them through asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        if (db_dir := os.path.dirname(self._db_path)) and not os.path.isdir(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._lock:
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+
+    def get(self, path: str) -> IndexedEntry | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM entries WHERE path = ?", (path,)).fetchone()
+        return IndexedEntry(*row) if row else None
+
+    def directories(self) -> list[tuple[str, int | None]]:
+        """Returns the (path, recorded mtime) of every indexed directory, parents before their children."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT path, directory_mtime_ns FROM entries WHERE is_directory ORDER BY depth, path"
+            ).fetchall()
+
+    def files_modified_since(self, timestamp: float) -> list[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM entries WHERE NOT is_directory AND last_modified >= ?", (timestamp,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _children(self, path: str) -> list[IndexedEntry]:
+        rows = self._db.execute("SELECT * FROM entries WHERE parent = ? AND path != ''", (path,)).fetchall()
+        return [IndexedEntry(*row) for row in rows]
+
+    def children(self, path: str) -> list[IndexedEntry]:
+        with self._lock:
+            return self._children(path)
+
+    def subtree(self, path: str, max_depth: int) -> list[IndexedEntry]:
+        """
+        Returns the entries under a directory, down to the given depth (counted from the root of the drop box), ordered
+        by parent directory and then by name.
+        """
+        low, high = _under(path)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM entries WHERE path > ? AND path < ? AND depth <= ? ORDER BY parent, name",
+                (low, high, max_depth),
+            ).fetchall()
+        return [IndexedEntry(*row) for row in rows]
+
+    def search_files(self, query: SearchQuery, prefix: str, after: str, limit: int) -> list[IndexedEntry]:
+        """
+        Returns up to limit files with paths starting with the given prefix and sorting after the given path, in path
+        order. Size and modification time predicates are evaluated by SQLite; callers still need to match paths.
+        """
+
+        conditions = ["NOT is_directory", "path >= ?", "path < ?", "path > ?"]
+        params: list = [prefix, f"{prefix}\U0010ffff", after]
+        for condition, value in (
+            ("size >= ?", query.min_size),
+            ("size <= ?", query.max_size),
+            ("last_modified >= ?", query.modified_after),
+            ("last_modified < ?", query.modified_before),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM entries WHERE {' AND '.join(conditions)} ORDER BY path LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [IndexedEntry(*row) for row in rows]
+
+    def has_directories_at_depth(self, path: str, depth: int) -> bool:
+        low, high = _under(path)
+        with self._lock:
+            return (
+                self._db.execute(
+                    "SELECT 1 FROM entries WHERE path > ? AND path < ? AND depth = ? AND is_directory LIMIT 1",
+                    (low, high, depth),
+                ).fetchone()
+                is not None
+            )
+
+    def _remove(self, path: str) -> None:
+        low, high = _under(path)
+        self._db.execute("DELETE FROM entries WHERE path = ? OR (path > ? AND path < ?)", (path, low, high))
+
+    def remove(self, path: str) -> None:
+        """Removes an entry, along with everything under it if it is a directory."""
+        with self._lock:
+            self._remove(path)
+
+    def _ensure_directories(self, path: str) -> None:
+        # Directories created along the way are left without an mtime, so the next rescan lists them
+        while path:
+            parent, name, depth = _split(path)
+            self._db.execute(
+                "INSERT OR IGNORE INTO entries (path, parent, name, depth, is_directory) VALUES (?, ?, ?, ?, 1)",
+                (path, parent, name, depth),
+            )
+            path = parent
+
+    def put_file(self, path: str, stat: os.stat_result) -> None:
+        parent, name, depth = _split(path)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._ensure_directories(parent)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, 0, ?, ?, ?, NULL)",
+                    (path, parent, name, depth, stat.st_size, stat.st_mtime, stat.st_ctime),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def replace_directory(
+        self,
+        path: str,
+        mtime_ns: int,
+        files: list[tuple[str, os.stat_result]],
+        directories: list[str],
+    ) -> list[str]:
+        """
+        Replaces the indexed contents of a directory with freshly-scanned (file name, stat) pairs and sub-directory
+        names, in a single transaction, and records the directory's mtime. Returns the paths of sub-directories which
+        were not indexed before (and so still need to be scanned themselves).
+        Files put in the index (e.g., by an upload) since the directory was scanned are kept: a file whose status
+        changed after the scanned directory mtime may just have been created, so its absence from the scan doesn't
+        mean it was removed. If it was, the directory's mtime has changed too, so the next rescan removes it.
+        """
+
+        parent, name, depth = _split(path)
+        prefix = f"{path}/" if path else ""
+        new_directories: list[str] = []
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                # Read within the transaction, so entries put concurrently are either seen here or put afterwards
+                existing = {e.name: e for e in self._children(path)}
+                self._ensure_directories(parent)
+                self._db.execute(
+                    "INSERT INTO entries (path, parent, name, depth, is_directory, directory_mtime_ns) "
+                    "VALUES (?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET directory_mtime_ns = excluded.directory_mtime_ns",
+                    (path, parent, name, depth, mtime_ns),
+                )
+
+                file_names = {file_name for file_name, _ in files}
+                directory_names = set(directories)
+                scanned_at = mtime_ns / 1e9
+                for entry in existing.values():
+                    if entry.name in (directory_names if entry.is_directory else file_names):
+                        continue
+                    put_after_scan = not entry.is_directory and (entry.last_metadata_change or 0) > scanned_at
+                    if put_after_scan and entry.name not in directory_names:
+                        continue
+                    # Removed, or replaced by an entry of the other type
+                    self._remove(entry.path)
+
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, 0, ?, ?, ?, NULL)",
+                    [
+                        (f"{prefix}{file_name}", path, file_name, depth + 1, st.st_size, st.st_mtime, st.st_ctime)
+                        for file_name, st in files
+                    ],
+                )
+
+                for directory_name in directories:
+                    if (entry := existing.get(directory_name)) is None or not entry.is_directory:
+                        self._db.execute(
+                            "INSERT INTO entries (path, parent, name, depth, is_directory) VALUES (?, ?, ?, ?, 1)",
+                            (f"{prefix}{directory_name}", path, directory_name, depth + 1),
+                        )
+                        new_directories.append(f"{prefix}{directory_name}")
+
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+        return new_directories
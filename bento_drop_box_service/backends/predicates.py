@@ -0,0 +1,89 @@
+import fnmatch
+import os
+import re
+from collections.abc import Iterable
+
+__all__ = [
+    "is_glob",
+    "compile_globs",
+    "glob_literal_prefixes",
+    "narrow_listing_prefix",
+    "MetadataPredicates",
+]
+
+# Shared by tree filters and search queries: path glob matching, listing prefixes derived from globs, and predicates on
+# file metadata.
+
+_GLOB_SPECIAL_CHARACTERS = re.compile(r"[*?\[]")
+
+
+def is_glob(pattern: str) -> bool:
+    return _GLOB_SPECIAL_CHARACTERS.search(pattern) is not None
+
+
+def compile_globs(globs: Iterable[str]) -> re.Pattern | None:
+    """
+    Combines glob patterns (matched against whole paths, with * also matching /) into a single regular expression, so
+    each path is only matched once. None if there are no patterns.
+    """
+    globs = tuple(globs)
+    return re.compile("|".join(fnmatch.translate(g) for g in globs)) if globs else None
+
+
+def glob_literal_prefixes(globs: Iterable[str]) -> tuple[str, ...]:
+    """
+    Returns the literal start of each glob pattern (up to its first glob character), which every path matching the
+    pattern starts with.
+    """
+    return tuple(_GLOB_SPECIAL_CHARACTERS.split(g, maxsplit=1)[0] for g in globs)
+
+
+def narrow_listing_prefix(prefix: str, glob_prefixes: tuple[str, ...]) -> str | None:
+    """
+    Narrows a path prefix to list (for backends listing keys by prefix) to the longest one which every path under it
+    matching any of the globs with the given literal prefixes must have. None if no such path can exist.
+    """
+
+    if not glob_prefixes:
+        return prefix
+    common_prefix = os.path.commonprefix(list(glob_prefixes))
+    if common_prefix.startswith(prefix):
+        return common_prefix
+    if prefix.startswith(common_prefix):
+        # Prefixes of individual globs may still rule out everything under the prefix
+        return prefix if any(p.startswith(prefix) or prefix.startswith(p) for p in glob_prefixes) else None
+    return None
+
+
+class MetadataPredicates:
+    """
+    Predicates on file metadata, all optional:
+     - min_size/max_size: inclusive bounds on the file size, in bytes
+     - modified_after/modified_before: bounds on the file's last modification time (Unix timestamp), inclusive and
+       exclusive respectively
+    """
+
+    def __init__(
+        self,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.has_metadata_predicates = any(p is not None for p in (min_size, max_size, modified_after, modified_before))
+
+    @property
+    def metadata_key(self) -> tuple:
+        return self.min_size, self.max_size, self.modified_after, self.modified_before
+
+    def matches_metadata(self, size: int, last_modified: float) -> bool:
+        return not self.has_metadata_predicates or (
+            (self.min_size is None or size >= self.min_size)
+            and (self.max_size is None or size <= self.max_size)
+            and (self.modified_after is None or last_modified >= self.modified_after)
+            and (self.modified_before is None or last_modified < self.modified_before)
+        )
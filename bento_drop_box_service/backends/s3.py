@@ -1,14 +1,44 @@
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, suppress
+from datetime import UTC, datetime, timedelta
+from email.utils import parsedate, parsedate_to_datetime
+from secrets import token_bytes, token_hex
 
 import aioboto3
+import orjson
+from aiobotocore.config import AioConfig
 from bento_lib.logging import log_level_from_str
-from fastapi import status
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, status
 from fastapi.requests import Request
-from starlette.responses import Response, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.responses import (
+    MalformedRangeHeader,
+    PlainTextResponse,
+    RangeNotSatisfiable,
+    Response,
+    StreamingResponse,
+)
+from starlette.staticfiles import NotModifiedResponse
 from werkzeug.utils import secure_filename
 
 from ..config import Config
-from .base import DropBoxBackend, DropBoxEntry
+from .base import DeleteResult, DropBoxBackend, DropBoxEntry, UploadSession
+from .checksums import Checksums, repr_digest_header
+from .filters import TreeFilter
+from .http_utils import http_date, is_not_modified, multipart_byteranges, parse_range_header, should_use_range
+from .search import SearchQuery
+
+DELETE_OBJECTS_MAX_KEYS = 1000  # S3 limit on the number of keys per delete_objects call
+COPY_OBJECT_MAX_SIZE = 5 * 1024**3  # S3 limit on the size of objects copied with a single copy_object call
+CHECKSUM_METADATA_PREFIX = "checksum-"  # user metadata keys holding checksums, e.g. checksum-sha256
 
 
 class S3Backend(DropBoxBackend):
@@ -31,94 +61,136 @@ class S3Backend(DropBoxBackend):
             "aws_secret_access_key": config.s3_secret_key,
             "region_name": config.s3_region_name,
             "verify": config.s3_validate_ssl,
+            "config": AioConfig(
+                max_pool_connections=config.s3_max_pool_connections,
+                tcp_keepalive=config.s3_tcp_keepalive,
+                connector_args={"keepalive_timeout": config.s3_keepalive_timeout},
+            ),
         }
         self.bucket_name = config.s3_bucket
+        self._upload_signing_key = (
+            config.resumable_upload_signing_key or config.s3_secret_key
+        ).encode() or token_bytes(32)
+
+        # A single long-lived client (and thus a single HTTP connection pool) is shared by all requests. It is opened
+        # in startup() via the application lifespan, or lazily on first use, and closed in shutdown().
+        self._s3_client = None
+        self._s3_client_exit_stack: AsyncExitStack | None = None
+        self._s3_client_lock = asyncio.Lock()
+
+    async def _get_s3_client(self):
+        if self._s3_client is not None:
+            return self._s3_client
+
+        async with self._s3_client_lock:
+            if self._s3_client is None:
+                exit_stack = AsyncExitStack()
+                self._s3_client = await exit_stack.enter_async_context(self.session.client("s3", **self.s3_kwargs))
+                self._s3_client_exit_stack = exit_stack
+                self.logger.debug("Opened S3 client")
 
-    async def _create_s3_client(self):
-        return self.session.client("s3", **self.s3_kwargs)
+        return self._s3_client
+
+    async def startup(self) -> None:
+        await self._get_s3_client()
+
+    async def shutdown(self) -> None:
+        async with self._s3_client_lock:
+            if self._s3_client_exit_stack is not None:
+                await self._s3_client_exit_stack.aclose()
+                self.logger.debug("Closed S3 client")
+            self._s3_client = None
+            self._s3_client_exit_stack = None
 
     @staticmethod
-    def create_directory_tree(files: list[DropBoxEntry]):
+    def create_directory_tree(files: list[DropBoxEntry]) -> list[DropBoxEntry]:
         """
         Function to create the directory tree from a list of files
         For each file present in the list :
-         - Check if the directories contained in the filePath exist in the tree
-           (if not, create a node in the tree for the directory)
-         - When all the directories in the filePath are present in the tree, add the file to the right place in the tree
+         - Look up the contents list of its parent directory in an index keyed by directory path
+           (if not present, create nodes in the tree for the missing directories, recursively up to the root)
+         - Add the file to its parent directory's contents
+        Finally, every level is sorted by name to match the local backend's ordering.
+        Lookups are O(1) per file, rather than a linear scan of each level for every path component.
         """
 
         tree: list[DropBoxEntry] = []
 
+        # Contents list of each directory node, keyed by directory path; None is the root of the tree.
+        directory_contents: dict[str | None, list[DropBoxEntry]] = {None: tree}
+
+        def _get_directory_contents(directory_path: str | None) -> list[DropBoxEntry]:
+            if (contents := directory_contents.get(directory_path)) is not None:
+                return contents
+
+            # If the directory is not in the tree, create it (and, if needed, its ancestors)
+            parent_path, _, directory_name = directory_path.rpartition("/")
+            new_tree_node = DropBoxEntry(
+                name=directory_name, filePath=directory_path, relativePath=directory_path, contents=[]
+            )
+            _get_directory_contents(parent_path if "/" in directory_path else None).append(new_tree_node)
+            directory_contents[directory_path] = new_tree_node["contents"]
+            return new_tree_node["contents"]
+
         for file in files:
-            directories = file["filePath"].split("/")
-            current_level = tree
-            for i, directory_name in enumerate(directories[:-1]):
-                exist_in_tree: bool = False
-
-                for tree_node in current_level:
-                    if tree_node["name"] == directory_name:
-                        current_level = tree_node["contents"]
-                        exist_in_tree = True
-                        break
-
-                if not exist_in_tree:
-                    # If the directory is not in the tree, create it
-                    directory_path = "/".join(directories[: i + 1])
-                    new_tree_node = DropBoxEntry(
-                        name=directory_name, filePath=directory_path, relativePath=directory_path, contents=[]
-                    )
-                    current_level.append(new_tree_node)
-                    current_level = new_tree_node["contents"]
-
-            # Add file to the tree, at the right place (current level)
-            current_level.append(
-                DropBoxEntry(
-                    name=file["name"],
-                    filePath=file["filePath"],
-                    relativePath="/" + file["relativePath"],
-                    size=file.get("size"),
-                    lastModified=file["lastModified"],
-                    lastMetadataChange=file["lastMetadataChange"],
-                    uri=file["uri"],
-                )
+            file_path = file["filePath"]
+
+            # Add file to the tree, at the right place (its parent directory's level)
+            entry = DropBoxEntry(
+                name=file["name"],
+                filePath=file_path,
+                relativePath="/" + file["relativePath"],
+                size=file.get("size"),
+                lastModified=file["lastModified"],
+                lastMetadataChange=file["lastMetadataChange"],
+                uri=file["uri"],
             )
+            if "checksums" in file:
+                entry["checksums"] = file["checksums"]
+            _get_directory_contents(file_path.rpartition("/")[0] if "/" in file_path else None).append(entry)
+
+        for contents in directory_contents.values():
+            contents.sort(key=lambda e: e["name"])
 
         return tree
 
-    async def get_directory_tree(
+    async def _iter_objects(
         self,
-        sub_path: str | None = None,
-        ignore: list[str] | None = None,
-        include: list[str] | None = None,
-    ) -> tuple[DropBoxEntry, ...]:
-        self.validate_filters(include, ignore)
+        sub_path: str | None,
+        filters: TreeFilter | None,
+    ) -> AsyncIterator[DropBoxEntry]:
+        """
+        Yields a file entry for each object under sub_path passing the traversal limit and filters, in key order.
+        """
 
         prefix = sub_path if sub_path else ""
+        if filters and (prefix := filters.listing_prefix(prefix)) is None:
+            return  # nothing under the sub path can pass the include globs
         traversal_limit = self.config.traversal_limit
 
-        files_list: list[DropBoxEntry] = []
-        async with await self._create_s3_client() as s3_client:
-            paginator = s3_client.get_paginator("list_objects_v2")
-            page_iterator = paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
+        s3_client = await self._get_s3_client()
+        paginator = s3_client.get_paginator("list_objects_v2")
+        page_iterator = paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
 
-            async for page in page_iterator:
-                if "Contents" not in page:
-                    # Page has no objects, nothing to do.
-                    # Can occur if no objects are found for the given sub_path.
-                    continue
+        async for page in page_iterator:
+            if "Contents" not in page:
+                # Page has no objects, nothing to do.
+                # Can occur if no objects are found for the given sub_path.
+                continue
 
-                for obj in page["Contents"]:
-                    key = obj["Key"]
+            for obj in page["Contents"]:
+                key = obj["Key"]
 
-                    if key.count("/") > traversal_limit:
-                        self.logger.warning(f"Object key {key} violates traversal limit {traversal_limit}")
-                        continue
+                if key.count("/") > traversal_limit:
+                    self.logger.warning(f"Object key {key} violates traversal limit {traversal_limit}")
+                    continue
 
-                    if not self.is_passing_filter(key, include, ignore):
-                        continue
+                last_modified = obj["LastModified"].timestamp()
+                if filters and not (filters.matches_path(key) and filters.matches_metadata(obj["Size"], last_modified)):
+                    continue
 
-                    last_modified = obj["LastModified"].timestamp()
-                    entry: DropBoxEntry = {
+                yield self._add_checksums(
+                    {
                         "name": key.split("/")[-1],
                         "filePath": key,
                         "relativePath": key,
@@ -127,55 +199,1031 @@ class S3Backend(DropBoxBackend):
                         "lastMetadataChange": last_modified,
                         "uri": f"{self.config.service_url_base_path}/objects/{key}",
                     }
-                    files_list.append(entry)
+                )
 
+    async def get_directory_tree(
+        self,
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> tuple[DropBoxEntry, ...]:
+        files_list: list[DropBoxEntry] = [entry async for entry in self._iter_objects(sub_path, filters)]
         return tuple(self.create_directory_tree(files_list))
 
-    async def upload_to_path(self, request: Request, path: str, content_length: int) -> Response:
+    def _file_entry(self, obj: dict) -> DropBoxEntry:
+        key = obj["Key"]
+        last_modified = obj["LastModified"].timestamp()
+        return self._add_checksums(
+            {
+                "name": key.split("/")[-1],
+                "filePath": key,
+                "relativePath": "/" + key,
+                "size": obj["Size"],
+                "lastModified": last_modified,
+                "lastMetadataChange": last_modified,
+                "uri": f"{self.config.service_url_base_path}/objects/{key}",
+            }
+        )
+
+    async def _list_directory_level(
+        self,
+        prefix: str,
+        depth: int | None,
+        limit: int | None,
+        start_after: str | None,
+        filters: TreeFilter | None,
+    ) -> tuple[list[DropBoxEntry], tuple[str, bool] | None]:
+        """
+        Lists a single "directory" level using Delimiter="/", so that S3 only returns the keys directly under the
+        prefix and rolls everything deeper up into CommonPrefixes. Sub-directories are then listed the same way, down to
+        the requested depth. Returns the entries (in key order) and, if the listing was cut off by the limit, the
+        (name, is directory) of the last key or common prefix S3 returned, to build the next page's cursor from.
+        """
+
+        s3_client = await self._get_s3_client()
+        list_kwargs = {"Bucket": self.bucket_name, "Prefix": prefix, "Delimiter": "/"}
+        if start_after is not None:
+            list_kwargs["StartAfter"] = start_after
+
+        if limit is None:
+            pages = [page async for page in s3_client.get_paginator("list_objects_v2").paginate(**list_kwargs)]
+        else:
+            pages = [await s3_client.list_objects_v2(**list_kwargs, MaxKeys=limit)]
+
+        traversal_limit = self.config.traversal_limit
+        items: list[tuple[str, DropBoxEntry]] = []  # (key or common prefix, entry)
+        last_item: tuple[str, bool] | None = None  # (key or common prefix, is directory) - last in key order
+
+        for page in pages:
+            for common_prefix in page.get("CommonPrefixes", []):
+                directory_path = common_prefix["Prefix"][:-1]
+                last_item = max(last_item or ("", False), (common_prefix["Prefix"], True))
+                if filters and filters.skips_directory(directory_path):
+                    continue  # nothing in it could pass the filter, so it isn't listed
+                directory_entry = DropBoxEntry(
+                    name=directory_path.rsplit("/", 1)[-1],
+                    filePath=directory_path,
+                    relativePath=directory_path,
+                    contents=[],
+                )
+                items.append((common_prefix["Prefix"], directory_entry))
+
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                last_item = max(last_item or ("", False), (key, False))
+
+                if key == prefix:  # "directory marker" object
+                    continue
+
+                if key.count("/") > traversal_limit:
+                    self.logger.warning(f"Object key {key} violates traversal limit {traversal_limit}")
+                    continue
+
+                if filters and not (
+                    filters.matches_path(key) and filters.matches_metadata(obj["Size"], obj["LastModified"].timestamp())
+                ):
+                    continue
+
+                items.append((key, self._file_entry(obj)))
+
+        items.sort(key=lambda i: i[0])
+        entries = [entry for _, entry in items]
+
+        directories = [entry for entry in entries if "contents" in entry]
+
+        if depth is not None and depth <= 1:
+            for directory_entry in directories:
+                directory_entry["truncated"] = True
+        else:
+            # Directories whose children would all be past the traversal limit are left empty
+            expandable = [entry for entry in directories if entry["filePath"].count("/") < traversal_limit]
+            sub_listings = await asyncio.gather(
+                *(
+                    self._list_directory_level(
+                        f"{entry['filePath']}/", depth - 1 if depth is not None else None, None, None, filters
+                    )
+                    for entry in expandable
+                )
+            )
+            for directory_entry, (contents, _) in zip(expandable, sub_listings, strict=True):
+                directory_entry["contents"] = contents
+            if filters:
+                # if filtering, skip empty (fully-listed) directories, like in the full tree
+                entries = [entry for entry in entries if "contents" not in entry or entry["contents"]]
+
+        if limit is None or last_item is None or not pages[-1].get("IsTruncated", False):
+            return entries, None
+
+        last_key, last_is_directory = last_item
+        return entries, (last_key[len(prefix) :].removesuffix("/"), last_is_directory)
+
+    async def get_directory_listing(
+        self,
+        sub_path: str | None = None,
+        depth: int | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:
+        prefix = f"{sub_path.strip('/')}/" if sub_path and sub_path.strip("/") else ""
+
+        start_after = None
+        if cursor is not None:
+            after_name, after_is_directory = self.decode_cursor(cursor)
+            # For a directory (common prefix), start after every key under it, not just after the prefix itself.
+            start_after = prefix + after_name + ("/\U0010ffff" if after_is_directory else "")
+
+        entries, last_item = await self._list_directory_level(prefix, depth, limit, start_after, filters)
+        return tuple(entries), (self.encode_cursor(*last_item) if last_item else None)
+
+    async def iter_directory_entries(
+        self,
+        sub_path: str | None = None,
+        filters: TreeFilter | None = None,
+    ) -> AsyncIterator[DropBoxEntry]:
+        # S3 lists keys in lexicographic order, so all keys under a given "directory" prefix are listed one after
+        # another. Comparing each key's directories with the previous key's is thus enough to know when to emit the
+        # (implicit) directory entries, without keeping track of every directory seen.
+        previous_directories: list[str] = []
+
+        async for file in self._iter_objects(sub_path, filters):
+            directories = file["filePath"].split("/")[:-1]
+
+            common = 0
+            while (
+                common < min(len(directories), len(previous_directories))
+                and directories[common] == previous_directories[common]
+            ):
+                common += 1
+
+            for i in range(common, len(directories)):
+                directory_path = "/".join(directories[: i + 1])
+                yield DropBoxEntry(name=directories[i], filePath=directory_path, relativePath=directory_path)
+
+            previous_directories = directories
+
+            yield {**file, "relativePath": "/" + file["relativePath"]}
+
+    async def search(
+        self, query: SearchQuery, limit: int, cursor: str | None = None
+    ) -> tuple[tuple[DropBoxEntry, ...], str | None]:
+        after = self.decode_cursor(cursor)[0] if cursor is not None else ""
+
+        if (prefix := query.listing_prefix) is None:
+            return (), None
+
+        traversal_limit = self.config.traversal_limit
+        results: list[DropBoxEntry] = []
+
+        # Only keys under the listing prefix (combining the prefix predicate with the literal start of any globs) are
+        # listed, starting after the cursor; S3 lists keys in the same path order as search results are paginated in.
+        list_kwargs = {"Bucket": self.bucket_name, "Prefix": prefix}
+        if after:
+            list_kwargs["StartAfter"] = after
+
+        s3_client = await self._get_s3_client()
+        async for page in s3_client.get_paginator("list_objects_v2").paginate(**list_kwargs):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if key.count("/") > traversal_limit:
+                    continue
+                if query.matches(key, obj["Size"], obj["LastModified"].timestamp()):
+                    results.append(self._file_entry(obj))
+                    if len(results) > limit:
+                        return tuple(results[:limit]), self.encode_cursor(results[limit - 1]["filePath"], False)
+
+        return tuple(results), None
+
+    @staticmethod
+    def _secure_key(path: str) -> str:
         path_parts = path.split("/")
         # We need to be able to upload to "sub-folders" in S3, so we cannot censor slashes (which secure_filename does).
         # So to create a "semi-secure" path while maintaining slashes, but filtering out double slashes or "."/"..".
-        semi_secured_path = "/".join(secure_filename(p) for p in path_parts if p and p not in ("..", "."))
-        async with await self._create_s3_client() as s3_client:
-            await s3_client.put_object(Bucket=self.bucket_name, Key=semi_secured_path, Body=await request.body())
+        return "/".join(secure_filename(p) for p in path_parts if p and p not in ("..", "."))
 
+    async def upload_to_path(self, request: Request, path: str, content_length: int) -> Response:
+        semi_secured_path = self._secure_key(path)
+        s3_client = await self._get_s3_client()
+
+        if content_length <= self.config.s3_multipart_part_size:
+            # Small bodies fit in a single part anyway, so keep to a single put_object call
+            body = await request.body()
+            checksums, put_kwargs = None, {}
+            if (hasher := self._new_checksum_hasher()) is not None:
+                await asyncio.to_thread(hasher.update, body)
+                checksums = hasher.hexdigests()
+                put_kwargs["Metadata"] = self._checksum_metadata(checksums)
+            await s3_client.put_object(Bucket=self.bucket_name, Key=semi_secured_path, Body=body, **put_kwargs)
+        else:
+            checksums = await self._multipart_upload(request, semi_secured_path, content_length)
+
+        await self._record_upload(semi_secured_path, checksums)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    async def _retrive_headers(self, path: str) -> dict[str, str]:
-        async with await self._create_s3_client() as s3:
-            head = await s3.head_object(Bucket=self.bucket_name, Key=path)
+    @staticmethod
+    def _checksum_metadata(checksums: Checksums) -> dict[str, str]:
+        return {f"{CHECKSUM_METADATA_PREFIX}{algorithm}": digest for algorithm, digest in checksums.items()}
+
+    def _metadata_checksums(self, metadata: dict[str, str] | None) -> Checksums | None:
+        """
+        Reads the checksums for the configured algorithms out of an object's user metadata, if they are all there.
+        """
+        if not self._checksum_algorithms or not metadata:
+            return None
+        return self._configured_checksums({k.removeprefix(CHECKSUM_METADATA_PREFIX): v for k, v in metadata.items()})
+
+    async def _record_upload(self, key: str, checksums: Checksums | None = None) -> None:
+        """
+        Records a newly-uploaded object in the change feed (and its checksums in the checksum cache, whether they were
+        given or stored in the object's metadata), with the size and modification time S3 reports for it (so the next
+        change detection pass doesn't see it as modified).
+        """
+
+        if key.count("/") > self.config.traversal_limit:
+            return
+        try:
+            obj = await self._head_object(key)
+        except Exception:  # change detection will pick the object up
+            self.logger.exception(f"Error recording upload of {key}")
+            return
+        if checksums := checksums or self._metadata_checksums(obj.get("Metadata")):
+            self._checksums.put(key, obj["ContentLength"], obj["LastModified"].timestamp(), checksums)
+        self._changes.record_file(
+            self._file_entry({"Key": key, "Size": obj["ContentLength"], "LastModified": obj["LastModified"]})
+        )
+
+    async def _load_checksums(self, entry: DropBoxEntry) -> Checksums | None:
+        obj = await self._head_object(entry["filePath"])
+        if (obj["ContentLength"], obj["LastModified"].timestamp()) != (entry["size"], entry["lastModified"]):
+            return None
+        return self._metadata_checksums(obj.get("Metadata"))
+
+    # Checksums computed by update_checksums are only kept in memory: storing them in an object's metadata would take
+    # a copy of the object onto itself, which changes its modification time (and is limited to 5 GiB).
+
+    @staticmethod
+    async def _iter_parts(stream: AsyncIterator[bytes], part_size: int) -> AsyncIterator[bytes]:
+        """
+        Re-chunks a request body stream into parts of exactly part_size bytes (except for the last part).
+        """
+        buffer = bytearray()
+        async for chunk in stream:
+            buffer.extend(chunk)
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+        if buffer:
+            yield bytes(buffer)
+
+    async def _multipart_upload(self, request: Request, key: str, content_length: int) -> Checksums | None:
+        """
+        Streams a request body into an S3 multipart upload, with up to s3_multipart_concurrency parts being uploaded at
+        once. Memory use is bounded to roughly (concurrency + 1) * part size, regardless of the body size.
+        If the client disconnects, the body doesn't match the declared length, or a part fails, the multipart upload
+        is aborted so no orphaned parts are left behind in the bucket.
+        Returns the body's checksums, if any are configured. Since they are only known once the last part has been
+        received, they are added to the object's metadata afterwards, by copying the object onto itself (up to the
+        5 GiB copy_object limit; larger objects' checksums are only kept in memory).
+        """
+
+        s3_client = await self._get_s3_client()
+        part_slots = asyncio.Semaphore(self.config.s3_multipart_concurrency)
+        part_etags: dict[int, str] = {}
+        hasher = self._new_checksum_hasher()
+
+        upload_id = (await s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=key))["UploadId"]
+        self.logger.debug(f"Started multipart upload of {key} (upload ID: {upload_id})")
+
+        async def _upload_part(part_number: int, body: bytes) -> None:
+            try:
+                res = await s3_client.upload_part(
+                    Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+                )
+                part_etags[part_number] = res["ETag"]
+            finally:
+                part_slots.release()
+
+        try:
+            bytes_received = 0
+            async with asyncio.TaskGroup() as tg:
+                part_number = 0
+                async for part_body in self._iter_parts(request.stream(), self.config.s3_multipart_part_size):
+                    if hasher is not None:  # parts come in order, while earlier ones are still being uploaded
+                        await asyncio.to_thread(hasher.update, part_body)
+                    await part_slots.acquire()
+                    part_number += 1
+                    bytes_received += len(part_body)
+                    tg.create_task(_upload_part(part_number, part_body))
+
+            if bytes_received != content_length:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Received {bytes_received} bytes, but Content-Length was {content_length}",
+                )
+
+            await s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": n, "ETag": e} for n, e in sorted(part_etags.items())]},
+            )
+
+        except BaseException as e:
+            self.logger.warning(f"Aborting multipart upload of {key} (upload ID: {upload_id}): {e!r}")
+            await asyncio.shield(s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id))
+            if isinstance(e, BaseExceptionGroup) and len(e.exceptions) == 1:
+                # Unwrap exceptions from the task group (e.g., client disconnects or a failed part)
+                raise e.exceptions[0] from None
+            raise
+
+        if hasher is None:
+            return None
+
+        checksums = hasher.hexdigests()
+        if content_length <= COPY_OBJECT_MAX_SIZE:
+            try:
+                await s3_client.copy_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    CopySource={"Bucket": self.bucket_name, "Key": key},
+                    Metadata=self._checksum_metadata(checksums),
+                    MetadataDirective="REPLACE",
+                )
+            except ClientError as e:  # the upload itself succeeded; its checksums are still kept in memory
+                self.logger.warning(f"Could not store checksums in the metadata of {key}: {e!r}")
+        return checksums
+
+    # Resumable uploads map directly onto S3 multipart uploads (part N starts at offset (N - 1) * part size), so no
+    # session state is kept in the service: upload IDs encode the object key, S3 upload ID, and the session's size,
+    # part size, and expiry time (signed, so clients can't alter them), and received parts are listed from S3.
+
+    def _sign_upload_id(self, encoded: str) -> str:
+        return hmac.new(self._upload_signing_key, encoded.encode("ascii"), hashlib.sha256).hexdigest()
+
+    def _encode_upload_id(self, session: UploadSession, s3_upload_id: str) -> str:
+        data = [session["path"], s3_upload_id, session["size"], session["partSize"], session["expires"]]
+        encoded = base64.urlsafe_b64encode(orjson.dumps(data)).decode("ascii")
+        return f"{encoded}.{self._sign_upload_id(encoded)}"
+
+    def _decode_upload_id(self, upload_id: str) -> tuple[UploadSession, str]:
+        not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+        encoded, _, signature = upload_id.rpartition(".")
+        if not hmac.compare_digest(signature.encode(), self._sign_upload_id(encoded).encode()):
+            raise not_found
+        try:
+            key, s3_upload_id, size, part_size, expires = orjson.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not (isinstance(key, str) and isinstance(s3_upload_id, str) and size > 0 and part_size > 0):
+                raise TypeError("invalid upload ID contents")
+        except (ValueError, TypeError, orjson.JSONDecodeError):
+            raise not_found
+        if key != self._secure_key(key):  # signed keys were already secured when the upload was created
+            raise not_found
+
+        session: UploadSession = {"id": upload_id, "path": key, "size": size, "partSize": part_size, "expires": expires}
+        self.check_upload_not_expired(session)
+        return session, s3_upload_id
+
+    @staticmethod
+    def _raise_if_upload_not_found(e: ClientError) -> None:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload" or (
+            e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == status.HTTP_404_NOT_FOUND
+        ):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    async def create_upload(self, path: str, size: int) -> UploadSession:
+        key = self._secure_key(path)
+        s3_client = await self._get_s3_client()
+
+        s3_upload_id = (await s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=key))["UploadId"]
+        self.logger.debug(f"Created upload of {key} (upload ID: {s3_upload_id}, {size} bytes)")
+
+        session: UploadSession = {
+            "id": "",
+            "path": key,
+            "size": size,
+            "partSize": self.upload_part_size(size),
+            "expires": time.time() + self.config.resumable_upload_ttl,
+        }
+        session["id"] = self._encode_upload_id(session, s3_upload_id)
+        return session
+
+    async def upload_part(self, upload_id: str, offset: int, request: Request, content_length: int) -> None:
+        session, s3_upload_id = self._decode_upload_id(upload_id)
+        part_length = self.upload_part_length(session, offset, content_length)
+
+        # The part is received into a single buffer, which is passed on to S3 as-is
+        body = bytearray(part_length)
+        bytes_received = 0
+        async for chunk in request.stream():
+            if bytes_received + len(chunk) > part_length:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Received more than the expected {part_length} bytes",
+                )
+            body[bytes_received : bytes_received + len(chunk)] = chunk
+            bytes_received += len(chunk)
+        if bytes_received != part_length:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Received {bytes_received} bytes, but the part is {part_length} bytes long",
+            )
+
+        s3_client = await self._get_s3_client()
+        try:
+            await s3_client.upload_part(
+                Bucket=self.bucket_name,
+                Key=session["path"],
+                UploadId=s3_upload_id,
+                PartNumber=offset // session["partSize"] + 1,
+                Body=body,
+            )
+        except ClientError as e:
+            self._raise_if_upload_not_found(e)
+            raise
+
+    async def _list_upload_parts(self, session: UploadSession, s3_upload_id: str) -> list[dict]:
+        s3_client = await self._get_s3_client()
+        parts: list[dict] = []
+        marker_kwargs: dict = {}
+
+        try:
+            while True:
+                res = await s3_client.list_parts(
+                    Bucket=self.bucket_name, Key=session["path"], UploadId=s3_upload_id, **marker_kwargs
+                )
+                parts.extend(res.get("Parts", ()))
+                if not res.get("IsTruncated"):
+                    return parts
+                marker_kwargs["PartNumberMarker"] = res["NextPartNumberMarker"]
+        except ClientError as e:
+            self._raise_if_upload_not_found(e)
+            raise
+
+    async def get_upload_status(self, upload_id: str) -> UploadSession:
+        session, s3_upload_id = self._decode_upload_id(upload_id)
+        parts = await self._list_upload_parts(session, s3_upload_id)
+        return {
+            **session,
+            "receivedOffsets": sorted((p["PartNumber"] - 1) * session["partSize"] for p in parts),
+            "bytesReceived": sum(p["Size"] for p in parts),
+        }
+
+    async def complete_upload(self, upload_id: str) -> None:
+        session, s3_upload_id = self._decode_upload_id(upload_id)
+        parts = await self._list_upload_parts(session, s3_upload_id)
+
+        received_offsets = [(p["PartNumber"] - 1) * session["partSize"] for p in parts]
+        if missing_offsets := self.missing_upload_offsets(session, received_offsets):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Upload is missing {len(missing_offsets)} part(s), starting at offset {missing_offsets[0]}",
+            )
+
+        s3_client = await self._get_s3_client()
+        try:
+            await s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=session["path"],
+                UploadId=s3_upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": p["PartNumber"], "ETag": p["ETag"]}
+                        for p in sorted(parts, key=lambda p: p["PartNumber"])
+                    ]
+                },
+            )
+        except ClientError as e:
+            self._raise_if_upload_not_found(e)
+            raise
+
+        await self._record_upload(session["path"])
+        self.logger.debug(f"Completed upload of {session['path']} (upload ID: {s3_upload_id})")
+
+    async def abort_upload(self, upload_id: str) -> None:
+        session, s3_upload_id = self._decode_upload_id(upload_id)
+        s3_client = await self._get_s3_client()
+        try:
+            await s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=session["path"], UploadId=s3_upload_id)
+        except ClientError as e:
+            self._raise_if_upload_not_found(e)
+            raise
+
+    async def cleanup_expired_uploads(self) -> int:
+        """
+        Aborts any multipart uploads in the bucket which were started more than the upload TTL ago. Since S3 keeps the
+        parts of incomplete multipart uploads (and bills for them) indefinitely, this also cleans up after uploads
+        interrupted by e.g. a service restart.
+        """
+
+        s3_client = await self._get_s3_client()
+        expired_before = datetime.now(UTC) - timedelta(seconds=self.config.resumable_upload_ttl)
+        n_cleaned = 0
+        marker_kwargs: dict = {}
+
+        while True:
+            res = await s3_client.list_multipart_uploads(Bucket=self.bucket_name, **marker_kwargs)
+
+            for upload in res.get("Uploads", ()):
+                if upload["Initiated"] >= expired_before:
+                    continue
+                self.logger.info(f"Cleaning up expired upload of {upload['Key']} (upload ID: {upload['UploadId']})")
+                try:
+                    await s3_client.abort_multipart_upload(
+                        Bucket=self.bucket_name, Key=upload["Key"], UploadId=upload["UploadId"]
+                    )
+                    n_cleaned += 1
+                except ClientError as e:  # e.g., completed or aborted in the meantime
+                    self.logger.warning(f"Could not abort expired upload {upload['UploadId']}: {e!r}")
+
+            if not res.get("IsTruncated"):
+                return n_cleaned
+
+            marker_kwargs = {"KeyMarker": res["NextKeyMarker"], "UploadIdMarker": res["NextUploadIdMarker"]}
+
+    def _object_headers(self, path: str, metadata: dict) -> dict[str, str]:
+        """
+        Builds download response headers from the metadata in a get_object (or head_object) response, including the
+        object's checksums (from its user metadata, or the checksum cache) if they are known.
+        """
 
         name = path.rsplit("/", 1)[-1]
 
         headers = {
+            "Accept-Ranges": "bytes",
             "Content-Disposition": f'attachment; filename="{name}"',
-            "Content-Type": head.get("ContentType") or "application/octet-stream",
+            "Content-Type": metadata.get("ContentType") or "application/octet-stream",
         }
 
-        if "ContentLength" in head:
-            headers["Content-Length"] = str(head["ContentLength"])
-        if "ETag" in head:
-            headers["ETag"] = head["ETag"]
-        if "LastModified" in head:
-            headers["Last-Modified"] = str(head["LastModified"])
+        if "ContentLength" in metadata:
+            headers["Content-Length"] = str(metadata["ContentLength"])
+        if "ETag" in metadata:
+            headers["ETag"] = metadata["ETag"]
+        if "LastModified" in metadata:
+            headers["Last-Modified"] = http_date(metadata["LastModified"])
+
+        if self._checksum_algorithms and (checksums := self._object_checksums(path, metadata)):
+            headers["Repr-Digest"] = repr_digest_header(checksums)
 
         return headers
 
-    async def retrieve_from_path(self, path: str) -> Response:
+    def _object_checksums(self, path: str, metadata: dict) -> Checksums | None:
+        if (checksums := self._metadata_checksums(metadata.get("Metadata"))) is not None:
+            return checksums
+        if "LastModified" not in metadata or "ContentLength" not in metadata:
+            return None
+        # Checksums are for the whole object, even if only a range of it is being sent
+        content_range = metadata.get("ContentRange")  # bytes start-end/size
+        size = int(content_range.rpartition("/")[2]) if content_range else int(metadata["ContentLength"])
+        return self._checksums.get(path, size, metadata["LastModified"].timestamp())
+
+    async def _get_object(self, path: str, **kwargs) -> dict:
+        s3 = await self._get_s3_client()
+        try:
+            return await s3.get_object(Bucket=self.bucket_name, Key=path, **kwargs)
+        except ClientError as e:
+            if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == status.HTTP_404_NOT_FOUND:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+            raise
+
+    async def _head_object(self, path: str) -> dict:
+        s3 = await self._get_s3_client()
+        try:
+            return await s3.head_object(Bucket=self.bucket_name, Key=path)
+        except ClientError as e:
+            if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == status.HTTP_404_NOT_FOUND:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+            raise
+
+    async def _read_chunks(self, stream, length: int | None = None) -> AsyncIterator[bytes]:
+        """
+        Reads an object body (or only its first length bytes) in chunks which start at s3_chunk_size bytes, and double
+        (up to s3_max_chunk_size) after every read which S3 fills completely, i.e. while it keeps up with reads, so that
+        fast downloads take fewer, larger reads.
+        """
         chunk_size = self.config.s3_chunk_size
-        headers = await self._retrive_headers(path)
-
-        async def stream_object():
-            async with await self._create_s3_client() as s3:
-                obj = await s3.get_object(Bucket=self.bucket_name, Key=path)
-                self.logger.debug(f"Streaming {path}")
-                stream = obj["Body"]
-                while chunk := await stream.read(chunk_size):
+        max_chunk_size = max(self.config.s3_max_chunk_size, chunk_size)
+        remaining = length
+        while (remaining is None or remaining > 0) and (
+            chunk := await stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+        ):
+            yield chunk
+            if remaining is not None:
+                remaining -= len(chunk)
+            if len(chunk) == chunk_size:
+                chunk_size = min(chunk_size * 2, max_chunk_size)
+
+    async def _stream_body(self, path: str, obj: dict, length: int | None = None) -> AsyncIterator[bytes]:
+        """
+        Streams an object body (or only its first length bytes), reading up to s3_read_ahead_chunks chunks ahead of
+        the consumer in a background task, so that fetching from S3 and sending to the client overlap rather than
+        taking turns.
+        """
+
+        self.logger.debug(f"Streaming {path}" + (f" ({obj['ContentRange']})" if "ContentRange" in obj else ""))
+        stream = obj["Body"]
+        read_ahead = self.config.s3_read_ahead_chunks
+
+        async with stream:  # release the connection back to the shared pool, even if the client disconnects
+            if not read_ahead:
+                async for chunk in self._read_chunks(stream, length):
+                    yield chunk
+                return
+
+            queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+            slots = asyncio.Semaphore(read_ahead - 1)  # bounds the number of chunks waiting in the queue to read_ahead
+
+            async def _read_ahead() -> None:
+                async for chunk in self._read_chunks(stream, length):
+                    queue.put_nowait(chunk)
+                    await slots.acquire()
+
+            reader = asyncio.create_task(_read_ahead())
+            reader.add_done_callback(lambda _: queue.put_nowait(None))  # end of the body, or the reader failed
+            try:
+                while (chunk := await queue.get()) is not None:
+                    slots.release()
+                    yield chunk
+                reader.result()  # raises the reader's error, if the body could not be read in full
+            finally:
+                # Don't leave the reader running on the body once it is closed (e.g., if the client disconnected)
+                reader.cancel()
+                with suppress(asyncio.CancelledError):
+                    await reader
+
+    def _stream_full_object(self, path: str, obj: dict) -> AsyncIterator[bytes]:
+        threshold = self.config.s3_parallel_download_threshold
+        if threshold and "ContentRange" not in obj and obj["ContentLength"] >= threshold:
+            return self._stream_parallel_ranges(path, obj)
+        return self._stream_body(path, obj)
+
+    async def _fetch_range(self, path: str, byte_range: tuple[int, int], conditions: dict) -> bytes:
+        obj = await self._get_object(path, Range=f"bytes={byte_range[0]}-{byte_range[1] - 1}", **conditions)
+        async with obj["Body"] as body:
+            return await body.read()
+
+    async def _stream_parallel_ranges(self, path: str, obj: dict) -> AsyncIterator[bytes]:
+        """
+        Streams a large object as consecutive ranges of s3_parallel_download_part_size bytes, so that a single download
+        isn't limited to the throughput of a single connection. The first range is streamed from the body of the
+        original get_object response, while up to s3_parallel_download_concurrency of the following ranges are fetched
+        (into memory) with ranged GETs. These are conditional on the object's ETag, so that if the object is replaced
+        during the download, the download fails rather than mixing the contents of both versions.
+        """
+
+        size = int(obj["ContentLength"])
+        part_size = self.config.s3_parallel_download_part_size
+        concurrency = self.config.s3_parallel_download_concurrency
+        conditions = {"IfMatch": obj["ETag"]} if "ETag" in obj else {}
+        self.logger.debug(f"Streaming {path} in ranges of {part_size} bytes")
+
+        range_starts = iter(range(part_size, size, part_size))
+        pending: deque[asyncio.Task] = deque()
+
+        def _fetch_more() -> None:
+            while len(pending) < concurrency and (start := next(range_starts, None)) is not None:
+                pending.append(
+                    asyncio.ensure_future(self._fetch_range(path, (start, min(start + part_size, size)), conditions))
+                )
+
+        try:
+            _fetch_more()
+            # The rest of the original response's body is left unread, so its connection is closed rather than re-used
+            async for chunk in self._stream_body(path, obj, length=part_size):
+                yield chunk
+            while pending:
+                data = await pending.popleft()
+                _fetch_more()
+                yield data
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _stream_object(self, path: str, byte_range: tuple[int, int]) -> AsyncIterator[bytes]:
+        """
+        Streams the [start, end) range of an object from S3.
+        """
+        obj = await self._get_object(path, Range=f"bytes={byte_range[0]}-{byte_range[1] - 1}")
+        async for chunk in self._stream_body(path, obj):
+            yield chunk
+
+    @staticmethod
+    async def _close_body(obj: dict) -> None:
+        async with obj["Body"]:
+            pass
+
+    @staticmethod
+    def _conditional_get_kwargs(request_headers: Headers) -> dict:
+        """
+        Translates If-None-Match/If-Modified-Since into get_object parameters, so that S3 itself answers with 304
+        rather than starting to send the body. Only the simple forms are passed through; anything else (lists of ETags,
+        weak ETags, "*") is evaluated after the fact from the response metadata instead. Like for local files,
+        If-Modified-Since is ignored when If-None-Match is present.
+        """
+
+        if if_none_match := request_headers.get("if-none-match"):
+            if_none_match = if_none_match.strip()
+            if "," not in if_none_match and if_none_match.startswith('"'):
+                return {"IfNoneMatch": if_none_match}
+            return {}
+
+        if (if_modified_since := request_headers.get("if-modified-since")) and parsedate(if_modified_since):
+            return {"IfModifiedSince": parsedate_to_datetime(if_modified_since)}
+
+        return {}
+
+    async def retrieve_from_path(self, request: Request, path: str) -> Response:
+        # Downloads are served from a single get_object call: conditions and (single) ranges are passed through to S3,
+        # and response headers are built from the get_object response metadata before streaming starts.
+
+        http_range = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+
+        if http_range is not None and if_range is not None and if_range.startswith("W/"):
+            # Weak validators never match If-Range, so the full object is sent (like FileResponse)
+            http_range = None
+
+        if http_range is not None and "," in http_range:
+            return await self._retrieve_multiple_ranges(request, path, http_range)
+
+        get_kwargs = self._conditional_get_kwargs(request.headers)
+
+        if http_range is not None:
+            get_kwargs["Range"] = http_range.strip()
+            if if_range is not None:
+                # Let S3 check the If-Range validator; if it doesn't match, S3 answers 412 and we re-fetch in full.
+                if if_range.startswith('"'):
+                    get_kwargs["IfMatch"] = if_range
+                elif parsedate(if_range):
+                    get_kwargs["IfUnmodifiedSince"] = parsedate_to_datetime(if_range)
+
+        try:
+            obj = await self._get_object(path, **get_kwargs)
+        except ClientError as e:
+            metadata = e.response.get("ResponseMetadata", {})
+            match metadata.get("HTTPStatusCode"):
+                case status.HTTP_304_NOT_MODIFIED:
+                    return NotModifiedResponse(Headers(metadata.get("HTTPHeaders", {})))
+                case status.HTTP_412_PRECONDITION_FAILED if (
+                    "IfMatch" in get_kwargs or "IfUnmodifiedSince" in get_kwargs
+                ):
+                    http_range = None
+                    obj = await self._get_object(path, **self._conditional_get_kwargs(request.headers))
+                case status.HTTP_416_RANGE_NOT_SATISFIABLE:
+                    size = e.response.get("Error", {}).get("ActualObjectSize")
+                    if size is None:
+                        size = (await self._head_object(path))["ContentLength"]
+                    return PlainTextResponse(
+                        status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{size}"}
+                    )
+                case _:
+                    raise
+
+        headers = self._object_headers(path, obj)
+        response_headers = Headers(headers)
+
+        if is_not_modified(response_headers, request.headers):
+            # Conditions which weren't passed through to S3 (e.g., multiple or weak ETags)
+            await self._close_body(obj)
+            return NotModifiedResponse(response_headers)
+
+        if http_range is None:
+            return StreamingResponse(content=self._stream_full_object(path, obj), headers=headers)
+
+        if if_range is not None and not should_use_range(if_range, response_headers):
+            # Date validator which doesn't exactly match Last-Modified: send the full object instead
+            await self._close_body(obj)
+            obj = await self._get_object(path)
+            return StreamingResponse(
+                content=self._stream_full_object(path, obj), headers=self._object_headers(path, obj)
+            )
+
+        # Range request: check S3's interpretation of the range against the same rules as FileResponse uses.
+
+        if content_range := obj.get("ContentRange"):  # bytes start-end/size
+            range_str, size_str = content_range.removeprefix("bytes ").split("/")
+            s3_start, s3_end = map(int, range_str.split("-"))
+            s3_range, size = (s3_start, s3_end + 1), int(size_str)
+        else:  # S3 ignored the Range header (e.g., start > end) and is sending the whole object
+            s3_range, size = None, int(obj["ContentLength"])
+
+        try:
+            ranges = parse_range_header(http_range, size)
+        except MalformedRangeHeader as e:
+            await self._close_body(obj)
+            return PlainTextResponse(e.content, status_code=status.HTTP_400_BAD_REQUEST)
+        except RangeNotSatisfiable as e:
+            await self._close_body(obj)
+            return PlainTextResponse(
+                status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{e.max_size}"}
+            )
+
+        start, end = ranges[0]
+
+        if s3_range != (start, end):  # pragma: no cover - S3 and FileResponse range semantics should agree
+            await self._close_body(obj)
+            obj = await self._get_object(path, Range=f"bytes={start}-{end - 1}")
+
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str(end - start)
+        return StreamingResponse(
+            content=self._stream_body(path, obj), status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers
+        )
+
+    async def _retrieve_multiple_ranges(self, request: Request, path: str, http_range: str) -> Response:
+        # S3 only supports a single range per request, so each range is fetched in turn and assembled into a
+        # multipart/byteranges body. The object size is needed up front to resolve and merge the ranges, so (unlike
+        # other downloads) this starts with a head_object call.
+
+        headers = self._object_headers(path, await self._head_object(path))
+        response_headers = Headers(headers)
+
+        if is_not_modified(response_headers, request.headers):
+            return NotModifiedResponse(response_headers)
+
+        if not should_use_range(request.headers.get("if-range"), response_headers):
+            return StreamingResponse(content=self._stream_body(path, await self._get_object(path)), headers=headers)
+
+        size = int(headers["Content-Length"])
+
+        try:
+            ranges = parse_range_header(http_range, size)
+        except MalformedRangeHeader as e:
+            return PlainTextResponse(e.content, status_code=status.HTTP_400_BAD_REQUEST)
+        except RangeNotSatisfiable as e:
+            return PlainTextResponse(
+                status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{e.max_size}"}
+            )
+
+        if not ranges:  # Too many ranges; send the whole object instead
+            return StreamingResponse(content=self._stream_body(path, await self._get_object(path)), headers=headers)
+
+        if len(ranges) == 1:  # Ranges were merged into one
+            start, end = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            headers["Content-Length"] = str(end - start)
+            return StreamingResponse(
+                content=self._stream_object(path, (start, end)),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                headers=headers,
+            )
+
+        boundary = token_hex(13)
+        content_length, part_header = multipart_byteranges(ranges, boundary, size, headers["Content-Type"])
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["Content-Length"] = str(content_length)
+
+        async def stream_ranges():
+            for range_start, range_end in ranges:
+                yield part_header(range_start, range_end)
+                async for chunk in self._stream_object(path, (range_start, range_end)):
                     yield chunk
+                yield b"\r\n"
+            yield f"--{boundary}--".encode("latin-1")
+
+        return StreamingResponse(content=stream_ranges(), status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers)
+
+    async def _prefetch_object(self, entry: DropBoxEntry) -> dict:
+        obj = await self._get_object(entry["filePath"])
+        if obj["ContentLength"] <= self.config.archive_prefetch_size:
+            async with obj["Body"] as body:
+                obj["Prefetched"] = await body.read()
+        return obj
+
+    async def _object_chunks(self, path: str, obj: dict) -> AsyncIterator[bytes]:
+        if (prefetched := obj.get("Prefetched")) is not None:
+            if prefetched:
+                yield prefetched
+            return
+        async for chunk in self._stream_body(path, obj):
+            yield chunk
+
+    async def iter_file_contents(
+        self, entries: AsyncIterator[DropBoxEntry]
+    ) -> AsyncIterator[tuple[DropBoxEntry, AsyncIterator[bytes] | None]]:
+        # Objects are requested up to archive_read_ahead entries ahead of the one being consumed, so that per-object
+        # request latency overlaps with sending the previous objects. Small objects are read in full ahead of time;
+        # larger ones only have their get_object response (i.e., an open connection) waiting, and are streamed in turn.
 
-        return StreamingResponse(content=stream_object(), headers=headers)
+        read_ahead = self.config.archive_read_ahead
+        pending: deque[tuple[DropBoxEntry, asyncio.Task | None]] = deque()
+        n_fetching = 0
+
+        try:
+            async for entry in entries:
+                is_file = "uri" in entry
+                pending.append((entry, asyncio.ensure_future(self._prefetch_object(entry)) if is_file else None))
+                n_fetching += is_file
+
+                while pending and (n_fetching > read_ahead or pending[0][1] is None):
+                    next_entry, task = pending.popleft()
+                    if task is None:
+                        yield next_entry, None
+                        continue
+                    n_fetching -= 1
+                    yield next_entry, self._object_chunks(next_entry["filePath"], await task)
+
+            while pending:
+                next_entry, task = pending.popleft()
+                yield next_entry, (None if task is None else self._object_chunks(next_entry["filePath"], await task))
+        finally:
+            # Client disconnected or something failed: don't leave requests in flight or connections checked out
+            for _, task in pending:
+                if task is None:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and "Prefetched" not in task.result():
+                    await self._close_body(task.result())
+
+    @staticmethod
+    def _object_key(path: str) -> str | None:
+        """
+        Resolves a path to the key of an existing object, for deletes: unlike for uploads, the key's characters are left
+        as they are (like for retrieval), so any object which can be downloaded can also be deleted. Only empty
+        components (i.e., leading, trailing or double slashes) are dropped. None if the path has "." or ".." components
+        or no components at all, i.e. if it can't refer to an object in the tree.
+        """
+
+        path_parts = [p for p in path.split("/") if p]
+        if not path_parts or any(p in (".", "..") for p in path_parts):
+            return None
+        return "/".join(path_parts)
 
     async def delete_at_path(self, path: str) -> Response:
-        async with await self._create_s3_client() as s3_client:
-            await s3_client.delete_object(Bucket=self.bucket_name, Key=path)
+        if (key := self._object_key(path)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nothing found at specified path")
+        s3_client = await self._get_s3_client()
+        await s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+        self._checksums.discard(key)
+        self._changes.record_removed(key)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    async def _delete_objects(self, keys: list[str]) -> list[DeleteResult]:
+        """
+        Deletes up to DELETE_OBJECTS_MAX_KEYS keys in a single delete_objects call. In quiet mode, S3 only reports the
+        keys it could not delete; like delete_object, deleting a key which doesn't exist counts as a success.
+        """
+
+        s3_client = await self._get_s3_client()
+        res = await s3_client.delete_objects(
+            Bucket=self.bucket_name, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        )
+        errors = {e["Key"]: e for e in res.get("Errors", ())}
+        return [
+            {"path": key, "status": status.HTTP_204_NO_CONTENT}
+            if (error := errors.get(key)) is None
+            else {
+                "path": key,
+                "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "detail": f"{error.get('Code')}: {error.get('Message')}",
+            }
+            for key in keys
+        ]
+
+    async def delete_paths(self, paths: list[str] | None = None, prefix: str | None = None) -> list[DeleteResult]:
+        results = await self._delete_paths(paths, prefix)
+        for key, result in results:
+            if result["status"] == status.HTTP_204_NO_CONTENT:
+                self._checksums.discard(key)
+                self._changes.record_removed(key)
+        return [result for _, result in results]
+
+    async def _delete_paths(self, paths: list[str] | None, prefix: str | None) -> list[tuple[str | None, DeleteResult]]:
+        """
+        Deletes a batch of files, returning the key each path was resolved to along with its outcome. Paths are
+        resolved to keys like for single deletes, but reported as given, like for the local backend.
+        """
+
+        if prefix is None:
+            path_keys = {path: self._object_key(path) for path in paths or ()}  # de-duplicated, in order
+            keys = list(dict.fromkeys(key for key in path_keys.values() if key))
+            batches = await asyncio.gather(
+                *(
+                    self._delete_objects(keys[i : i + DELETE_OBJECTS_MAX_KEYS])
+                    for i in range(0, len(keys), DELETE_OBJECTS_MAX_KEYS)
+                )
+            )
+            key_results = {result["path"]: result for batch in batches for result in batch}
+            return [
+                (key, {**key_results[key], "path": path})
+                if key
+                else (
+                    key,
+                    {"path": path, "status": status.HTTP_404_NOT_FOUND, "detail": "Nothing found at specified path"},
+                )
+                for path, key in path_keys.items()
+            ]
+
+        # Each listing page holds at most 1000 keys, i.e. exactly one delete_objects call's worth.
+        s3_client = await self._get_s3_client()
+        paginator = s3_client.get_paginator("list_objects_v2")
+        results: list[tuple[str | None, DeleteResult]] = []
+        async for page in paginator.paginate(
+            Bucket=self.bucket_name,
+            Prefix=f"{self.normalize_delete_prefix(prefix)}/",
+            PaginationConfig={"PageSize": DELETE_OBJECTS_MAX_KEYS},
+        ):
+            if keys := [obj["Key"] for obj in page.get("Contents", ())]:
+                results.extend((result["path"], result) for result in await self._delete_objects(keys))
+        return results
@@ -0,0 +1,48 @@
+from .predicates import MetadataPredicates, compile_globs, glob_literal_prefixes, narrow_listing_prefix
+
+__all__ = [
+    "SearchQuery",
+]
+
+
+class SearchQuery(MetadataPredicates):
+    """
+    File metadata search predicates, prepared once per request. All given predicates must match:
+     - prefix: the file's path (relative to the root of the drop box, without a leading slash) starts with it
+     - globs: the path matches any of the glob patterns (with * also matching /, so *.vcf.gz matches at any depth)
+     - suffixes: the file name ends with any of the suffixes
+     - the metadata predicates (see MetadataPredicates)
+    """
+
+    def __init__(
+        self,
+        prefix: str = "",
+        globs: list[str] | None = None,
+        suffixes: list[str] | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+    ):
+        super().__init__(min_size, max_size, modified_after, modified_before)
+        self.prefix = prefix.lstrip("/")
+        self.globs = tuple(g.lstrip("/") for g in globs or ())
+        self.suffixes = tuple(suffixes or ())
+
+        self._glob_re = compile_globs(self.globs)
+
+    @property
+    def listing_prefix(self) -> str | None:
+        """
+        The longest path prefix which every matching file must have, combining the prefix predicate with the literal
+        start of the glob patterns, for backends to only list what could match. None if nothing can match.
+        """
+        return narrow_listing_prefix(self.prefix, glob_literal_prefixes(self.globs))
+
+    def matches(self, path: str, size: int, last_modified: float) -> bool:
+        return (
+            path.startswith(self.prefix)
+            and (self._glob_re is None or self._glob_re.match(path) is not None)
+            and (not self.suffixes or path.endswith(self.suffixes))
+            and self.matches_metadata(size, last_modified)
+        )
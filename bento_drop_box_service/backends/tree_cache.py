@@ -0,0 +1,142 @@
+import asyncio
+import functools
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from .base import DropBoxEntry
+
+__all__ = [
+    "TreeCacheKey",
+    "DirectoryMTimes",
+    "DirectoryTreeCache",
+]
+
+TreeCacheKey = tuple[str, tuple]  # (sub path, filter key)
+DirectoryMTimes = dict[str, int]  # directory path -> st_mtime_ns at the time it was scanned
+
+
+@dataclass
+class _CachedTree:
+    tree: tuple[DropBoxEntry, ...]
+    directory_mtimes: DirectoryMTimes
+    validated_at: float
+    etag: str | None = None  # computed on first use
+
+
+def _directory_mtimes_unchanged(directory_mtimes: DirectoryMTimes) -> bool:
+    for path, mtime_ns in directory_mtimes.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:  # directory removed or otherwise inaccessible
+            return False
+    return True
+
+
+class DirectoryTreeCache:
+    """
+    Bounded LRU cache of built directory trees, keyed by sub path and filters.
+
+    A cached tree is served as-is for up to `staleness` seconds after it was last validated. Past that, it is
+    re-validated by checking the modification times of every directory scanned when building it; any entry being
+    added, removed, or renamed changes its parent directory's mtime, so an unchanged set of mtimes means the tree can
+    be reused. In-place modification of an existing file does not update directory mtimes, so size/timestamp changes
+    from outside writers are only picked up once the tree is rebuilt for another reason.
+    Writes made by the service itself should call clear() so they are visible immediately.
+    """
+
+    def __init__(self, max_size: int, staleness: float):
+        self._max_size = max_size
+        self._staleness = staleness
+        self._entries: OrderedDict[TreeCacheKey, _CachedTree] = OrderedDict()
+        self._in_flight: dict[TreeCacheKey, asyncio.Task] = {}
+        self._generation: int = 0  # incremented on clear(), so builds started before a write aren't cached
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+
+    async def _get_valid(self, key: TreeCacheKey) -> tuple[DropBoxEntry, ...] | None:
+        if (cached := self._entries.get(key)) is None:
+            return None
+
+        now = time.monotonic()
+        if now - cached.validated_at > self._staleness:
+            if not await asyncio.to_thread(_directory_mtimes_unchanged, cached.directory_mtimes):
+                self._entries.pop(key, None)
+                return None
+            cached.validated_at = now
+
+        self._entries.move_to_end(key)
+        return cached.tree
+
+    def _put(self, key: TreeCacheKey, tree: tuple[DropBoxEntry, ...], directory_mtimes: DirectoryMTimes) -> None:
+        self._entries[key] = _CachedTree(tree, directory_mtimes, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def get_etag(
+        self, key: TreeCacheKey, tree: tuple[DropBoxEntry, ...], compute: Callable[[tuple[DropBoxEntry, ...]], str]
+    ) -> str:
+        """
+        Returns the ETag of a tree returned by get_or_build, computing it only once while the tree stays cached.
+        """
+        if (cached := self._entries.get(key)) is None or cached.tree is not tree:
+            return compute(tree)
+        if cached.etag is None:
+            cached.etag = compute(tree)
+        return cached.etag
+
+    async def _build(
+        self,
+        key: TreeCacheKey,
+        build: Callable[[DirectoryMTimes], Awaitable[tuple[DropBoxEntry, ...]]],
+    ) -> tuple[DropBoxEntry, ...]:
+        generation = self._generation
+        directory_mtimes: DirectoryMTimes = {}
+        tree = await build(directory_mtimes)
+        if generation == self._generation:
+            self._put(key, tree, directory_mtimes)
+        return tree
+
+    def _build_done(self, key: TreeCacheKey, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved, in case no request was left waiting on this build
+
+    async def get_or_build(
+        self,
+        key: TreeCacheKey,
+        build: Callable[[DirectoryMTimes], Awaitable[tuple[DropBoxEntry, ...]]],
+    ) -> tuple[DropBoxEntry, ...]:
+        """
+        Returns the cached tree for a key if it is still valid, otherwise builds it with build(), which must record
+        the mtime of every directory it scans into the dictionary passed to it. Concurrent requests for the same key
+        share a single build, which runs as its own task: a request being cancelled (e.g., by the client
+        disconnecting) stops it from waiting, without cancelling the build for the other requests.
+        """
+
+        if not self.enabled:
+            return await build({})
+
+        if (tree := await self._get_valid(key)) is not None:
+            return tree
+
+        if (task := self._in_flight.get(key)) is None:
+            task = asyncio.create_task(self._build(key, build))
+            task.add_done_callback(functools.partial(self._build_done, key))
+            self._in_flight[key] = task
+
+        return await asyncio.shield(task)
@@ -22,6 +22,50 @@ class Config(BentoFastAPIBaseConfig):
     service_data: str = "data/"
     service_data_source: Literal["local"] = "local"
     traversal_limit: int = 16
+    # Maximum number of local directory scans in flight at once; sibling directories are walked concurrently, which
+    # hides per-call metadata latency on network filesystems (NFS, Lustre, etc.)
+    traversal_concurrency: int = Field(default=8, ge=1)
+    # Local backend directory tree cache: maximum number of cached (sub path, filters) trees (0 disables the cache),
+    # and how long (in seconds) a cached tree is served before checking directory mtimes for outside changes.
+    tree_cache_size: int = 32
+    tree_cache_staleness: float = 2.0
+    # Local uploads are written to a temporary file in buffers of this size, then atomically moved into place. fsync
+    # policy: "none" leaves flushing to the OS, "file" syncs the file's contents before it is made visible, and
+    # "file_and_directory" also syncs the containing directory afterwards so the new entry survives a crash.
+    local_upload_buffer_size: int = Field(default=4 * 1024 * 1024, ge=64 * 1024)
+    local_upload_fsync: Literal["none", "file", "file_and_directory"] = "none"
+    # Optional persistent metadata index for the local backend: an SQLite database at this path (disabled if empty),
+    # which should live outside the drop box or be a dotfile so it isn't part of the tree. Tree requests and path
+    # lookups are served from it; it is updated by the service's own uploads and deletes, and reconciled with outside
+    # changes every local_index_rescan_interval seconds by a rescan which only lists directories whose mtime changed.
+    local_index_path: str = ""
+    local_index_rescan_interval: float = Field(default=30, gt=0)
+    # Directory archive downloads: files are read in chunks of this size. For S3, up to archive_read_ahead objects are
+    # requested ahead of the one being sent, and objects up to archive_prefetch_size bytes are read in full ahead of
+    # time (bounding read-ahead memory to about archive_read_ahead * archive_prefetch_size).
+    archive_chunk_size: int = Field(default=1024 * 1024, ge=64 * 1024)
+    archive_read_ahead: int = Field(default=8, ge=0)
+    archive_prefetch_size: int = Field(default=1024 * 1024, ge=0)
+    # Change feed: the number of most recent file changes kept for clients polling for changes since their last sync,
+    # and how often (in seconds) the whole tree is listed to detect changes made from outside the service. Each pass is
+    # a full directory walk or bucket listing, so detection is disabled (0) by default, leaving only the service's own
+    # uploads and deletes in the feed.
+    change_feed_size: int = Field(default=10000, ge=1)
+    change_detection_interval: float = Field(default=0, ge=0)
+    # Authorization decision cache: decisions from the authorization service are re-used for the same token (stored
+    # only as a hash), permissions and resource for up to authz_cache_ttl seconds, and never past the token's expiry.
+    # Setting either option to 0 disables the cache.
+    authz_cache_size: int = Field(default=4096, ge=0)
+    authz_cache_ttl: float = Field(default=10, ge=0)
+    # Checksums ("md5", "sha1", "sha256" and/or "sha512"; none by default) computed for uploads while they are received
+    # and stored with the file (local: in an extended attribute; S3: in object metadata), for file entries and download
+    # headers. Files without stored checksums (e.g., added from outside the service) have theirs computed in the
+    # background every checksum_scan_interval seconds (0 disables this), and cached until the file is modified. Up to
+    # checksum_cache_size files' checksums are cached in memory; past that, the least recently used are evicted (and
+    # loaded from where they are stored again, or for checksums only kept in memory, computed again by the next pass).
+    checksum_algorithms: tuple[Literal["md5", "sha1", "sha256", "sha512"], ...] = ()
+    checksum_scan_interval: float = Field(default=300, ge=0)
+    checksum_cache_size: int = Field(default=100000, ge=1)
 
     s3_access_key: str = ""
     s3_secret_key: str = ""
@@ -30,7 +74,32 @@ class Config(BentoFastAPIBaseConfig):
     s3_region_name: str = ""
     s3_validate_ssl: bool = False
     s3_use_https: bool = True
-    s3_chunk_size: int = 64 * 1024
+    # S3 downloads: object bodies are read ahead of what has been sent to the client, into a queue of up to
+    # s3_read_ahead_chunks chunks (0 disables read-ahead). Chunks start at s3_chunk_size bytes, and double after every
+    # read S3 fills completely (i.e., while it keeps up), up to s3_max_chunk_size bytes. Whole-object downloads of
+    # objects of at least s3_parallel_download_threshold bytes (0 disables this) are fetched as ranged GETs of
+    # s3_parallel_download_part_size bytes instead, with up to s3_parallel_download_concurrency of them in flight.
+    s3_chunk_size: int = Field(default=64 * 1024, ge=1)
+    s3_max_chunk_size: int = Field(default=1024 * 1024, ge=1)
+    s3_read_ahead_chunks: int = Field(default=4, ge=0)
+    s3_parallel_download_threshold: int = Field(default=0, ge=0)
+    s3_parallel_download_part_size: int = Field(default=16 * 1024 * 1024, ge=1024 * 1024)
+    s3_parallel_download_concurrency: int = Field(default=4, ge=1)
+    # Connection pool settings for the shared, long-lived S3 client
+    s3_max_pool_connections: int = 32
+    s3_tcp_keepalive: bool = True
+    s3_keepalive_timeout: float = 60.0  # seconds an idle pooled connection is kept open for re-use
+    # Uploads larger than one part are streamed to S3 as multipart uploads, with up to this many parts in flight at once
+    s3_multipart_part_size: int = Field(default=16 * 1024 * 1024, ge=5 * 1024 * 1024)  # S3 minimum part size: 5 MiB
+    s3_multipart_concurrency: int = Field(default=4, ge=1)
+    # Resumable uploads: the size of each part (except the last; raised as needed to stay within S3's 10,000 part
+    # limit), how long (in seconds) a session can be used before it expires and is cleaned up, and how often to clean
+    # up. S3 upload IDs carry the session itself, signed with resumable_upload_signing_key (by default, the S3 secret
+    # key; or if that is empty too, a random key, in which case sessions don't survive a restart).
+    resumable_upload_part_size: int = Field(default=64 * 1024 * 1024, ge=5 * 1024 * 1024)
+    resumable_upload_ttl: float = Field(default=24 * 60 * 60, gt=0)
+    resumable_upload_cleanup_interval: float = Field(default=60 * 60, gt=0)
+    resumable_upload_signing_key: str = ""
     use_s3_backend: bool = Field(default_factory=lambda c: c["s3_endpoint"] != "")
 
 
@@ -0,0 +1,200 @@
+import inspect
+import os
+import time
+from collections.abc import Callable, Iterable
+from functools import wraps
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.exposition import choose_encoder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+__all__ = [
+    "render_metrics",
+    "instrument_backend_operation",
+    "count_tree_entries",
+    "MetricsMiddleware",
+    "HTTP_REQUEST_DURATION",
+    "BACKEND_OPERATION_DURATION",
+    "BACKEND_OPERATION_ERRORS",
+    "BYTES_UPLOADED",
+    "BYTES_DOWNLOADED",
+    "TRANSFERS_IN_PROGRESS",
+    "TREE_ENTRIES",
+    "AUTHZ_CACHE_REQUESTS",
+]
+
+# Metrics are kept in-process in the default prometheus_client registry. labels() returns the child holding the
+# value(s) for a given set of label values, which callers on hot paths (e.g., per-chunk byte counts) should hold on to
+# rather than looking up every time.
+
+
+def render_metrics(accept: str | None) -> tuple[bytes, str]:
+    """
+    Renders every registered metric in the exposition format negotiated from an Accept header value (the Prometheus
+    text format, or OpenMetrics), returning the rendered metrics and their content type.
+    """
+    encoder, content_type = choose_encoder(accept)
+    return encoder(REGISTRY), content_type
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "drop_box_http_request_duration_seconds",
+    "Time from receiving a request to finishing sending its response, by route.",
+    ("method", "route", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+BACKEND_OPERATION_DURATION = Histogram(
+    "drop_box_backend_operation_duration_seconds",
+    "Duration of storage backend operations (for streamed listings and contents, until fully consumed).",
+    ("backend", "operation"),
+    buckets=LATENCY_BUCKETS,
+)
+BACKEND_OPERATION_ERRORS = Counter(
+    "drop_box_backend_operation_errors",
+    "Storage backend operations which raised an exception, by exception type.",
+    ("backend", "operation", "error"),
+)
+BYTES_UPLOADED = Counter(
+    "drop_box_uploaded_bytes",
+    "Bytes received in upload request bodies.",
+    ("backend",),
+)
+BYTES_DOWNLOADED = Counter(
+    "drop_box_downloaded_bytes",
+    "Bytes sent in file and archive download response bodies.",
+    ("backend",),
+)
+TRANSFERS_IN_PROGRESS = Gauge(
+    "drop_box_transfers_in_progress",
+    "Uploads and downloads currently in progress.",
+    ("backend", "direction"),
+)
+TREE_ENTRIES = Histogram(
+    "drop_box_tree_entries",
+    "Number of entries (files and directories) in tree responses.",
+    ("backend",),
+    buckets=(10, 100, 1000, 10000, 100000, 1000000),
+)
+AUTHZ_CACHE_REQUESTS = Counter(
+    "drop_box_authz_cache_requests",
+    "Authorization checks answered from the decision cache (hit) or by the authorization service (miss).",
+    ("result",),
+)
+
+
+def instrument_backend_operation(backend: str, operation: str, fn: Callable) -> Callable:
+    """
+    Wraps a backend method (a coroutine function or async generator function) to record its duration and errors.
+    """
+
+    duration = BACKEND_OPERATION_DURATION.labels(backend, operation)
+
+    def _record_error(e: Exception) -> None:
+        BACKEND_OPERATION_ERRORS.labels(backend, operation, type(e).__name__).inc()
+
+    if inspect.isasyncgenfunction(fn):
+
+        @wraps(fn)
+        async def _wrapped_gen(*args, **kwargs):
+            start = time.perf_counter()
+            gen = fn(*args, **kwargs)
+            try:
+                async for item in gen:
+                    yield item
+            except Exception as e:
+                _record_error(e)
+                raise
+            finally:
+                await gen.aclose()
+                duration.observe(time.perf_counter() - start)
+
+        return _wrapped_gen
+
+    @wraps(fn)
+    async def _wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            _record_error(e)
+            raise
+        finally:
+            duration.observe(time.perf_counter() - start)
+
+    return _wrapped
+
+
+def count_tree_entries(entries: Iterable[dict]) -> int:
+    return sum(1 + count_tree_entries(entry.get("contents", ())) for entry in entries)
+
+
+_DOWNLOAD_ROUTES = frozenset({"/objects/{path:path}"})
+_ARCHIVE_MEDIA_TYPES = (b"application/x-tar", b"application/zip")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every request by route template, as well as upload/download byte counts
+    and in-progress transfers. Streaming bodies are only counted (one addition per ASGI message), never buffered.
+    """
+
+    def __init__(self, app: ASGIApp, backend: str):
+        self.app = app
+        self._uploaded = BYTES_UPLOADED.labels(backend)
+        self._downloaded = BYTES_DOWNLOADED.labels(backend)
+        self._uploads_in_progress = TRANSFERS_IN_PROGRESS.labels(backend, "upload")
+        self._downloads_in_progress = TRANSFERS_IN_PROGRESS.labels(backend, "download")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        method = scope["method"]
+        status_code = 500
+        is_upload = method == "PUT"
+        is_download = False
+
+        if is_upload:
+            self._uploads_in_progress.inc()
+
+        async def _receive() -> Message:
+            message = await receive()
+            if is_upload and message["type"] == "http.request":
+                self._uploaded.inc(len(message.get("body", b"")))
+            return message
+
+        async def _send(message: Message) -> None:
+            nonlocal status_code, is_download
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                route = scope.get("route")
+                is_download = (
+                    route is not None and route.path in _DOWNLOAD_ROUTES and method in ("GET", "POST")
+                ) or any(
+                    v.startswith(_ARCHIVE_MEDIA_TYPES) for k, v in message.get("headers", ()) if k == b"content-type"
+                )
+                if is_download:
+                    self._downloads_in_progress.inc()
+            elif message["type"] == "http.response.body" and is_download:
+                self._downloaded.inc(len(message.get("body", b"")))
+            elif message["type"] == "http.response.pathsend" and is_download:
+                # File sent by the server itself (e.g., FileResponse with the pathsend extension)
+                self._downloaded.inc(os.path.getsize(message["path"]))
+            await send(message)
+
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            if is_upload:
+                self._uploads_in_progress.dec()
+            if is_download:
+                self._downloads_in_progress.dec()
+            # Unmatched requests (e.g., 404s) are grouped together, so arbitrary paths don't create new label values
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                method, route.path if route is not None else "<unmatched>", str(status_code)
+            ).observe(time.perf_counter() - start)
@@ -1,14 +1,24 @@
-from typing import Annotated
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from typing import Annotated, Literal
 
+import orjson
 from bento_lib.auth.permissions import P_DELETE_DROP_BOX, P_INGEST_DROP_BOX, P_VIEW_DROP_BOX
 from bento_lib.auth.resources import RESOURCE_EVERYTHING
-from fastapi import APIRouter, Form, Query, Request, status
+from fastapi import APIRouter, Depends, Form, Query, Request, status
 from fastapi.exceptions import HTTPException
 from fastapi.responses import ORJSONResponse
-from starlette.responses import Response
+from pydantic import BaseModel, Field, model_validator
+from starlette.responses import Response, StreamingResponse
 
 from .authz import authz_middleware
+from .backends.archive import ARCHIVE_MEDIA_TYPES, ArchiveMember, stream_tar, stream_zip
+from .backends.base import DeleteResult, DropBoxBackend, DropBoxEntry, UploadSession
 from .backends.dependency import BackendDependency
+from .backends.filters import TreeFilter
+from .backends.http_utils import is_not_modified
+from .backends.search import SearchQuery
+from .metrics import TREE_ENTRIES, count_tree_entries, render_metrics
 
 drop_box_router = APIRouter()
 
@@ -19,39 +29,291 @@ authz_ingest_dependency = authz_middleware.dep_require_permissions_on_resource(f
 authz_delete_dependency = authz_middleware.dep_require_permissions_on_resource(frozenset({P_DELETE_DROP_BOX}))
 
 
-@drop_box_router.get("/tree", dependencies=(authz_view_dependency,))
-async def drop_box_tree(
-    backend: BackendDependency,
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+CHANGES_TOKEN_HEADER = "X-Changes-Token"
+
+TreeFormatQuery = Annotated[
+    Literal["json", "compact", "ndjson", "tar", "zip"] | None,
+    Query(
+        alias="format",
+        description=(
+            "Tree response format (Optional): nested JSON (default), compact JSON (parallel arrays of entry names, "
+            "parent indices, sizes and timestamps), or newline-delimited JSON, streaming flattened entries as they are "
+            f"listed. NDJSON can also be requested with an Accept: {NDJSON_MEDIA_TYPE} header. "
+            "tar or zip download the files in the (filtered) tree as an archive, generated as it is sent."
+        ),
+    ),
+]
+
+
+def _timestamp(dt: datetime | None) -> float | None:
+    if dt is None:
+        return None
+    # Times without a time zone are taken to be in UTC
+    return (dt if dt.tzinfo is not None else dt.replace(tzinfo=UTC)).timestamp()
+
+
+def _tree_filter(
     include: Annotated[
-        list[str] | None, Query(description="Filter Query Parameter (Optional): File extensions to include in tree")
+        list[str] | None,
+        Query(
+            description=(
+                "Filter Query Parameter (Optional): File name suffixes (e.g. .vcf.gz) or path globs (e.g. run_*/*.vcf, "
+                "where * also matches /) of files to include in tree"
+            )
+        ),
     ] = None,
     ignore: Annotated[
-        list[str] | None, Query(description="Filter Query Parameter (Optional): File extensions to exclude from tree")
+        list[str] | None,
+        Query(
+            description=(
+                "Filter Query Parameter (Optional): File name suffixes or path globs of files to exclude from tree "
+                "(applied on top of include); a glob like tmp/* leaves out the whole directory without listing it"
+            )
+        ),
+    ] = None,
+    min_size: Annotated[int | None, Query(ge=0, description="Minimum file size in bytes (inclusive)")] = None,
+    max_size: Annotated[int | None, Query(ge=0, description="Maximum file size in bytes (inclusive)")] = None,
+    modified_after: Annotated[
+        datetime | None, Query(description="Only files last modified at or after this time (ISO 8601 or Unix time)")
+    ] = None,
+    modified_before: Annotated[
+        datetime | None, Query(description="Only files last modified before this time (ISO 8601 or Unix time)")
     ] = None,
+) -> TreeFilter | None:
+    # Compiled once per request, and applied while the tree is listed
+    tree_filter = TreeFilter(
+        include=include,
+        ignore=ignore,
+        min_size=min_size,
+        max_size=max_size,
+        modified_after=_timestamp(modified_after),
+        modified_before=_timestamp(modified_before),
+    )
+    return tree_filter if tree_filter else None
+
+
+TreeFilterQuery = Annotated[TreeFilter | None, Depends(_tree_filter)]
+DepthQuery = Annotated[
+    int | None,
+    Query(ge=1, description="Listing depth (Optional): 1 lists only the direct children of the directory, etc."),
+]
+LimitQuery = Annotated[
+    int | None,
+    Query(ge=1, le=1000, description="Page size (Optional): maximum number of direct children of the directory"),
+]
+CursorQuery = Annotated[
+    str | None,
+    Query(description=f"Page cursor (Optional): value of the {NEXT_CURSOR_HEADER} header of the previous page"),
+]
+
+
+async def _ndjson_stream(backend: DropBoxBackend, entries: AsyncIterator[DropBoxEntry]) -> AsyncIterator[bytes]:
+    n_entries = 0
+    async for entry in entries:
+        n_entries += 1
+        yield orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    TREE_ENTRIES.labels(backend.metrics_name).observe(n_entries)
+
+
+async def _start_listing(entries: AsyncIterator[DropBoxEntry]) -> AsyncIterator[DropBoxEntry] | None:
+    """
+    Starts listing before sending a streaming response, so that errors (e.g., invalid filters) can still be reported
+    with an appropriate status code rather than cutting off the stream. Returns None if there are no entries.
+    """
+
+    try:
+        first_entry = await anext(entries)
+    except StopAsyncIteration:
+        return None
+
+    async def _entries_with_first():
+        yield first_entry
+        async for e in entries:
+            yield e
+
+    return _entries_with_first()
+
+
+async def _archive_members(
+    backend: DropBoxBackend, sub_path: str | None, entries: AsyncIterator[DropBoxEntry]
+) -> AsyncIterator[ArchiveMember]:
+    # Members are named relative to the requested directory's parent, so the archive extracts into a single directory
+    # named like the requested one (or, for the whole drop box, into the current directory).
+    directory_path = sub_path.strip("/") if sub_path else ""
+    base_path = directory_path.rpartition("/")[0]
+
+    async def _entries_in_directory():
+        # Leave out anything not strictly inside the requested directory (e.g., S3 "directories" along the prefix)
+        async for entry in entries:
+            if not directory_path or entry["relativePath"].strip("/").startswith(f"{directory_path}/"):
+                yield entry
+
+    async for entry, contents in backend.iter_file_contents(_entries_in_directory()):
+        arcname = entry["relativePath"].strip("/").removeprefix(f"{base_path}/" if base_path else "")
+        yield arcname, entry, contents
+
+
+async def _archive_response(
+    backend: DropBoxBackend,
+    sub_path: str | None,
+    filters: TreeFilter | None,
+    archive_format: str,
 ) -> Response:
-    return ORJSONResponse(await backend.get_directory_tree(include=include, ignore=ignore))
+    entries = await _start_listing(backend.iter_directory_entries(sub_path=sub_path, filters=filters))
+    if entries is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No files found to archive")
+
+    archive_name = (sub_path.strip("/").rpartition("/")[2] if sub_path else "") or "drop_box"
+    stream = stream_tar if archive_format == "tar" else stream_zip
+    return StreamingResponse(
+        stream(_archive_members(backend, sub_path, entries)),
+        media_type=ARCHIVE_MEDIA_TYPES[archive_format],
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}.{archive_format}"'},
+    )
+
+
+async def _tree_response(
+    request: Request,
+    backend: DropBoxBackend,
+    sub_path: str | None,
+    filters: TreeFilter | None,
+    tree_format: str | None,
+    depth: int | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+) -> Response:
+    if depth is not None or limit is not None or cursor is not None:
+        # Depth-limited and/or paginated listing, e.g. for expanding directories on demand
+        if tree_format not in (None, "json"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Depth and pagination are not supported for {tree_format}",
+            )
+        entries, next_cursor = await backend.get_directory_listing(
+            sub_path=sub_path, depth=depth, limit=limit, cursor=cursor, filters=filters
+        )
+        TREE_ENTRIES.labels(backend.metrics_name).observe(count_tree_entries(entries))
+        return ORJSONResponse(entries, headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
+
+    if tree_format == "ndjson" or (tree_format is None and NDJSON_MEDIA_TYPE in request.headers.get("Accept", "")):
+        entries = await _start_listing(backend.iter_directory_entries(sub_path=sub_path, filters=filters))
+        if entries is None:
+            return Response(media_type=NDJSON_MEDIA_TYPE)
+        return StreamingResponse(_ndjson_stream(backend, entries), media_type=NDJSON_MEDIA_TYPE)
+
+    if tree_format in ARCHIVE_MEDIA_TYPES:
+        return await _archive_response(backend, sub_path, filters, tree_format)
+
+    # The change feed position is taken before building the tree, so changes made while it is built aren't missed
+    headers = {CHANGES_TOKEN_HEADER: backend.changes_token}
+    tree = await backend.get_directory_tree(sub_path=sub_path, filters=filters)
+    etag = backend.get_tree_etag(tree, sub_path=sub_path, filters=filters)
+    if tree_format == "compact":
+        etag = f'{etag[:-1]}-compact"'  # each representation of the tree gets its own ETag
+    headers["ETag"] = etag
+    if is_not_modified({"etag": etag}, request.headers):
+        # Pollers re-requesting an unchanged tree don't need it serialized and sent again
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    TREE_ENTRIES.labels(backend.metrics_name).observe(count_tree_entries(tree))
+    return ORJSONResponse(backend.compact_tree(tree) if tree_format == "compact" else tree, headers=headers)
+
+
+def _content_length(request: Request) -> int:
+    content_length = int(request.headers.get("Content-Length", "0"))
+    if content_length == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No file provided or no/zero content length specified"
+        )
+    return content_length
+
+
+@drop_box_router.get("/tree", dependencies=(authz_view_dependency,))
+async def drop_box_tree(
+    request: Request,
+    backend: BackendDependency,
+    filters: TreeFilterQuery,
+    tree_format: TreeFormatQuery = None,
+    depth: DepthQuery = None,
+    limit: LimitQuery = None,
+    cursor: CursorQuery = None,
+) -> Response:
+    return await _tree_response(request, backend, None, filters, tree_format, depth, limit, cursor)
 
 
 @drop_box_router.get("/tree/{path:path}", dependencies=(authz_view_dependency,))
 async def drop_box_subtree(
+    request: Request,
     backend: BackendDependency,
     path: str | None,
-    include: Annotated[
-        list[str] | None, Query(description="Filter Query Parameter (Optional): File extensions to include in tree")
+    filters: TreeFilterQuery,
+    tree_format: TreeFormatQuery = None,
+    depth: DepthQuery = None,
+    limit: LimitQuery = None,
+    cursor: CursorQuery = None,
+) -> Response:
+    # Same as /tree endpoint, but accepts a subpath in order to return a directory sub-tree.
+    # Useful to download files for WES workflows that take a directory input; with format=tar or format=zip, the files
+    # themselves are downloaded in a single request.
+    # Also supports listing only down to a given depth, and paging through the directory's direct children, so that
+    # directories can be expanded on demand.
+    return await _tree_response(request, backend, path, filters, tree_format, depth, limit, cursor)
+
+
+@drop_box_router.get("/changes", dependencies=(authz_view_dependency,))
+async def drop_box_changes(
+    backend: BackendDependency,
+    since: Annotated[
+        str | None,
+        Query(description=f"Token from a tree response's {CHANGES_TOKEN_HEADER} header, or from the previous request"),
     ] = None,
-    ignore: Annotated[
-        list[str] | None, Query(description="Filter Query Parameter (Optional): File extensions to exclude from tree")
+) -> Response:
+    # Files added, modified or removed since the token was issued (one change per file), so clients can keep a copy of
+    # the tree in sync without re-fetching it. Without a token, only returns the current token. Tokens expire once the
+    # service restarts or too many changes have happened since (410); clients then need to re-fetch the tree.
+    changes = backend.get_changes(since) if since is not None else []
+    return ORJSONResponse({"token": backend.changes_token, "changes": changes})
+
+
+@drop_box_router.get("/search", dependencies=(authz_view_dependency,))
+async def drop_box_search(
+    backend: BackendDependency,
+    prefix: Annotated[str, Query(description="Path prefix, relative to the root of the drop box")] = "",
+    glob: Annotated[
+        list[str] | None,
+        Query(description="Glob pattern(s) matched against file paths (* also matches /, e.g. *.vcf.gz at any depth)"),
     ] = None,
+    suffix: Annotated[list[str] | None, Query(description="File name suffix(es), e.g. .vcf.gz")] = None,
+    min_size: Annotated[int | None, Query(ge=0, description="Minimum file size in bytes (inclusive)")] = None,
+    max_size: Annotated[int | None, Query(ge=0, description="Maximum file size in bytes (inclusive)")] = None,
+    modified_after: Annotated[
+        datetime | None, Query(description="Only files last modified at or after this time (ISO 8601 or Unix time)")
+    ] = None,
+    modified_before: Annotated[
+        datetime | None, Query(description="Only files last modified before this time (ISO 8601 or Unix time)")
+    ] = None,
+    limit: Annotated[int, Query(ge=1, le=1000, description="Page size: maximum number of files returned")] = 100,
+    cursor: CursorQuery = None,
 ) -> Response:
-    # Same as /tree endpoint, but accepts a subpath in order to return a directory sub-tree.
-    # Useful to download files for WES workflows that take a directory input.
-    tree = await backend.get_directory_tree(sub_path=path, include=include, ignore=ignore)
-    return ORJSONResponse(tree)
+    # Finds files by metadata without clients having to download and filter the whole tree. All given predicates must
+    # match; results are file entries (like in the tree) sorted by path, paginated with the X-Next-Cursor header.
+    query = SearchQuery(
+        prefix=prefix,
+        globs=glob,
+        suffixes=suffix,
+        min_size=min_size,
+        max_size=max_size,
+        modified_after=_timestamp(modified_after),
+        modified_before=_timestamp(modified_before),
+    )
+    entries, next_cursor = await backend.search(query, limit, cursor)
+    return ORJSONResponse(entries, headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
 
 
 @drop_box_router.get("/objects/{path:path}", dependencies=(authz_view_dependency,))
-async def drop_box_retrieve(path: str, backend: BackendDependency):
-    return await backend.retrieve_from_path(path)
+async def drop_box_retrieve(request: Request, path: str, backend: BackendDependency):
+    return await backend.retrieve_from_path(request, path)
 
 
 @drop_box_router.post("/objects/{path:path}")
@@ -70,17 +332,12 @@ async def drop_box_retrieve_post(
         headers_getter=(lambda _r: {"Authorization": f"Bearer {token}"}),
     )
 
-    return await backend.retrieve_from_path(path)
+    return await backend.retrieve_from_path(request, path)
 
 
 @drop_box_router.put("/objects/{path:path}", dependencies=(authz_ingest_dependency,))
 async def drop_box_upload(request: Request, path: str, backend: BackendDependency):
-    content_length = int(request.headers.get("Content-Length", "0"))
-    if content_length == 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="No file provided or no/zero content length specified"
-        )
-    return await backend.upload_to_path(request, path, content_length)
+    return await backend.upload_to_path(request, path, _content_length(request))
 
 
 @drop_box_router.delete(
@@ -90,3 +347,82 @@ async def drop_box_upload(request: Request, path: str, backend: BackendDependenc
 )
 async def drop_box_delete(path: str, backend: BackendDependency):
     return await backend.delete_at_path(path)
+
+
+class BatchDeleteRequest(BaseModel):
+    paths: list[str] | None = Field(
+        default=None, min_length=1, max_length=10000, description="Paths of the files to delete"
+    )
+    prefix: str | None = Field(default=None, description="Directory under which every file is deleted")
+
+    @model_validator(mode="after")
+    def _check_paths_or_prefix(self):
+        if (self.paths is None) == (self.prefix is None):
+            raise ValueError("Exactly one of paths or prefix must be specified")
+        return self
+
+
+@drop_box_router.post("/delete", dependencies=(authz_delete_dependency,))
+async def drop_box_delete_batch(body: BatchDeleteRequest, backend: BackendDependency) -> list[DeleteResult]:
+    # Deletes many files in one request (e.g., to clean up after an ingestion run), returning the outcome for each file
+    return await backend.delete_paths(paths=body.paths, prefix=body.prefix)
+
+
+class UploadCreateRequest(BaseModel):
+    path: str = Field(description="Destination path of the uploaded file, relative to the root of the drop box")
+    size: int = Field(gt=0, description="Total length of the file, in bytes")
+
+
+# Resumable uploads: a session is created for a destination path and file size, then parts are uploaded at offsets
+# which are multiples of the session's part size (in any order, in parallel, and again if interrupted), and the file is
+# only written to its destination once the session is completed. The session status lists the parts received so far.
+
+
+@drop_box_router.post("/uploads", status_code=status.HTTP_201_CREATED, dependencies=(authz_ingest_dependency,))
+async def drop_box_upload_create(body: UploadCreateRequest, backend: BackendDependency) -> UploadSession:
+    return await backend.create_upload(body.path, body.size)
+
+
+@drop_box_router.get("/uploads/{upload_id}", dependencies=(authz_ingest_dependency,))
+async def drop_box_upload_status(upload_id: str, backend: BackendDependency) -> UploadSession:
+    return await backend.get_upload_status(upload_id)
+
+
+@drop_box_router.put(
+    "/uploads/{upload_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=(authz_ingest_dependency,),
+)
+async def drop_box_upload_part(
+    request: Request,
+    upload_id: str,
+    offset: Annotated[int, Query(ge=0, description="Offset of the part within the file, in bytes")],
+    backend: BackendDependency,
+):
+    await backend.upload_part(upload_id, offset, request, _content_length(request))
+
+
+@drop_box_router.post(
+    "/uploads/{upload_id}/complete",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=(authz_ingest_dependency,),
+)
+async def drop_box_upload_complete(upload_id: str, backend: BackendDependency):
+    await backend.complete_upload(upload_id)
+
+
+@drop_box_router.delete(
+    "/uploads/{upload_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=(authz_ingest_dependency,),
+)
+async def drop_box_upload_abort(upload_id: str, backend: BackendDependency):
+    await backend.abort_upload(upload_id)
+
+
+@drop_box_router.get("/metrics", dependencies=(authz_view_dependency,))
+async def drop_box_metrics(request: Request) -> Response:
+    # Prometheus metrics: request latency by route, backend operation timings/errors, transfer volumes, tree sizes.
+    # These reveal traffic and error patterns, so they need the same permission as viewing the drop box.
+    content, content_type = render_metrics(request.headers.get("accept"))
+    return Response(content, media_type=content_type)
@@ -1,3 +1,4 @@
+import logging
 import os
 import pathlib
 from functools import lru_cache
@@ -5,8 +6,12 @@ from functools import lru_cache
 import pytest
 from fastapi.testclient import TestClient
 
+from bento_drop_box_service.backends.dependency import get_backend
+from bento_drop_box_service.backends.s3 import S3Backend
 from bento_drop_box_service.config import Config, get_config
 
+from .fake_s3 import FakeS3Client
+
 local_dir = str(pathlib.Path(__file__).parent / "test_data")
 bucket_name = "test"
 
@@ -32,3 +37,91 @@ def client_local(test_config: Config):
 
     application.dependency_overrides[get_config] = get_test_local_config
     yield TestClient(application)
+
+
+@pytest.fixture()
+def make_local_client(test_config: Config, tmp_path):
+    """
+    Factory for test clients of the local backend, serving a writable temporary drop box, with optional config updates.
+    """
+
+    from bento_drop_box_service.app import application
+
+    def _make_local_client(**config_updates) -> TestClient:
+        config = test_config.model_copy(
+            update={
+                "service_data": str(tmp_path),
+                "local_upload_buffer_size": 256 * 1024,
+                "resumable_upload_part_size": 5 * 1024 * 1024,
+                **config_updates,
+            }
+        )
+        application.dependency_overrides[get_config] = lambda: config
+        return TestClient(application)
+
+    yield _make_local_client
+    application.dependency_overrides[get_config] = get_test_local_config
+
+
+@pytest.fixture()
+def client_local_writable(make_local_client):
+    yield make_local_client()
+
+
+@pytest.fixture()
+def s3_client():
+    yield FakeS3Client()
+
+
+@pytest.fixture()
+def make_s3_backend(test_config: Config, s3_client: FakeS3Client):
+    """
+    Factory for S3 backends using the in-process fake S3 client, with optional config updates.
+    """
+
+    def _make_s3_backend(**config_updates) -> S3Backend:
+        backend = S3Backend(
+            test_config.model_copy(
+                update={
+                    "s3_endpoint": "s3.local",
+                    "s3_bucket": bucket_name,
+                    "s3_multipart_part_size": 5 * 1024 * 1024,
+                    "s3_multipart_concurrency": 2,
+                    "resumable_upload_part_size": 5 * 1024 * 1024,
+                    **config_updates,
+                }
+            ),
+            logging.getLogger(__name__),
+        )
+        # Use the in-process fake instead of a real client connection pool
+        backend._s3_client = s3_client
+        return backend
+
+    yield _make_s3_backend
+
+
+@pytest.fixture()
+def s3_backend(make_s3_backend):
+    yield make_s3_backend()
+
+
+@pytest.fixture()
+def make_s3_client():
+    """
+    Factory for test clients serving a given S3 backend.
+    """
+
+    from bento_drop_box_service.app import application
+
+    def _make_s3_client(backend: S3Backend) -> TestClient:
+        application.dependency_overrides[get_config] = get_test_local_config
+        application.dependency_overrides[get_backend] = lambda: backend
+        return TestClient(application, raise_server_exceptions=False)
+
+    yield _make_s3_client
+    application.dependency_overrides.pop(get_backend, None)
+
+
+@pytest.fixture()
+def client_s3(make_s3_client, s3_backend: S3Backend):
+    yield make_s3_client(s3_backend)
@@ -0,0 +1,301 @@
+import hashlib
+import re
+import uuid
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from functools import cached_property
+
+from botocore.exceptions import ClientError
+
+__all__ = ["FakeS3Client"]
+
+
+def _client_error(code: str, http_status: int, operation: str) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": http_status}}, operation
+    )
+
+
+@dataclass
+class FakeS3Object:
+    body: bytes
+    last_modified: datetime = field(default_factory=lambda: datetime.now(UTC).replace(microsecond=0))
+    content_type: str = "binary/octet-stream"
+    metadata: dict[str, str] = field(default_factory=dict)  # user metadata
+
+    @cached_property  # objects are replaced rather than modified, and hashing large bodies takes a while
+    def etag(self) -> str:
+        return f'"{hashlib.md5(self.body).hexdigest()}"'
+
+
+@dataclass
+class FakeMultipartUpload:
+    key: str
+    initiated: datetime = field(default_factory=lambda: datetime.now(UTC))
+    parts: dict[int, bytes] = field(default_factory=dict)
+
+
+class FakeStreamingBody:
+    def __init__(self, body: bytes, read_sizes: list[int] | None = None):
+        self._body = body
+        self._offset = 0
+        self._read_sizes = read_sizes
+        self.closed = False
+
+    async def read(self, amt: int | None = None) -> bytes:
+        if self._read_sizes is not None:
+            self._read_sizes.append(amt)
+        end = len(self._body) if amt is None else self._offset + amt
+        chunk = self._body[self._offset : end]
+        self._offset += len(chunk)
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_args):
+        self.closed = True
+
+
+class FakeListObjectsV2Paginator:
+    def __init__(self, client: "FakeS3Client"):
+        self._client = client
+
+    async def paginate(self, PaginationConfig: dict | None = None, **kwargs):
+        kwargs["MaxKeys"] = (PaginationConfig or {}).get("PageSize", 1000)
+        while True:
+            page = await self._client.list_objects_v2(**kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                break
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+class FakeS3Client:
+    """
+    In-process stand-in for the subset of the aioboto3 S3 client API used by S3Backend, backed by a dictionary.
+    """
+
+    def __init__(self):
+        self.objects: dict[str, FakeS3Object] = {}
+        self.multipart_uploads: dict[str, FakeMultipartUpload] = {}
+        self.aborted_uploads: list[str] = []
+        self.calls: list[str] = []
+        self.list_prefixes: list[str] = []  # Prefix of each list_objects_v2 call
+        self.get_ranges: list[str | None] = []  # Range of each get_object call
+        self.read_sizes: list[int | None] = []  # size requested by each object body read
+        self.fail_upload_part: int | None = None  # if set, upload_part fails for this part number
+
+    def put(self, key: str, body: bytes, **kwargs) -> None:
+        self.objects[key] = FakeS3Object(body, **kwargs)
+
+    async def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        Delimiter: str | None = None,
+        MaxKeys: int = 1000,
+        StartAfter: str | None = None,
+        ContinuationToken: str | None = None,
+    ):
+        self.calls.append("list_objects_v2")
+        self.list_prefixes.append(Prefix)
+
+        after = ContinuationToken or StartAfter or ""
+        # (key or common prefix, is common prefix), in key order, as S3 returns them
+        items: list[tuple[str, bool]] = []
+        for key in sorted(k for k in self.objects if k.startswith(Prefix) and k > after):
+            if Delimiter and Delimiter in key[len(Prefix) :]:
+                common_prefix = key[: key.index(Delimiter, len(Prefix)) + 1]
+                if items and items[-1] == (common_prefix, True):
+                    continue
+                if common_prefix <= after:  # still inside a common prefix which was already returned
+                    continue
+                items.append((common_prefix, True))
+            else:
+                items.append((key, False))
+
+        page_items, is_truncated = items[:MaxKeys], len(items) > MaxKeys
+        page: dict = {"KeyCount": len(page_items), "IsTruncated": is_truncated}
+        if is_truncated:
+            # S3 continues after the last key or common prefix (including every key under it)
+            last, last_is_prefix = page_items[-1]
+            page["NextContinuationToken"] = last + ("\U0010ffff" if last_is_prefix else "")
+        if contents := [k for k, is_prefix in page_items if not is_prefix]:
+            page["Contents"] = [
+                {
+                    "Key": k,
+                    "Size": len(self.objects[k].body),
+                    "LastModified": self.objects[k].last_modified,
+                    "ETag": self.objects[k].etag,
+                }
+                for k in contents
+            ]
+        if common_prefixes := [k for k, is_prefix in page_items if is_prefix]:
+            page["CommonPrefixes"] = [{"Prefix": p} for p in common_prefixes]
+        return page
+
+    def get_paginator(self, operation: str):
+        assert operation == "list_objects_v2"
+        return FakeListObjectsV2Paginator(self)
+
+    async def put_object(self, Bucket: str, Key: str, Body: bytes, Metadata: dict[str, str] | None = None, **_kwargs):
+        self.calls.append("put_object")
+        self.put(Key, Body, metadata=dict(Metadata or {}))
+        return {"ETag": self.objects[Key].etag}
+
+    async def copy_object(
+        self,
+        Bucket: str,
+        Key: str,
+        CopySource: dict,
+        Metadata: dict[str, str] | None = None,
+        MetadataDirective: str = "COPY",
+    ):
+        self.calls.append("copy_object")
+        if (source := self.objects.get(CopySource["Key"])) is None:
+            raise _client_error("NoSuchKey", 404, "CopyObject")
+        metadata = dict(Metadata or {}) if MetadataDirective == "REPLACE" else dict(source.metadata)
+        self.put(Key, source.body, content_type=source.content_type, metadata=metadata)
+        return {"CopyObjectResult": {"ETag": self.objects[Key].etag, "LastModified": self.objects[Key].last_modified}}
+
+    async def head_object(self, Bucket: str, Key: str):
+        self.calls.append("head_object")
+        if (obj := self.objects.get(Key)) is None:
+            raise _client_error("404", 404, "HeadObject")
+        return {
+            "ContentLength": len(obj.body),
+            "ContentType": obj.content_type,
+            "ETag": obj.etag,
+            "LastModified": obj.last_modified,
+            "Metadata": dict(obj.metadata),
+        }
+
+    async def get_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Range: str | None = None,
+        IfMatch: str | None = None,
+        IfNoneMatch: str | None = None,
+        IfModifiedSince: datetime | None = None,
+        IfUnmodifiedSince: datetime | None = None,
+    ):
+        self.calls.append("get_object")
+        self.get_ranges.append(Range)
+        if (obj := self.objects.get(Key)) is None:
+            raise _client_error("NoSuchKey", 404, "GetObject")
+
+        if (IfMatch is not None and IfMatch != obj.etag) or (
+            IfUnmodifiedSince is not None and obj.last_modified > IfUnmodifiedSince
+        ):
+            raise _client_error("PreconditionFailed", 412, "GetObject")
+
+        if (IfNoneMatch is not None and IfNoneMatch == obj.etag) or (
+            IfModifiedSince is not None and obj.last_modified <= IfModifiedSince
+        ):
+            error = _client_error("304", 304, "GetObject")
+            error.response["ResponseMetadata"]["HTTPHeaders"] = {"etag": obj.etag}
+            raise error
+
+        res: dict = {
+            "ContentType": obj.content_type,
+            "ETag": obj.etag,
+            "LastModified": obj.last_modified,
+            "Metadata": dict(obj.metadata),
+        }
+        body = obj.body
+        size = len(obj.body)
+
+        # S3 supports a single "bytes=start-end", "bytes=start-" or "bytes=-suffix" range, and ignores invalid ones
+        if Range is not None and (m := re.fullmatch(r"bytes=(\d*)-(\d*)", Range)) and any(m.groups()):
+            start_str, end_str = m.groups()
+            start = int(start_str) if start_str else max(size - int(end_str), 0)
+            end = min(int(end_str), size - 1) if start_str and end_str else size - 1
+            if start >= size:
+                error = _client_error("InvalidRange", 416, "GetObject")
+                error.response["Error"]["ActualObjectSize"] = str(size)
+                raise error
+            if start <= end:
+                body = obj.body[start : end + 1]
+                res["ContentRange"] = f"bytes {start}-{end}/{size}"
+
+        return {**res, "Body": FakeStreamingBody(body, self.read_sizes), "ContentLength": len(body)}
+
+    async def delete_object(self, Bucket: str, Key: str):
+        self.calls.append("delete_object")
+        self.objects.pop(Key, None)
+        return {}
+
+    async def delete_objects(self, Bucket: str, Delete: dict):
+        self.calls.append("delete_objects")
+        assert len(Delete["Objects"]) <= 1000
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+        return {} if Delete.get("Quiet") else {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
+
+    def _get_multipart_upload(self, Key: str, UploadId: str, operation: str) -> FakeMultipartUpload:
+        if (upload := self.multipart_uploads.get(UploadId)) is None or upload.key != Key:
+            raise _client_error("NoSuchUpload", 404, operation)
+        return upload
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, **_kwargs):
+        self.calls.append("create_multipart_upload")
+        upload_id = str(uuid.uuid4())
+        self.multipart_uploads[upload_id] = FakeMultipartUpload(Key)
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    async def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes):
+        self.calls.append("upload_part")
+        if PartNumber == self.fail_upload_part:
+            raise _client_error("InternalError", 500, "UploadPart")
+        self._get_multipart_upload(Key, UploadId, "UploadPart").parts[PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    async def list_parts(self, Bucket: str, Key: str, UploadId: str, MaxParts: int = 1000, PartNumberMarker: int = 0):
+        self.calls.append("list_parts")
+        upload = self._get_multipart_upload(Key, UploadId, "ListParts")
+        part_numbers = sorted(n for n in upload.parts if n > PartNumberMarker)
+        page = part_numbers[:MaxParts]
+        res: dict = {
+            "Parts": [
+                {"PartNumber": n, "Size": len(upload.parts[n]), "ETag": f'"{hashlib.md5(upload.parts[n]).hexdigest()}"'}
+                for n in page
+            ],
+            "IsTruncated": len(part_numbers) > MaxParts,
+        }
+        if res["IsTruncated"]:
+            res["NextPartNumberMarker"] = page[-1]
+        return res
+
+    async def list_multipart_uploads(
+        self, Bucket: str, MaxUploads: int = 1000, KeyMarker: str = "", UploadIdMarker: str = ""
+    ):
+        self.calls.append("list_multipart_uploads")
+        uploads = sorted(
+            (u.key, upload_id, u.initiated)
+            for upload_id, u in self.multipart_uploads.items()
+            if (u.key, upload_id) > (KeyMarker, UploadIdMarker)
+        )
+        page = uploads[:MaxUploads]
+        res: dict = {
+            "Uploads": [{"Key": k, "UploadId": u, "Initiated": i} for k, u, i in page],
+            "IsTruncated": len(uploads) > MaxUploads,
+        }
+        if res["IsTruncated"]:
+            res["NextKeyMarker"], res["NextUploadIdMarker"] = page[-1][:2]
+        return res
+
+    async def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict):
+        self.calls.append("complete_multipart_upload")
+        parts = self._get_multipart_upload(Key, UploadId, "CompleteMultipartUpload").parts
+        del self.multipart_uploads[UploadId]
+        self.put(Key, b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"]))
+        return {"Key": Key, "ETag": self.objects[Key].etag}
+
+    async def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        self.calls.append("abort_multipart_upload")
+        self._get_multipart_upload(Key, UploadId, "AbortMultipartUpload")
+        del self.multipart_uploads[UploadId]
+        self.aborted_uploads.append(UploadId)
+        return {}
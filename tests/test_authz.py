@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from bento_lib.auth.exceptions import BentoAuthException
+from bento_lib.auth.permissions import P_DELETE_DROP_BOX, P_VIEW_DROP_BOX
+from bento_lib.auth.resources import RESOURCE_EVERYTHING
+
+VIEW = frozenset({P_VIEW_DROP_BOX})
+DELETE = frozenset({P_DELETE_DROP_BOX})
+
+
+def _jwt(exp: float | None) -> str:
+    claims = {"sub": "user"} if exp is None else {"sub": "user", "exp": exp}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b"=").decode()
+    return f"Bearer eyJhbGciOiJub25lIn0.{payload}.sig"
+
+
+def _request(authorization: str | None = None):
+    return SimpleNamespace(headers={"Authorization": authorization} if authorization else {}, state=SimpleNamespace())
+
+
+@pytest.fixture()
+def authz(test_config):
+    # The module builds the service's middleware instance from the config when imported
+    from bento_drop_box_service import authz
+
+    yield authz
+
+
+def _middleware(monkeypatch, authz, allowed_permissions: frozenset, cache_size: int = 16, cache_ttl: float = 60):
+    middleware = authz.CachingFastApiAuthMiddleware(
+        "https://authz.local", decision_cache=authz.AuthzDecisionCache(cache_size, cache_ttl)
+    )
+    calls = []
+
+    async def _authz_post(request, path, body, require_token=False, headers_getter=None):
+        calls.append(headers_getter(request) if headers_getter else {"Authorization": request.headers["Authorization"]})
+        return {"result": [[p in allowed_permissions for p in body["permissions"]]]}
+
+    monkeypatch.setattr(middleware, "async_authz_post", _authz_post)
+    return middleware, calls
+
+
+@pytest.mark.asyncio
+async def test_authz_cache_hits_and_misses(monkeypatch, authz):
+    middleware, calls = _middleware(monkeypatch, authz, VIEW)
+    token = _jwt(time.time() + 3600)
+
+    for _ in range(3):
+        req = _request(token)
+        await middleware.async_check_authz_evaluate(req, VIEW, RESOURCE_EVERYTHING, set_authz_flag=True)
+        assert req.state.bento_determined_authz
+    assert calls == [{"Authorization": token}]
+
+    # Denials are cached too, separately for each permission set
+    for _ in range(2):
+        with pytest.raises(BentoAuthException) as e:
+            await middleware.async_check_authz_evaluate(_request(token), DELETE, RESOURCE_EVERYTHING)
+        assert e.value.status_code == 403
+    assert len(calls) == 2
+
+    # Different tokens, resources, and token-passing methods are keyed separately/together as expected
+    other_token = _jwt(time.time() + 3600)[:-1] + "x"
+    await middleware.async_check_authz_evaluate(_request(other_token), VIEW, RESOURCE_EVERYTHING)
+    await middleware.async_check_authz_evaluate(_request(token), VIEW, {"project": "p1"})
+    assert len(calls) == 4
+    await middleware.async_check_authz_evaluate(
+        _request(), VIEW, RESOURCE_EVERYTHING, headers_getter=lambda _r: {"Authorization": token}
+    )
+    assert len(calls) == 4
+
+    # Raw tokens are never held by the cache
+    assert all(token.encode() not in repr(k).encode() for k in middleware.decision_cache._entries)
+
+    # Direct evaluations share the cache, with results in the order of the requested permissions
+    assert await middleware.async_evaluate(_request(token), [RESOURCE_EVERYTHING], [P_VIEW_DROP_BOX]) == ((True,),)
+    assert len(calls) == 4
+    permissions = [P_DELETE_DROP_BOX, P_VIEW_DROP_BOX]
+    assert await middleware.async_evaluate(_request(token), [RESOURCE_EVERYTHING], permissions) == ((False, True),)
+    assert await middleware.async_evaluate(_request(token), [RESOURCE_EVERYTHING], permissions) == ((False, True),)
+    assert len(calls) == 5
+
+
+@pytest.mark.asyncio
+async def test_authz_cache_expiry(monkeypatch, authz):
+    middleware, calls = _middleware(monkeypatch, authz, VIEW)
+
+    # Decisions for tokens without a readable expiry, or which have already expired, are not cached
+    for token in (_jwt(None), "Bearer opaque", _jwt(time.time() - 1)):
+        for _ in range(2):
+            await middleware.async_check_authz_evaluate(_request(token), VIEW, RESOURCE_EVERYTHING)
+    assert len(calls) == 6
+
+    # Entries expire with the token if it expires before the TTL
+    token = _jwt(time.time() + 0.2)
+    await middleware.async_check_authz_evaluate(_request(token), VIEW, RESOURCE_EVERYTHING)
+    await middleware.async_check_authz_evaluate(_request(token), VIEW, RESOURCE_EVERYTHING)
+    assert len(calls) == 7
+    await asyncio.sleep(0.25)
+    await middleware.async_check_authz_evaluate(_request(token), VIEW, RESOURCE_EVERYTHING)
+    assert len(calls) == 8
+
+    # Missing tokens are still rejected without asking the authorization service
+    with pytest.raises(BentoAuthException):
+        await middleware.async_check_authz_evaluate(_request(), VIEW, RESOURCE_EVERYTHING)
+    assert len(calls) == 8
+
+
+@pytest.mark.asyncio
+async def test_authz_cache_bounded_and_disabled(monkeypatch, authz):
+    middleware, calls = _middleware(monkeypatch, authz, VIEW, cache_size=2)
+    tokens = [_jwt(time.time() + 3600 + i) for i in range(3)]
+    for token in tokens:
+        await middleware.async_check_authz_evaluate(_request(token), VIEW, RESOURCE_EVERYTHING)
+    assert len(middleware.decision_cache._entries) == 2
+    await middleware.async_check_authz_evaluate(_request(tokens[0]), VIEW, RESOURCE_EVERYTHING)  # evicted
+    assert len(calls) == 4
+
+    middleware, calls = _middleware(monkeypatch, authz, VIEW, cache_ttl=0)
+    for _ in range(2):
+        await middleware.async_check_authz_evaluate(_request(tokens[0]), VIEW, RESOURCE_EVERYTHING)
+    assert len(calls) == 2
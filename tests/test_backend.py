@@ -1,6 +1,28 @@
+import asyncio
+import base64
+import hashlib
 import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+from datetime import UTC, datetime, timedelta
 
+import orjson
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+from bento_drop_box_service.backends.base import DropBoxEntry
+from bento_drop_box_service.backends.checksums import ChecksumCache
 from bento_drop_box_service.backends.dependency import get_backend
+from bento_drop_box_service.backends.filters import TreeFilter
+from bento_drop_box_service.backends.local import LocalBackend
+from bento_drop_box_service.backends.local_index import LocalMetadataIndex
+from bento_drop_box_service.backends.s3 import S3Backend
+from bento_drop_box_service.backends.search import SearchQuery
+from bento_drop_box_service.backends.tree_cache import DirectoryTreeCache
 from bento_drop_box_service.config import Config
 
 
@@ -8,3 +30,580 @@ def test_backend_logger(test_config: Config):
     test_logger = logging.getLogger(__name__)
     b = get_backend(test_config, test_logger)
     assert b.logger == test_logger
+
+
+@pytest.mark.asyncio
+async def test_local_backend_traversal_limit(test_config: Config):
+    b = LocalBackend(test_config.model_copy(update={"traversal_limit": 0}), logging.getLogger(__name__))
+    tree = await b.get_directory_tree()
+
+    # Root level is listed, but directories beyond the limit are not scanned
+    assert sorted(e["name"] for e in tree) == ["patate.txt", "some_dir", "tomate.vcf", "zucchini.json"]
+    some_dir = next(e for e in tree if e["name"] == "some_dir")
+    assert some_dir["contents"] == []
+
+
+@pytest.mark.asyncio
+async def test_local_backend_tree_cache(test_config: Config, tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "sub").mkdir()
+
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "tree_cache_staleness": 0}),
+        logging.getLogger(__name__),
+    )
+
+    tree = await b.get_directory_tree()
+    assert [e["name"] for e in tree] == ["a.txt", "sub"]
+    # Nothing changed on disk: the cached tree is re-validated and re-used
+    assert await b.get_directory_tree() is tree
+    # Different filters are cached separately
+    assert [e["name"] for e in await b.get_directory_tree(filters=TreeFilter(include=[".txt"]))] == ["a.txt"]
+
+    # Outside changes in a nested directory are picked up through directory mtimes
+    (tmp_path / "sub" / "b.txt").write_text("b")
+    tree_2 = await b.get_directory_tree()
+    assert tree_2 is not tree
+    assert [e["name"] for e in tree_2[1]["contents"]] == ["b.txt"]
+
+    # The service's own deletes invalidate the cache
+    await b.delete_at_path("sub/b.txt")
+    assert (await b.get_directory_tree())[1]["contents"] == []
+
+
+@pytest.mark.asyncio
+async def test_local_backend_tree_cache_disabled(test_config: Config, tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "tree_cache_size": 0}),
+        logging.getLogger(__name__),
+    )
+    assert len(await b.get_directory_tree()) == 1
+    assert await b.get_directory_tree() is not await b.get_directory_tree()
+
+
+@pytest.mark.asyncio
+async def test_tree_cache_build_survives_cancelled_request():
+    cache = DirectoryTreeCache(10, 60)
+    release = asyncio.Event()
+    n_builds = 0
+    tree: tuple[DropBoxEntry, ...] = ({"name": "a.txt", "filePath": "/a.txt", "relativePath": "/a.txt"},)
+
+    async def _build(_directory_mtimes):
+        nonlocal n_builds
+        n_builds += 1
+        await release.wait()
+        return tree
+
+    # The request which started the build is cancelled (e.g., its client disconnected) while another one waits on it
+    leader = asyncio.create_task(cache.get_or_build(("", ()), _build))
+    follower = asyncio.create_task(cache.get_or_build(("", ()), _build))
+    await asyncio.sleep(0)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+    release.set()
+    assert await follower is tree
+    assert n_builds == 1
+    # The build still completed and was cached
+    assert await cache.get_or_build(("", ()), _build) is tree
+    assert n_builds == 1
+
+
+@pytest.mark.asyncio
+async def test_local_backend_get_node_at_path(test_config: Config, tmp_path):
+    (tmp_path / ".hidden").write_text("h")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "b").mkdir()
+    (tmp_path / "a" / "b" / "c.txt").write_text("c")
+
+    b = LocalBackend(test_config.model_copy(update={"service_data": str(tmp_path)}), logging.getLogger(__name__))
+
+    # Resolved nodes match the entries in the directory tree
+    tree = await b.get_directory_tree()
+    assert await b.get_node_at_path("a/b/c.txt") == tree[0]["contents"][0]["contents"][0]
+    assert await b.get_node_at_path("/a/b/c.txt") == tree[0]["contents"][0]["contents"][0]
+
+    for missing in (".hidden", "a/../a/b/c.txt", "a//b/c.txt", "a/b/d.txt", "a/c/c.txt", ""):
+        with pytest.raises(HTTPException) as e:
+            await b.get_node_at_path(missing)
+        assert e.value.status_code == 404
+
+    with pytest.raises(HTTPException) as e:
+        await b.get_node_at_path("a/b/c.txt/d", verb="delete")
+    assert e.value.status_code == 400
+
+    with pytest.raises(HTTPException) as e:
+        await b.get_node_at_path("a/b", verb="delete")
+    assert e.value.status_code == 400
+    assert e.value.detail == "Cannot delete a directory"
+
+    # Past the traversal limit, nothing is found, as the file wouldn't be in the tree
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "traversal_limit": 1}),
+        logging.getLogger(__name__),
+    )
+    with pytest.raises(HTTPException) as e:
+        await b.get_node_at_path("a/b/c.txt")
+    assert e.value.status_code == 404
+
+
+def test_local_metadata_index_keeps_files_put_during_scan(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("a")
+    (data_dir / "gone.txt").write_text("x")
+
+    index = LocalMetadataIndex(str(tmp_path / "index.sqlite3"))
+    index.open()
+    try:
+        index.replace_directory("", 0, [("a.txt", os.stat(data_dir / "a.txt"))], [])
+        index.put_file("gone.txt", os.stat(data_dir / "gone.txt"))
+        (data_dir / "gone.txt").unlink()
+
+        # A rescan lists the directory, then a file is uploaded (and put in the index) before the scan is applied
+        scanned_mtime_ns = os.stat(data_dir).st_mtime_ns
+        time.sleep(0.02)
+        (data_dir / "b.txt").write_text("b")
+        index.put_file("b.txt", os.stat(data_dir / "b.txt"))
+        index.replace_directory("", scanned_mtime_ns, [("a.txt", os.stat(data_dir / "a.txt"))], [])
+
+        # The upload is kept, while the file removed before the scan is not
+        assert sorted(e.name for e in index.children("")) == ["a.txt", "b.txt"]
+    finally:
+        index.close()
+
+
+@pytest.mark.asyncio
+async def test_local_backend_metadata_index(test_config: Config, tmp_path):
+    data_dir = tmp_path / "data"
+    shutil.copytree(pathlib.Path(test_config.service_data), data_dir)
+    config = test_config.model_copy(
+        update={
+            "service_data": str(data_dir),
+            "local_index_path": str(tmp_path / "index.sqlite3"),
+            "tree_cache_size": 0,
+        }
+    )
+
+    fs_b = LocalBackend(config.model_copy(update={"local_index_path": ""}), logging.getLogger(__name__))
+    b = LocalBackend(config, logging.getLogger(__name__))
+    await b.startup()
+    try:
+        assert await b.reconcile_index() == 4  # root, some_dir, some_dir/empty_dir, some_dir/some_other_dir
+        # Nothing changed: no directories are listed again
+        assert await b.reconcile_index() == 0
+
+        # Trees served from the index match trees built from the filesystem
+        for kwargs in (
+            {},
+            {"filters": TreeFilter(include=[".txt"])},
+            {"filters": TreeFilter(ignore=[".vcf"], min_size=1)},
+            {"filters": TreeFilter(include=["some_dir/*"], ignore=["some_dir/some_other_dir/*"])},
+            {"sub_path": "some_dir"},
+        ):
+            assert await b.get_directory_tree(**kwargs) == await fs_b.get_directory_tree(**kwargs)
+        assert await b.get_node_at_path("some_dir/tomate.vcf") == await fs_b.get_node_at_path("some_dir/tomate.vcf")
+        # So do search results, with cursors working across both
+        for query in (SearchQuery(suffixes=[".txt", ".json"]), SearchQuery(prefix="some_dir/", max_size=10)):
+            page, cursor = await b.search(query, 2)
+            assert (page, cursor) == await fs_b.search(query, 2)
+            assert await b.search(query, 2, cursor) == await fs_b.search(query, 2, cursor)
+        with pytest.raises(HTTPException) as e:
+            await b.get_node_at_path("some_dir", verb="delete")
+        assert e.value.status_code == 400
+
+        # The service's own deletes update the index right away
+        await b.delete_at_path("some_dir/tomate.vcf")
+        assert b._index.get("some_dir/tomate.vcf") is None
+
+        # Outside changes show up after the next reconciliation pass
+        (data_dir / "some_dir" / "new_dir").mkdir()
+        (data_dir / "some_dir" / "new_dir" / "a.txt").write_text("a")
+        (data_dir / "patate.txt").unlink()
+        # Found through the filesystem in the meantime
+        assert (await b.get_node_at_path("some_dir/new_dir/a.txt"))["size"] == 1
+        assert await b.reconcile_index() == 3  # root, some_dir, some_dir/new_dir
+        assert await b.get_directory_tree() == await fs_b.get_directory_tree()
+        assert b._index.get("some_dir/new_dir/a.txt").size == 1
+
+        # Recently-modified files are re-stat-ed by the next pass, as they may still be being written to in place
+        (data_dir / "some_dir" / "new_dir" / "a.txt").write_text("abc")
+        await b.reconcile_index()
+        assert b._index.get("some_dir/new_dir/a.txt").size == 3
+    finally:
+        await b.shutdown()
+
+    # After a restart, the existing index is served right away
+    b = LocalBackend(config, logging.getLogger(__name__))
+    await b.startup()
+    try:
+        assert b._index_ready
+        assert await b.get_directory_tree() == await fs_b.get_directory_tree()
+    finally:
+        await b.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_local_backend_detect_changes(test_config: Config, tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    b = LocalBackend(test_config.model_copy(update={"service_data": str(tmp_path)}), logging.getLogger(__name__))
+
+    assert await b.detect_changes() == 0  # baseline
+    token = b.changes_token
+
+    # Outside changes are picked up by the next detection pass
+    (tmp_path / "a.txt").write_text("aaa")
+    (tmp_path / "b.txt").unlink()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "c.txt").write_text("c")
+    assert await b.detect_changes() == 3
+    assert sorted((c["change"], c["relativePath"]) for c in b.get_changes(token)) == [
+        ("added", "/sub/c.txt"),
+        ("modified", "/a.txt"),
+        ("removed", "/b.txt"),
+    ]
+
+    # The service's own deletes are recorded right away, and not detected again
+    token = b.changes_token
+    await b.delete_at_path("sub/c.txt")
+    assert await b.detect_changes() == 0
+    assert [(c["change"], c["relativePath"]) for c in b.get_changes(token)] == [("removed", "/sub/c.txt")]
+
+    # Once changes since a token have been dropped from the feed, the token has expired
+    b = LocalBackend(b.config.model_copy(update={"change_feed_size": 1}), logging.getLogger(__name__))
+    token = b.changes_token
+    await b.delete_at_path("a.txt")
+    (tmp_path / "d.txt").write_text("d")
+    await b.detect_changes()
+    await b.delete_at_path("d.txt")
+    with pytest.raises(HTTPException) as e:
+        b.get_changes(token)
+    assert e.value.status_code == 410
+
+
+@pytest.mark.asyncio
+async def test_local_backend_update_checksums(test_config: Config, tmp_path, monkeypatch):
+    (tmp_path / "a.txt").write_bytes(b"a" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.txt").write_bytes(b"b")
+    config = test_config.model_copy(
+        update={"service_data": str(tmp_path), "checksum_algorithms": ("sha256",), "tree_cache_size": 0}
+    )
+    b = LocalBackend(config, logging.getLogger(__name__))
+
+    assert "checksums" not in (await b.get_directory_tree())[0]
+    assert await b.update_checksums() == 2
+    tree = await b.get_directory_tree()
+    assert tree[0]["checksums"] == {"sha256": hashlib.sha256(b"a" * 10).hexdigest()}
+    assert tree[1]["contents"][0]["checksums"] == {"sha256": hashlib.sha256(b"b").hexdigest()}
+    assert await b.update_checksums() == 0  # nothing left to do
+
+    # Computed checksums are stored in extended attributes, so they are re-used after a restart without reading files
+    b = LocalBackend(config, logging.getLogger(__name__))
+    with monkeypatch.context() as m:
+        m.setattr(b, "_read_file_chunks", None)
+        assert await b.update_checksums() == 2
+    # ... unless the configured algorithms changed
+    b = LocalBackend(config.model_copy(update={"checksum_algorithms": ("sha256", "md5")}), logging.getLogger(__name__))
+    assert await b.update_checksums() == 2
+    assert (await b.get_directory_tree())[0]["checksums"]["md5"] == hashlib.md5(b"a" * 10).hexdigest()
+
+    # Checksums are invalidated when a file is modified, and recomputed by the next pass
+    (tmp_path / "a.txt").write_bytes(b"changed")
+    assert "checksums" not in (await b.get_directory_tree())[0]
+    assert await b.update_checksums() == 1
+    assert (await b.get_directory_tree())[0]["checksums"]["sha256"] == hashlib.sha256(b"changed").hexdigest()
+
+    # Batch deletes forget the deleted files' checksums
+    a_stat = os.stat(tmp_path / "a.txt")
+    await b.delete_paths(paths=["/a.txt"])
+    assert b._checksums.get("a.txt", a_stat.st_size, a_stat.st_mtime) is None
+    assert "a.txt" not in b._checksums._entries
+
+
+def test_checksum_cache_lru():
+    cache = ChecksumCache(max_size=2)
+    cache.put("a", 1, 1.0, {"md5": "a"})
+    cache.put("b", 1, 1.0, {"md5": "b"})
+    assert cache.get("a", 1, 1.0) == {"md5": "a"}  # a is now the most recently used
+    cache.put("c", 1, 1.0, {"md5": "c"})
+    assert cache.get("b", 1, 1.0) is None
+    assert cache.get("a", 1, 1.0) == {"md5": "a"}
+    assert cache.get("c", 1, 1.0) == {"md5": "c"}
+
+
+@pytest.mark.asyncio
+async def test_local_backend_concurrent_traversal(test_config: Config, tmp_path, monkeypatch):
+    for i in range(8):
+        (tmp_path / f"dir{i}").mkdir()
+        (tmp_path / f"dir{i}" / "file.txt").write_text(str(i))
+
+    # Simulate a high-latency filesystem (e.g., NFS): sub-directory scans block until another scan is in flight (or a
+    # timeout, if scans are sequential), and the peak number of scans in flight at once is recorded.
+    lock = threading.Lock()
+    overlapping = threading.Event()
+    in_flight = 0
+    max_in_flight = 0
+    original_scan_directory = LocalBackend._scan_directory
+
+    def _slow_scan_directory(self, directory, *args, **kwargs):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            if in_flight > 1:
+                overlapping.set()
+        try:
+            if pathlib.Path(directory) != tmp_path:
+                overlapping.wait(timeout=2)
+            return original_scan_directory(self, directory, *args, **kwargs)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    monkeypatch.setattr(LocalBackend, "_scan_directory", _slow_scan_directory)
+
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "traversal_concurrency": 4}),
+        logging.getLogger(__name__),
+    )
+
+    tree = await b.get_directory_tree()
+
+    # Sibling directories are scanned concurrently, but never more than the configured cap at once
+    assert 1 < max_in_flight <= 4
+
+    # Output order is deterministic regardless of which scan finishes first
+    assert [e["name"] for e in tree] == [f"dir{i}" for i in range(8)]
+    assert all([c["name"] for c in e["contents"]] == ["file.txt"] for e in tree)
+
+
+@pytest.mark.asyncio
+async def test_local_backend_cleanup_expired_uploads(test_config: Config, tmp_path):
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "resumable_upload_ttl": 60}),
+        logging.getLogger(__name__),
+    )
+
+    session = await b.create_upload("reads.bam", 10)
+    assert await b.cleanup_expired_uploads() == 0
+
+    expired_b = LocalBackend(b.config.model_copy(update={"resumable_upload_ttl": 0.001}), logging.getLogger(__name__))
+    expired_session = await expired_b.create_upload("other.bam", 10)
+    await asyncio.sleep(0.01)
+
+    # Only the expired session is cleaned up
+    assert await b.cleanup_expired_uploads() == 1
+    assert (await b.get_upload_status(session["id"]))["receivedOffsets"] == []
+    with pytest.raises(HTTPException):
+        await b.get_upload_status(expired_session["id"])
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_cleanup_expired_uploads(s3_backend: S3Backend, s3_client):
+    session = await s3_backend.create_upload("reads.bam", 10)
+    stale_upload_id = (await s3_client.create_multipart_upload(Bucket="test", Key="stale.bam"))["UploadId"]
+    s3_client.multipart_uploads[stale_upload_id].initiated -= timedelta(days=2)
+
+    assert await s3_backend.cleanup_expired_uploads() == 1
+    assert s3_client.aborted_uploads == [stale_upload_id]
+    assert (await s3_backend.get_upload_status(session["id"]))["receivedOffsets"] == []
+
+
+@pytest.mark.asyncio
+async def test_local_backend_expired_upload(test_config: Config, tmp_path):
+    b = LocalBackend(
+        test_config.model_copy(update={"service_data": str(tmp_path), "resumable_upload_ttl": 0.001}),
+        logging.getLogger(__name__),
+    )
+    session = await b.create_upload("reads.bam", 10)
+    await asyncio.sleep(0.01)
+
+    # Expired sessions can't be used anymore, even before they are cleaned up
+    for operation in (b.get_upload_status, b.complete_upload, b.abort_upload):
+        with pytest.raises(HTTPException) as e:
+            await operation(session["id"])
+        assert e.value.status_code == 404
+    assert await b.cleanup_expired_uploads() == 1
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_upload_id_validation(s3_backend: S3Backend, s3_client):
+    session = await s3_backend.create_upload("run/reads.bam", 10)
+    encoded, _, signature = session["id"].rpartition(".")
+
+    # Upload IDs can't be altered by clients, e.g. to write to another key or extend the session
+    key, s3_upload_id, size, part_size, expires = orjson.loads(base64.urlsafe_b64decode(encoded))
+    for data in ([".uploads/x", s3_upload_id, size, part_size, expires], [key, s3_upload_id, size, part_size, 1e12]):
+        forged = base64.urlsafe_b64encode(orjson.dumps(data)).decode()
+        with pytest.raises(HTTPException) as e:
+            await s3_backend.get_upload_status(f"{forged}.{signature}")
+        assert e.value.status_code == 404
+
+    # Signed upload IDs with unsafe keys are refused too
+    unsafe_id = s3_backend._encode_upload_id({**session, "path": "../x"}, s3_upload_id)
+    with pytest.raises(HTTPException):
+        await s3_backend.get_upload_status(unsafe_id)
+
+    expired_id = s3_backend._encode_upload_id({**session, "expires": time.time() - 1}, s3_upload_id)
+    for operation in (s3_backend.get_upload_status, s3_backend.complete_upload, s3_backend.abort_upload):
+        with pytest.raises(HTTPException) as e:
+            await operation(expired_id)
+        assert e.value.status_code == 404
+
+    assert (await s3_backend.get_upload_status(session["id"]))["receivedOffsets"] == []
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_detect_changes(s3_backend: S3Backend, s3_client):
+    s3_client.put("a.txt", b"a")
+    assert await s3_backend.detect_changes() == 0  # baseline
+    token = s3_backend.changes_token
+
+    s3_client.put("run/c.txt", b"c")
+    await s3_backend.delete_paths(paths=["a.txt"])
+    assert await s3_backend.detect_changes() == 1  # the delete was already recorded
+    assert [(c["change"], c["relativePath"]) for c in s3_backend.get_changes(token)] == [
+        ("removed", "/a.txt"),
+        ("added", "/run/c.txt"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_update_checksums(make_s3_backend, s3_client):
+    b = make_s3_backend(checksum_algorithms=("md5", "sha256"))
+    s3_client.put("a.txt", b"a" * 10)
+    s3_client.put("stored.txt", b"s", metadata={"checksum-md5": "m", "checksum-sha256": "s"})
+
+    assert await b.update_checksums() == 2
+    tree = await b.get_directory_tree()
+    assert tree[0]["checksums"] == {
+        "md5": hashlib.md5(b"a" * 10).hexdigest(),
+        "sha256": hashlib.sha256(b"a" * 10).hexdigest(),
+    }
+    assert tree[1]["checksums"] == {"md5": "m", "sha256": "s"}  # from the object's metadata
+    # Computed checksums are only kept in memory (objects are not rewritten)
+    assert "copy_object" not in s3_client.calls
+    assert s3_client.objects["a.txt"].metadata == {}
+
+    s3_client.calls.clear()
+    assert await b.update_checksums() == 0
+    assert s3_client.calls == ["list_objects_v2"]
+
+    # Checksums are invalidated when an object is replaced
+    s3_client.put("a.txt", b"changed", last_modified=datetime.now(UTC) + timedelta(seconds=1))
+    assert "checksums" not in (await b.get_directory_tree())[0]
+    assert await b.update_checksums() == 1
+
+
+def test_s3_backend_create_directory_tree():
+    def _file(key: str) -> DropBoxEntry:
+        return {
+            "name": key.rsplit("/", 1)[-1],
+            "filePath": key,
+            "relativePath": key,
+            "size": 1,
+            "lastModified": 0.0,
+            "lastMetadataChange": 0.0,
+            "uri": f"/objects/{key}",
+        }
+
+    tree = S3Backend.create_directory_tree(
+        [_file(k) for k in ("z.txt", "run/s2/b.vcf", "run/s1/a.vcf", "a.txt", "run/s2/a.vcf", "run/x.json")]
+    )
+
+    assert [e["name"] for e in tree] == ["a.txt", "run", "z.txt"]
+    run = tree[1]
+    assert run["filePath"] == "run"
+    assert [e["name"] for e in run["contents"]] == ["s1", "s2", "x.json"]
+    s2 = run["contents"][1]
+    assert s2["relativePath"] == "run/s2"
+    assert [e["relativePath"] for e in s2["contents"]] == ["/run/s2/a.vcf", "/run/s2/b.vcf"]
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_stream_body_read_ahead(make_s3_backend, s3_client):
+    body = bytes(range(256)) * 4096
+    s3_client.put("big.bin", body)
+    b = make_s3_backend(s3_chunk_size=16 * 1024, s3_max_chunk_size=128 * 1024, s3_read_ahead_chunks=2)
+
+    assert b"".join([c async for c in b._stream_body("big.bin", await b._get_object("big.bin"))]) == body
+    # Reads double in size while S3 fills them, up to the maximum chunk size
+    assert s3_client.read_sizes[:5] == [16 * 1024, 32 * 1024, 64 * 1024, 128 * 1024, 128 * 1024]
+
+    # The body is read ahead of the consumer, by at most s3_read_ahead_chunks chunks
+    s3_client.read_sizes.clear()
+    obj = await b._get_object("big.bin")
+    stream = b._stream_body("big.bin", obj)
+    await anext(stream)
+    await asyncio.sleep(0.01)
+    assert len(s3_client.read_sizes) == 3
+    # Closing the stream early (e.g., if the client disconnects) stops the reader and closes the body
+    await stream.aclose()
+    assert obj["Body"].closed
+    assert len(s3_client.read_sizes) == 3
+
+    # Errors reading the body are raised to the consumer
+    obj = await b._get_object("big.bin")
+
+    async def _fail(_amt=None):
+        raise ConnectionResetError()
+
+    obj["Body"].read = _fail
+    with pytest.raises(ConnectionResetError):
+        _ = [c async for c in b._stream_body("big.bin", obj)]
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_parallel_ranged_download(make_s3_backend, s3_client):
+    mib = 1024 * 1024
+    body = bytes(range(256)) * (5 * mib // 256 + 3)
+    s3_client.put("big.bin", body)
+    s3_client.put("small.bin", body[:mib])
+    b = make_s3_backend(
+        s3_parallel_download_threshold=mib + 1,
+        s3_parallel_download_part_size=mib,
+        s3_parallel_download_concurrency=2,
+    )
+
+    obj = await b._get_object("big.bin")
+    assert b"".join([c async for c in b._stream_full_object("big.bin", obj)]) == body
+    # The first range comes from the original response; the others from ranged GETs
+    assert s3_client.get_ranges == [None] + [
+        f"bytes={start}-{min(start + mib, len(body)) - 1}" for start in range(mib, len(body), mib)
+    ]
+
+    # Objects under the threshold are streamed from the original response alone
+    s3_client.get_ranges.clear()
+    obj = await b._get_object("small.bin")
+    assert b"".join([c async for c in b._stream_full_object("small.bin", obj)]) == body[:mib]
+    assert s3_client.get_ranges == [None]
+
+    # Objects replaced during a download fail it, rather than mixing versions
+    obj = await b._get_object("big.bin")
+    s3_client.put("big.bin", body[::-1])
+    with pytest.raises(ClientError):
+        _ = [c async for c in b._stream_full_object("big.bin", obj)]
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_client_lifecycle(test_config: Config):
+    b = S3Backend(
+        test_config.model_copy(update={"s3_endpoint": "127.0.0.1:9000", "s3_use_https": False}),
+        logging.getLogger(__name__),
+    )
+
+    await b.startup()
+    client = await b._get_s3_client()
+    # The same pooled client is shared across calls
+    assert await b._get_s3_client() is client
+
+    await b.shutdown()
+    assert b._s3_client is None
+
+    # If used after shutdown (or without the lifespan having run), a new client is created lazily
+    assert (await b._get_s3_client()) is not client
+    await b.shutdown()
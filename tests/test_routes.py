@@ -1,3 +1,11 @@
+import base64
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import orjson
 from fastapi.testclient import TestClient
 
 from bento_drop_box_service.backends.base import DropBoxEntry
@@ -70,8 +78,9 @@ def test_tree_local(client_local: TestClient):
     res = client_local.get("/tree?ignore=txt&ignore=.json&ignore=.vcf")
     validate_filtered_tree(res.json(), [], [])
 
-    res = client_local.get("/tree?include=txt&ignore=json")
-    assert res.status_code == 400
+    # Include and ignore filters can be combined
+    res = client_local.get("/tree?include=txt&include=json&ignore=zucchini.json")
+    validate_filtered_tree(res.json(), ["patate.txt"], ["some_dir", "some_other_dir"])
 
 
 def test_tree_subpath_local(client_local: TestClient):
@@ -85,8 +94,41 @@ def test_tree_subpath_local(client_local: TestClient):
     res = client_local.get("/tree/some_dir?ignore=txt")
     validate_filtered_tree(res.json(), ["tomate.vcf", "zucchini.json"], ["some_other_dir"])
 
-    res = client_local.get("/tree/some_dir?include=txt&ignore=json")
-    assert res.status_code == 400
+    res = client_local.get("/tree/some_dir?include=txt&include=json&ignore=zucchini.json")
+    validate_filtered_tree(res.json(), ["patate.txt"], ["some_other_dir"])
+
+
+def test_tree_filters_local(client_local_writable: TestClient, tmp_path):
+    for path, size in (("a.vcf.gz", 10), ("run_1/s1.vcf.gz", 100), ("run_1/tmp/x.vcf.gz", 1), ("run_2/s2.bam", 1000)):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b"0" * size)
+    os.utime(tmp_path / "run_2" / "s2.bam", (1_600_000_000, 1_600_000_000))
+
+    def _file_paths(url: str) -> list[str]:
+        res = client_local_writable.get(url)
+        assert res.status_code == 200
+        return [e["relativePath"] for e in _flatten_tree(res.json()) if "uri" in e]
+
+    # Globs are matched against paths, with * also matching /
+    assert _file_paths("/tree?include=run_*/*.vcf.gz") == ["/run_1/s1.vcf.gz", "/run_1/tmp/x.vcf.gz"]
+    assert _file_paths("/tree?include=*.vcf.gz&ignore=*/tmp/*") == ["/a.vcf.gz", "/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree?include=.gz&ignore=run_1/tmp/*") == ["/a.vcf.gz", "/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree/run_1?ignore=run_1/tmp/*") == ["/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree?include=/run_2/*") == ["/run_2/s2.bam"]
+
+    # Metadata predicates
+    assert _file_paths("/tree?min_size=10&max_size=100") == ["/a.vcf.gz", "/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree?modified_before=2021-01-01") == ["/run_2/s2.bam"]
+    assert _file_paths("/tree?modified_after=2021-01-01T00:00:00Z&ignore=.gz") == []
+    assert _file_paths("/tree?modified_after=1600000000&include=.bam") == ["/run_2/s2.bam"]
+
+    # Directories nothing in which can pass are left out (here, without being listed), along with empty ones
+    res = client_local_writable.get("/tree?include=run_1/tmp/*")
+    assert [e["relativePath"] for e in _flatten_tree(res.json())] == ["/run_1", "/run_1/tmp", "/run_1/tmp/x.vcf.gz"]
+
+    # Depth-limited listings leave out directories which can't have anything passing the filter, even unexpanded ones
+    res = client_local_writable.get("/tree?depth=1&include=run_1/*.vcf.gz")
+    assert [(e["name"], e.get("truncated")) for e in res.json()] == [("run_1", True)]
 
 
 def test_object_download_local(client_local: TestClient):
@@ -122,3 +164,484 @@ def test_object_download_local_file_as_dir(client_local: TestClient):
 def test_folder_download_error_local(client_local: TestClient):
     res = client_local.get("/objects/some_dir/")
     assert res.status_code == 400
+
+
+def test_object_download_local_range_and_conditional(client_local: TestClient):
+    res = client_local.get("/objects/patate.txt")
+    assert res.status_code == 200
+    content, etag, last_modified = res.content, res.headers["etag"], res.headers["last-modified"]
+
+    res = client_local.get("/objects/patate.txt", headers={"Range": "bytes=0-1"})
+    assert res.status_code == 206
+    assert res.content == content[:2]
+
+    res = client_local.get("/objects/patate.txt", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+
+    res = client_local.get("/objects/patate.txt", headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+
+
+def _flatten_tree(tree: list[DropBoxEntry]) -> list[DropBoxEntry]:
+    flat = []
+    for entry in tree:
+        flat.append({k: v for k, v in entry.items() if k != "contents"})
+        flat.extend(_flatten_tree(entry.get("contents", [])))
+    return flat
+
+
+def test_tree_ndjson_local(client_local: TestClient):
+    tree = client_local.get("/tree").json()
+
+    res = client_local.get("/tree?format=ndjson")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert [orjson.loads(line) for line in res.content.splitlines()] == _flatten_tree(tree)
+
+    # Also available through content negotiation
+    res = client_local.get("/tree/some_dir", headers={"Accept": "application/x-ndjson"})
+    assert res.status_code == 200
+    assert [orjson.loads(line) for line in res.content.splitlines()] == _flatten_tree(
+        client_local.get("/tree/some_dir").json()
+    )
+
+    # Filters: directories are only included if something in them passes the filter
+    res = client_local.get("/tree?format=ndjson&include=json")
+    entries = [orjson.loads(line) for line in res.content.splitlines()]
+    assert entries == _flatten_tree(client_local.get("/tree?include=json").json())
+    assert "empty_dir" not in {e["name"] for e in entries}
+
+    res = client_local.get("/tree?format=ndjson&include=nothing")
+    assert res.status_code == 200
+    assert res.content == b""
+
+    res = client_local.get("/tree?format=ndjson&include=*dir/*&ignore=txt")
+    assert [orjson.loads(line) for line in res.content.splitlines()] == _flatten_tree(
+        client_local.get("/tree?include=*dir/*&ignore=txt").json()
+    )
+
+
+def _expand_compact_tree(compact: dict) -> list[dict]:
+    # Rebuilds flattened entries from a compact tree, the way a client would
+    entries = []
+    paths = []
+    for i, name in enumerate(compact["names"]):
+        parent = compact["parents"][i]
+        parent_path = paths[parent] if parent >= 0 else compact["root"]
+        paths.append(path := f"{parent_path}/{name}".lstrip("/"))
+        entry = {"name": name, "filePath": compact["filePathPrefix"] + path, "relativePath": f"/{path}"}
+        if compact["sizes"][i] is not None:
+            entry.update(
+                {
+                    "size": compact["sizes"][i],
+                    "lastModified": compact["lastModified"][i],
+                    "lastMetadataChange": compact["lastMetadataChange"][i],
+                    "uri": compact["uriPrefix"] + path,
+                }
+            )
+        if compact["checksums"][i] is not None:
+            entry["checksums"] = compact["checksums"][i]
+        entries.append(entry)
+    return entries
+
+
+def test_tree_compact_local(client_local: TestClient, make_local_client, tmp_path):
+    for url in ("/tree", "/tree/some_dir", "/tree/some_dir/some_other_dir", "/tree?include=json"):
+        tree = client_local.get(url).json()
+        compact_url = url + ("&" if "?" in url else "?") + "format=compact"
+        res = client_local.get(compact_url)
+        assert res.status_code == 200
+        compact = res.json()
+        assert all(p < i for i, p in enumerate(compact["parents"]))
+        assert _expand_compact_tree(compact) == _flatten_tree(tree)
+        assert len(res.content) < len(orjson.dumps(tree))
+
+        # Conditional requests work the same way, with a separate ETag for the compact representation
+        etag = res.headers["etag"]
+        assert etag != client_local.get(url).headers["etag"]
+        assert client_local.get(compact_url, headers={"If-None-Match": etag}).status_code == 304
+
+    compact = client_local.get("/tree?format=compact&include=nothing").json()
+    assert compact["names"] == [] and compact["uriPrefix"] is None
+
+    res = client_local.get("/tree?format=compact&depth=1")
+    assert res.status_code == 400
+
+    # Known checksums are kept
+    client_local_checksums = make_local_client(checksum_algorithms=("md5",))
+    assert client_local_checksums.put("/objects/run/a.vcf", content=b"a").status_code == 204
+    (tmp_path / "run" / "outside.vcf").write_text("b")  # no checksums until the background job computes them
+    compact = client_local_checksums.get("/tree?format=compact").json()
+    assert compact["names"] == ["run", "a.vcf", "outside.vcf"]
+    assert compact["checksums"] == [None, {"md5": hashlib.md5(b"a").hexdigest()}, None]
+    assert _expand_compact_tree(compact) == _flatten_tree(client_local_checksums.get("/tree").json())
+
+
+def test_tree_depth_and_pagination_local(client_local: TestClient):
+    res = client_local.get("/tree?depth=1")
+    assert res.status_code == 200
+    tree = res.json()
+    assert [e["name"] for e in tree] == ["patate.txt", "some_dir", "tomate.vcf", "zucchini.json"]
+    assert tree[1]["contents"] == []
+    assert tree[1]["truncated"] is True
+    assert "X-Next-Cursor" not in res.headers
+
+    res = client_local.get("/tree/some_dir?depth=2")
+    tree = res.json()
+    assert [e["name"] for e in tree] == ["empty_dir", "patate.txt", "some_other_dir", "tomate.vcf", "zucchini.json"]
+    assert "truncated" not in tree[2]
+    assert [e["name"] for e in tree[2]["contents"]] == ["patate.txt", "tomate.vcf", "zucchini.json"]
+
+    names = []
+    cursor = None
+    for _ in range(3):
+        res = client_local.get(
+            "/tree/some_dir", params={"depth": 1, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        )
+        assert res.status_code == 200
+        assert len(res.json()) <= 2
+        names.extend(e["name"] for e in res.json())
+        if (cursor := res.headers.get("X-Next-Cursor")) is None:
+            break
+    assert names == ["empty_dir", "patate.txt", "some_other_dir", "tomate.vcf", "zucchini.json"]
+
+    res = client_local.get("/tree?cursor=garbage")
+    assert res.status_code == 400
+    res = client_local.get("/tree?depth=0")
+    assert res.status_code == 400
+    res = client_local.get("/tree?depth=1&format=ndjson")
+    assert res.status_code == 400
+
+
+def test_upload_local(client_local_writable: TestClient, tmp_path):
+    body = bytes(range(256)) * 4099  # spans several write buffers, with a partial one at the end
+
+    res = client_local_writable.put("/objects/some_dir/reads.bam", content=body)
+    assert res.status_code == 204
+    assert (tmp_path / "some_dir" / "reads.bam").read_bytes() == body
+    # No temporary files are left behind
+    assert os.listdir(tmp_path / "some_dir") == ["reads.bam"]
+
+    res = client_local_writable.get("/tree")
+    assert [e["name"] for e in res.json()[0]["contents"]] == ["reads.bam"]
+
+    res = client_local_writable.put("/objects/some_dir/reads.bam", content=b"other")
+    assert res.status_code == 400
+    assert (tmp_path / "some_dir" / "reads.bam").read_bytes() == body
+
+
+def _repr_digest(body: bytes) -> str:
+    return ", ".join(
+        f"{name}=:{base64.b64encode(hashlib.new(algorithm, body).digest()).decode()}:"
+        for algorithm, name in (("md5", "md5"), ("sha256", "sha-256"))
+    )
+
+
+def test_upload_checksums_local(make_local_client, tmp_path):
+    client_local_checksums = make_local_client(checksum_algorithms=("md5", "sha256"))
+    body = bytes(range(256)) * 4099  # spans several write buffers, which are hashed as they are written
+
+    assert client_local_checksums.put("/objects/run/reads.bam", content=body).status_code == 204
+    entry = client_local_checksums.get("/tree").json()[0]["contents"][0]
+    assert entry["checksums"] == {"md5": hashlib.md5(body).hexdigest(), "sha256": hashlib.sha256(body).hexdigest()}
+    # Checksums are stored with the file
+    stored = orjson.loads(os.getxattr(tmp_path / "run" / "reads.bam", "user.bento_drop_box.checksums"))
+    assert stored["checksums"] == entry["checksums"]
+
+    res = client_local_checksums.get("/objects/run/reads.bam")
+    assert res.content == body
+    assert res.headers["repr-digest"] == _repr_digest(body)
+    # Checksums are those of the whole file, even for ranges
+    res = client_local_checksums.get("/objects/run/reads.bam", headers={"Range": "bytes=0-9"})
+    assert res.status_code == 206
+    assert res.headers["repr-digest"] == _repr_digest(body)
+
+    # Files added from outside the service have no checksums until the background job computes them
+    (tmp_path / "outside.txt").write_bytes(b"outside")
+    tree = client_local_checksums.get("/tree").json()
+    assert "checksums" not in tree[0]
+    assert "repr-digest" not in client_local_checksums.get("/objects/outside.txt").headers
+
+
+def test_tree_etag_and_changes_local(client_local_writable: TestClient, tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+
+    res = client_local_writable.get("/tree")
+    etag, token = res.headers["etag"], res.headers["x-changes-token"]
+    assert etag.startswith('W/"')
+
+    # Unchanged trees aren't sent again
+    res = client_local_writable.get("/tree", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["etag"] == etag
+    # ETags depend on the filters / sub path, like the trees themselves
+    assert client_local_writable.get("/tree", params={"include": ".vcf"}).headers["etag"] != etag
+
+    assert client_local_writable.put("/objects/run/b.vcf", content=b"bb").status_code == 204
+    assert client_local_writable.delete("/objects/a.txt").status_code == 204
+
+    res = client_local_writable.get("/tree", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+
+    res = client_local_writable.get("/changes", params={"since": token})
+    assert res.status_code == 200
+    changes = res.json()["changes"]
+    assert [(c["change"], c["relativePath"]) for c in changes] == [("added", "/run/b.vcf"), ("removed", "/a.txt")]
+    assert changes[0]["entry"]["size"] == 2
+
+    # Nothing new since the returned token
+    res = client_local_writable.get("/changes", params={"since": res.json()["token"]})
+    assert res.json()["changes"] == []
+
+    assert client_local_writable.get("/changes", params={"since": "unknown.0"}).status_code == 410
+
+
+def test_upload_local_content_length_mismatch(client_local_writable: TestClient, tmp_path):
+    res = client_local_writable.put(
+        "/objects/truncated.vcf",
+        content=iter([b"only part of the file"]),
+        headers={"Content-Length": "1000"},
+    )
+    assert res.status_code == 400
+    # Neither the final file nor the temporary file exist
+    assert os.listdir(tmp_path) == []
+
+
+def test_resumable_upload_local(client_local_writable: TestClient, tmp_path):
+    part_size = 5 * 1024 * 1024
+    body = os.urandom(2 * part_size + 1234)
+
+    res = client_local_writable.post("/uploads", json={"path": "run/reads.bam", "size": len(body)})
+    assert res.status_code == 201
+    session = res.json()
+    assert session["path"] == "run/reads.bam"
+    assert session["partSize"] == part_size
+    upload_id = session["id"]
+
+    # Parts can be sent in any order; the last part is shorter
+    res = client_local_writable.put(f"/uploads/{upload_id}?offset={2 * part_size}", content=body[2 * part_size :])
+    assert res.status_code == 204
+
+    # Parts must be exactly one part long, at a multiple of the part size
+    res = client_local_writable.put(f"/uploads/{upload_id}?offset=0", content=body[:100])
+    assert res.status_code == 400
+    res = client_local_writable.put(f"/uploads/{upload_id}?offset=100", content=body[100 : 100 + part_size])
+    assert res.status_code == 400
+
+    res = client_local_writable.put(f"/uploads/{upload_id}?offset=0", content=body[:part_size])
+    assert res.status_code == 204
+
+    res = client_local_writable.get(f"/uploads/{upload_id}")
+    assert res.status_code == 200
+    assert res.json()["receivedOffsets"] == [0, 2 * part_size]
+    assert res.json()["bytesReceived"] == part_size + 1234
+
+    # Can't complete with a part missing, and nothing is visible until the upload is completed
+    res = client_local_writable.post(f"/uploads/{upload_id}/complete")
+    assert res.status_code == 400
+    assert client_local_writable.get("/tree").json() == []
+
+    # Resume with the missing part
+    res = client_local_writable.put(f"/uploads/{upload_id}?offset={part_size}", content=body[part_size : 2 * part_size])
+    assert res.status_code == 204
+
+    res = client_local_writable.post(f"/uploads/{upload_id}/complete")
+    assert res.status_code == 204
+    assert (tmp_path / "run" / "reads.bam").read_bytes() == body
+
+    # Session is gone once completed
+    assert client_local_writable.get(f"/uploads/{upload_id}").status_code == 404
+    assert os.listdir(tmp_path / ".uploads") == []
+
+
+def test_resumable_upload_local_abort(client_local_writable: TestClient, tmp_path):
+    res = client_local_writable.post("/uploads", json={"path": "reads.bam", "size": 10})
+    upload_id = res.json()["id"]
+
+    assert client_local_writable.delete(f"/uploads/{upload_id}").status_code == 204
+    assert client_local_writable.delete(f"/uploads/{upload_id}").status_code == 404
+    assert client_local_writable.put(f"/uploads/{upload_id}?offset=0", content=b"0123456789").status_code == 404
+    assert client_local_writable.get("/uploads/../../etc").status_code == 404
+
+    # Can't start an upload to an existing path
+    (tmp_path / "existing.vcf").write_text("x")
+    assert client_local_writable.post("/uploads", json={"path": "existing.vcf", "size": 10}).status_code == 400
+
+
+def test_resumable_upload_local_staging_protected(client_local_writable: TestClient, tmp_path):
+    res = client_local_writable.post("/uploads", json={"path": "reads.bam", "size": 10})
+    upload_id = res.json()["id"]
+    session_path = tmp_path / ".uploads" / upload_id / "session.json"
+
+    # Staging files can't be written or deleted through the object API
+    res = client_local_writable.put(f"/objects/.uploads/{upload_id}/session.json", content=b"{}")
+    assert res.status_code == 400
+    assert client_local_writable.put("/objects/run/.hidden/x.txt", content=b"x").status_code == 400
+    assert client_local_writable.delete(f"/objects/.uploads/{upload_id}/session.json").status_code == 404
+    res = client_local_writable.post("/delete", json={"paths": [f".uploads/{upload_id}/session.json"]})
+    assert res.json()[0]["status"] == 404
+    assert session_path.exists()
+
+    # Even if the session file is tampered with, uploads can't be completed outside of the drop box
+    session = orjson.loads(session_path.read_bytes())
+    session_path.write_bytes(orjson.dumps({**session, "path": "../outside/pwned.txt"}))
+    assert client_local_writable.put(f"/uploads/{upload_id}?offset=0", content=b"0123456789").status_code == 204
+    assert client_local_writable.post(f"/uploads/{upload_id}/complete").status_code == 400
+    assert not (tmp_path.parent / "outside").exists()
+
+
+def test_batch_delete_local(client_local_writable: TestClient, tmp_path):
+    for name in ("a.vcf", "run/b.vcf", "run/sub/c.vcf", "run/.hidden"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(name)
+
+    res = client_local_writable.post("/delete", json={"paths": ["a.vcf", "missing.vcf", "run"]})
+    assert res.status_code == 200
+    assert [(r["path"], r["status"]) for r in res.json()] == [("a.vcf", 204), ("missing.vcf", 404), ("run", 400)]
+    assert not (tmp_path / "a.vcf").exists()
+
+    res = client_local_writable.post("/delete", json={"prefix": "run/"})
+    assert res.status_code == 200
+    assert [(r["path"], r["status"]) for r in res.json()] == [("run/b.vcf", 204), ("run/sub/c.vcf", 204)]
+    # Hidden files aren't part of the tree, so they are left alone
+    assert sorted(os.listdir(tmp_path / "run")) == [".hidden", "sub"]
+    assert client_local_writable.get("/tree/run").json() == [
+        {"name": "sub", "filePath": str(tmp_path / "run" / "sub"), "relativePath": "/run/sub", "contents": []}
+    ]
+
+    assert client_local_writable.post("/delete", json={"prefix": "/"}).status_code == 400
+    assert client_local_writable.post("/delete", json={"prefix": "nothing"}).status_code == 404
+    assert client_local_writable.post("/delete", json={}).status_code == 400
+    assert client_local_writable.post("/delete", json={"paths": ["a"], "prefix": "run"}).status_code == 400
+
+
+def _search_all(client: TestClient, params: dict) -> list[str]:
+    paths, cursor = [], None
+    while True:
+        res = client.get("/search", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert res.status_code == 200
+        paths.extend(e["relativePath"] for e in res.json())
+        if (cursor := res.headers.get("X-Next-Cursor")) is None:
+            return paths
+
+
+def test_search_local(client_local_writable: TestClient, tmp_path):
+    files = {
+        "a/x.vcf.gz": 10,
+        "a.vcf.gz": 2000,
+        "a/b/y.vcf.gz": 3000,
+        "a/b/z.txt": 5,
+        "b.vcf": 1,
+        ".hidden/h.vcf.gz": 1,
+    }
+    for name, size in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"x" * size)
+    os.utime(tmp_path / "a/b/y.vcf.gz", (1000000000, 1000000000))
+
+    # Results are sorted by path, and pages pick up where the previous one left off
+    all_vcf_gz = ["/a.vcf.gz", "/a/b/y.vcf.gz", "/a/x.vcf.gz"]
+    assert _search_all(client_local_writable, {"glob": "*.vcf.gz"}) == all_vcf_gz
+    assert _search_all(client_local_writable, {"suffix": ".vcf.gz", "limit": 1}) == all_vcf_gz
+
+    res = client_local_writable.get("/search", params={"glob": "a/b/*", "min_size": 100})
+    assert [e["relativePath"] for e in res.json()] == ["/a/b/y.vcf.gz"]
+    assert res.json()[0]["size"] == 3000
+    assert res.json()[0]["uri"].endswith("/objects/a/b/y.vcf.gz")
+
+    assert _search_all(client_local_writable, {"prefix": "a/", "max_size": 100}) == ["/a/b/z.txt", "/a/x.vcf.gz"]
+    assert _search_all(client_local_writable, {"modified_before": "2010-01-01T00:00:00"}) == ["/a/b/y.vcf.gz"]
+    assert _search_all(client_local_writable, {"modified_after": 1500000000, "suffix": ".vcf"}) == ["/b.vcf"]
+    assert _search_all(client_local_writable, {"prefix": "b", "glob": "a/*"}) == []
+    assert _search_all(client_local_writable, {"prefix": ".hidden/"}) == []
+
+    assert client_local_writable.get("/search", params={"cursor": "nope"}).status_code == 400
+
+
+def test_tree_archive_local(client_local: TestClient):
+    res = client_local.get("/tree/some_dir?format=tar")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-tar"
+    assert res.headers["content-disposition"] == 'attachment; filename="some_dir.tar"'
+    with tarfile.open(fileobj=io.BytesIO(res.content)) as tf:
+        assert tf.getnames() == [
+            "some_dir/empty_dir",
+            "some_dir/patate.txt",
+            "some_dir/some_other_dir",
+            "some_dir/some_other_dir/patate.txt",
+            "some_dir/some_other_dir/tomate.vcf",
+            "some_dir/some_other_dir/zucchini.json",
+            "some_dir/tomate.vcf",
+            "some_dir/zucchini.json",
+        ]
+        assert tf.extractfile("some_dir/patate.txt").read() == client_local.get("/objects/some_dir/patate.txt").content
+
+    # Same filters as the tree itself
+    res = client_local.get("/tree?format=zip&include=.vcf")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(res.content)) as zf:
+        assert zf.testzip() is None
+        assert [i.filename for i in zf.infolist() if not i.is_dir()] == [
+            "some_dir/some_other_dir/tomate.vcf",
+            "some_dir/tomate.vcf",
+            "tomate.vcf",
+        ]
+        assert zf.read("tomate.vcf") == client_local.get("/objects/tomate.vcf").content
+
+    assert client_local.get("/tree?format=tar&include=nothing").status_code == 404
+    assert client_local.get("/tree?format=tar&depth=1").status_code == 400
+    res = client_local.get("/tree/some_dir?format=zip&include=txt&include=vcf&ignore=some_dir/some_other_dir/*")
+    with zipfile.ZipFile(io.BytesIO(res.content)) as zf:
+        assert sorted(zf.namelist()) == ["some_dir/patate.txt", "some_dir/tomate.vcf"]
+
+
+def test_tree_sub_path_confined_local(client_local_writable: TestClient, tmp_path):
+    (tmp_path / "run").mkdir()
+    (tmp_path / "run" / "a.vcf").write_text("a")
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / ".hidden" / "b.vcf").write_text("b")
+
+    # Sub-paths which would leave the drop box, or which aren't directories in the tree, are not found in any format
+    for sub_path in ("%2E%2E", "run/%2E%2E/%2E%2E", "%2E", ".hidden", "missing", "run/a.vcf"):
+        for params in ({}, {"format": "ndjson"}, {"format": "compact"}, {"format": "tar"}, {"depth": 1}):
+            assert client_local_writable.get(f"/tree/{sub_path}", params=params).status_code == 404, (sub_path, params)
+
+    assert [e["relativePath"] for e in client_local_writable.get("/tree/run/").json()] == ["/run/a.vcf"]
+
+
+def test_metrics(client_local: TestClient):
+    assert client_local.get("/tree").status_code == 200
+    assert client_local.get("/objects/patate.txt").status_code == 200
+    assert client_local.get("/objects/peel.txt").status_code == 404
+
+    res = client_local.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=")
+    lines = res.text.splitlines()
+
+    # Latency by route template (not by path), backend operation timings and errors, transfer volumes, tree sizes
+    assert any(
+        line.startswith(
+            'drop_box_http_request_duration_seconds_count{method="GET",route="/objects/{path:path}",status="200"}'
+        )
+        for line in lines
+    )
+    assert any(
+        line.startswith(
+            'drop_box_backend_operation_duration_seconds_count{backend="local",operation="get_directory_tree"}'
+        )
+        for line in lines
+    )
+    assert any(
+        line.startswith(
+            'drop_box_backend_operation_errors_total{backend="local",error="HTTPException",operation="retrieve_from_path"}'
+        )
+        for line in lines
+    )
+    downloaded = next(line for line in lines if line.startswith('drop_box_downloaded_bytes_total{backend="local"}'))
+    assert float(downloaded.split()[-1]) >= len(client_local.get("/objects/patate.txt").content)
+    assert 'drop_box_transfers_in_progress{backend="local",direction="download"} 0.0' in lines
+    assert any(line.startswith('drop_box_tree_entries_count{backend="local"}') for line in lines)
@@ -0,0 +1,444 @@
+import base64
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+from datetime import UTC, datetime
+
+import orjson
+from fastapi.testclient import TestClient
+
+from .fake_s3 import FakeS3Client
+
+MiB = 1024 * 1024
+
+
+def test_upload_s3_small(client_s3: TestClient, s3_client: FakeS3Client):
+    res = client_s3.put("/objects/some_dir/patate.txt", content=b"patate")
+    assert res.status_code == 204
+    assert s3_client.objects["some_dir/patate.txt"].body == b"patate"
+    # Bodies smaller than a part skip multipart uploads altogether (the object is then only looked up for the change feed)
+    assert s3_client.calls == ["put_object", "head_object"]
+
+
+def test_upload_s3_multipart(client_s3: TestClient, s3_client: FakeS3Client):
+    body = bytes(range(256)) * (12 * MiB // 256 + 7)
+
+    res = client_s3.put("/objects/run/reads.bam", content=body)
+    assert res.status_code == 204
+    assert s3_client.objects["run/reads.bam"].body == body
+    assert s3_client.calls.count("upload_part") == 3
+    assert s3_client.calls[-2:] == ["complete_multipart_upload", "head_object"]
+    assert not s3_client.multipart_uploads
+
+
+def test_upload_s3_multipart_part_failure(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.fail_upload_part = 2
+
+    res = client_s3.put("/objects/run/reads.bam", content=b"x" * (12 * MiB))
+    assert res.status_code == 500
+    assert "run/reads.bam" not in s3_client.objects
+    # Upload was cleaned up rather than left with orphaned parts
+    assert len(s3_client.aborted_uploads) == 1
+    assert not s3_client.multipart_uploads
+
+
+def test_upload_checksums_s3(make_s3_client, make_s3_backend, s3_client: FakeS3Client):
+    client_s3_checksums = make_s3_client(make_s3_backend(checksum_algorithms=("md5", "sha256")))
+
+    def _checksums(body: bytes) -> dict[str, str]:
+        return {"md5": hashlib.md5(body).hexdigest(), "sha256": hashlib.sha256(body).hexdigest()}
+
+    small_body, large_body = b"patate", bytes(range(256)) * (12 * MiB // 256 + 7)
+    assert client_s3_checksums.put("/objects/patate.txt", content=small_body).status_code == 204
+    assert client_s3_checksums.put("/objects/run/reads.bam", content=large_body).status_code == 204
+
+    # Stored in object metadata: directly for single-part uploads, with a copy once multipart uploads are complete
+    assert s3_client.objects["patate.txt"].metadata == {
+        f"checksum-{algorithm}": digest for algorithm, digest in _checksums(small_body).items()
+    }
+    assert s3_client.objects["run/reads.bam"].metadata == {
+        f"checksum-{algorithm}": digest for algorithm, digest in _checksums(large_body).items()
+    }
+    assert s3_client.calls.count("copy_object") == 1
+
+    tree = client_s3_checksums.get("/tree").json()
+    assert tree[0]["checksums"] == _checksums(small_body)
+    assert tree[1]["contents"][0]["checksums"] == _checksums(large_body)
+
+    digest = base64.b64encode(hashlib.sha256(large_body).digest()).decode()
+    for headers in ({}, {"Range": "bytes=0-9"}, {"Range": "bytes=0-9,20-29"}):
+        res = client_s3_checksums.get("/objects/run/reads.bam", headers=headers)
+        assert res.headers["repr-digest"].endswith(f", sha-256=:{digest}:")
+
+    # Objects added from outside the service have no checksums until the background job computes them
+    s3_client.put("outside.txt", b"outside")
+    assert "checksums" not in client_s3_checksums.get("/tree").json()[0]
+    assert "repr-digest" not in client_s3_checksums.get("/objects/outside.txt").headers
+
+
+def test_download_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("some_dir/tomate.vcf", b"0123456789")
+
+    res = client_s3.get("/objects/some_dir/tomate.vcf")
+    assert res.status_code == 200
+    assert res.content == b"0123456789"
+    assert res.headers["accept-ranges"] == "bytes"
+    assert res.headers["content-disposition"] == 'attachment; filename="tomate.vcf"'
+    assert res.headers["last-modified"].endswith(" GMT")
+
+
+def test_download_s3_range(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("tomate.vcf", b"0123456789")
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=2-4"})
+    assert res.status_code == 206
+    assert res.content == b"234"
+    assert res.headers["content-range"] == "bytes 2-4/10"
+    assert res.headers["content-length"] == "3"
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=-3"})
+    assert res.status_code == 206
+    assert res.content == b"789"
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=0-1, 5-6"})
+    assert res.status_code == 206
+    assert res.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(res.headers["content-length"]) == len(res.content)
+    assert b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n" in res.content
+    assert b"Content-Range: bytes 5-6/10\r\n\r\n56\r\n" in res.content
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=20-"})
+    assert res.status_code == 416
+    assert res.headers["content-range"] == "bytes */10"
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "items=0-1"})
+    assert res.status_code == 400
+
+    # If-Range which doesn't match the current ETag: send the full object
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=2-4", "If-Range": '"outdated"'})
+    assert res.status_code == 200
+    assert res.content == b"0123456789"
+
+
+def test_download_s3_conditional(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("tomate.vcf", b"0123456789")
+
+    res = client_s3.get("/objects/tomate.vcf")
+    etag, last_modified = res.headers["etag"], res.headers["last-modified"]
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["etag"] == etag
+    assert res.content == b""
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+
+    res = client_s3.get("/objects/tomate.vcf", headers={"If-None-Match": '"other"'})
+    assert res.status_code == 200
+
+
+def test_download_s3_single_round_trip(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("tomate.vcf", b"0123456789")
+
+    for headers in ({}, {"Range": "bytes=2-4"}, {"If-None-Match": s3_client.objects["tomate.vcf"].etag}):
+        s3_client.calls.clear()
+        res = client_s3.get("/objects/tomate.vcf", headers=headers)
+        assert res.status_code in (200, 206, 304)
+        assert s3_client.calls == ["get_object"]
+
+    res = client_s3.get("/objects/tomate.vcf")
+    assert res.headers["content-length"] == "10"
+    assert res.headers["etag"] == s3_client.objects["tomate.vcf"].etag
+
+    # If-Range with a matching Last-Modified date: range is honoured
+    res = client_s3.get("/objects/tomate.vcf", headers={"Range": "bytes=0-0", "If-Range": res.headers["last-modified"]})
+    assert res.status_code == 206
+    assert res.content == b"0"
+
+
+def test_download_s3_parallel_ranges(make_s3_client, make_s3_backend, s3_client: FakeS3Client):
+    client_s3 = make_s3_client(
+        make_s3_backend(s3_parallel_download_threshold=2 * MiB, s3_parallel_download_part_size=MiB)
+    )
+    body = bytes(range(256)) * (3 * MiB // 256 + 5)
+    s3_client.put("reads.bam", body)
+
+    res = client_s3.get("/objects/reads.bam")
+    assert res.status_code == 200
+    assert res.headers["content-length"] == str(len(body))
+    assert res.content == body
+    assert s3_client.get_ranges == [
+        None,
+        f"bytes={MiB}-{2 * MiB - 1}",
+        f"bytes={2 * MiB}-{3 * MiB - 1}",
+        f"bytes={3 * MiB}-{len(body) - 1}",
+    ]
+
+    # Range requests are still served from a single ranged GET
+    s3_client.get_ranges.clear()
+    res = client_s3.get("/objects/reads.bam", headers={"Range": "bytes=0-9"})
+    assert res.content == body[:10]
+    assert s3_client.get_ranges == ["bytes=0-9"]
+
+
+def test_download_s3_404(client_s3: TestClient):
+    res = client_s3.get("/objects/peel.txt")
+    assert res.status_code == 404
+
+    res = client_s3.get("/objects/peel.txt", headers={"Range": "bytes=0-1,3-4"})
+    assert res.status_code == 404
+
+
+def test_tree_ndjson_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    for key in ("run/s2/b.vcf", "run/s1/a.vcf", "a.txt", "run/x.json", "run/s1/c.vcf"):
+        s3_client.put(key, b"data")
+
+    res = client_s3.get("/tree?format=ndjson")
+    assert res.status_code == 200
+    entries = [orjson.loads(line) for line in res.content.splitlines()]
+    assert [e["relativePath"] for e in entries] == [
+        "/a.txt",
+        "run",
+        "run/s1",
+        "/run/s1/a.vcf",
+        "/run/s1/c.vcf",
+        "run/s2",
+        "/run/s2/b.vcf",
+        "/run/x.json",
+    ]
+
+    res = client_s3.get("/tree/run/s1?format=ndjson&include=c.vcf")
+    assert [orjson.loads(line)["filePath"] for line in res.content.splitlines()] == ["run", "run/s1", "run/s1/c.vcf"]
+
+
+def test_tree_compact_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    for key in ("run/s2/b.vcf", "run/s1/a.vcf", "a.txt", "run/x.json"):
+        s3_client.put(key, b"data")
+
+    res = client_s3.get("/tree?format=compact")
+    assert res.status_code == 200
+    compact = res.json()
+    assert compact["root"] == ""
+    assert compact["filePathPrefix"] == ""
+    assert compact["uriPrefix"].endswith("/objects/")
+    assert compact["names"] == ["a.txt", "run", "s1", "a.vcf", "s2", "b.vcf", "x.json"]
+    assert compact["parents"] == [-1, -1, 1, 2, 1, 4, 1]
+    assert compact["sizes"] == [4, None, None, 4, None, 4, 4]
+    assert compact["checksums"] == [None] * 7
+    last_modified = s3_client.objects["run/s1/a.vcf"].last_modified.timestamp()
+    assert compact["lastModified"][3] == compact["lastMetadataChange"][3] == last_modified
+
+    # S3 sub-trees include the directories along the prefix, so they are rooted at the top of the bucket too
+    compact = client_s3.get("/tree/run/s1?format=compact").json()
+    assert compact["root"] == ""
+    assert compact["names"] == ["run", "s1", "a.vcf"]
+    assert compact["parents"] == [-1, 0, 1]
+
+
+def test_tree_filters_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    for key, size in (("a.vcf.gz", 10), ("run_1/s1.vcf.gz", 100), ("run_1/tmp/x.vcf.gz", 1), ("run_2/s2.bam", 1000)):
+        s3_client.put(key, b"0" * size)
+
+    def _file_paths(url: str) -> list[str]:
+        res = client_s3.get(f"{url}&format=ndjson")
+        assert res.status_code == 200
+        entries = [orjson.loads(line) for line in res.content.splitlines()]
+        return [e["relativePath"] for e in entries if "uri" in e]
+
+    assert _file_paths("/tree?include=*.vcf.gz&ignore=*/tmp/*") == ["/a.vcf.gz", "/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree?include=.gz&ignore=run_1/tmp/*&min_size=50") == ["/run_1/s1.vcf.gz"]
+    assert _file_paths("/tree?max_size=10") == ["/a.vcf.gz", "/run_1/tmp/x.vcf.gz"]
+
+    # Only keys under the literal start of the include globs are listed
+    s3_client.list_prefixes.clear()
+    assert _file_paths("/tree?include=run_1/*.vcf.gz") == ["/run_1/s1.vcf.gz", "/run_1/tmp/x.vcf.gz"]
+    assert set(s3_client.list_prefixes) == {"run_1/"}
+
+    # Directory levels which can't have anything passing the filter are not listed
+    s3_client.list_prefixes.clear()
+    res = client_s3.get("/tree?depth=2&include=run_1/*&ignore=run_1/tmp/*")
+    assert [e["name"] for e in res.json()] == ["run_1"]
+    assert [e["name"] for e in res.json()[0]["contents"]] == ["s1.vcf.gz"]
+    assert s3_client.list_prefixes == ["", "run_1/"]
+
+
+def test_tree_depth_and_pagination_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    for key in ("run/s2/b.vcf", "run/s1/a.vcf", "a.txt", "run/x.json", "run/s1/c.vcf", "run/s3/d.txt"):
+        s3_client.put(key, b"data")
+
+    res = client_s3.get("/tree?depth=1")
+    assert res.status_code == 200
+    assert [(e["name"], e.get("truncated")) for e in res.json()] == [("a.txt", None), ("run", True)]
+
+    res = client_s3.get("/tree/run?depth=2&include=.vcf")
+    tree = res.json()
+    assert [e["name"] for e in tree] == ["s1", "s2"]
+    assert [e["name"] for e in tree[0]["contents"]] == ["a.vcf", "c.vcf"]
+
+    s3_client.calls.clear()
+    names = []
+    cursor = None
+    while True:
+        res = client_s3.get("/tree/run", params={"depth": 1, "limit": 2, **({"cursor": cursor} if cursor else {})})
+        names.extend(e["name"] for e in res.json())
+        if (cursor := res.headers.get("X-Next-Cursor")) is None:
+            break
+    assert names == ["s1", "s2", "s3", "x.json"]
+    # Pages are listed with a delimiter, one request per page
+    assert s3_client.calls == ["list_objects_v2"] * 2
+
+
+def test_resumable_upload_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    part_size = 5 * MiB
+    body = os.urandom(2 * part_size + 1234)
+
+    res = client_s3.post("/uploads", json={"path": "run/reads.bam", "size": len(body)})
+    assert res.status_code == 201
+    session = res.json()
+    assert session["path"] == "run/reads.bam"
+    upload_id = session["id"]
+
+    res = client_s3.put(f"/uploads/{upload_id}?offset={2 * part_size}", content=body[2 * part_size :])
+    assert res.status_code == 204
+    res = client_s3.put(f"/uploads/{upload_id}?offset=0", content=body[:part_size])
+    assert res.status_code == 204
+
+    res = client_s3.get(f"/uploads/{upload_id}")
+    assert res.status_code == 200
+    assert res.json()["receivedOffsets"] == [0, 2 * part_size]
+    assert res.json()["bytesReceived"] == part_size + 1234
+
+    res = client_s3.post(f"/uploads/{upload_id}/complete")
+    assert res.status_code == 400
+    assert "run/reads.bam" not in s3_client.objects
+
+    res = client_s3.put(f"/uploads/{upload_id}?offset={part_size}", content=body[part_size : 2 * part_size])
+    assert res.status_code == 204
+
+    res = client_s3.post(f"/uploads/{upload_id}/complete")
+    assert res.status_code == 204
+    assert s3_client.objects["run/reads.bam"].body == body
+    assert not s3_client.multipart_uploads
+
+    assert client_s3.get(f"/uploads/{upload_id}").status_code == 404
+    assert client_s3.get("/uploads/not-an-upload").status_code == 404
+
+
+def test_resumable_upload_s3_abort(client_s3: TestClient, s3_client: FakeS3Client):
+    upload_id = client_s3.post("/uploads", json={"path": "reads.bam", "size": 10}).json()["id"]
+    assert client_s3.delete(f"/uploads/{upload_id}").status_code == 204
+    assert not s3_client.multipart_uploads
+    assert client_s3.delete(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_batch_delete_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    for i in range(1500):
+        s3_client.put(f"run/sample_{i:04d}.vcf", b"x")
+    s3_client.put("run.vcf", b"x")
+    s3_client.put("other/keep.vcf", b"x")
+
+    res = client_s3.post("/delete", json={"paths": ["other/keep.vcf", "missing.vcf"]})
+    assert res.status_code == 200
+    assert [(r["path"], r["status"]) for r in res.json()] == [("other/keep.vcf", 204), ("missing.vcf", 204)]
+
+    s3_client.calls.clear()
+    res = client_s3.post("/delete", json={"prefix": "run"})
+    assert res.status_code == 200
+    assert len(res.json()) == 1500
+    assert all(r["status"] == 204 for r in res.json())
+    # Keys are deleted in batches of at most 1000, rather than one request per key
+    assert s3_client.calls.count("delete_objects") == 2
+    assert list(s3_client.objects) == ["run.vcf"]
+
+    assert client_s3.post("/delete", json={"prefix": ""}).status_code == 400
+
+
+def test_batch_delete_s3_relative_paths(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("some_dir/x.vcf", b"x")
+    s3_client.put("y.vcf", b"x")
+    token = client_s3.get("/tree").headers["X-Changes-Token"]
+
+    # Paths in the tree's own relativePath form (with a leading slash) are deleted; results keep the paths as given
+    res = client_s3.post("/delete", json={"paths": ["/some_dir/x.vcf", "/y.vcf", "/./y.vcf", "/.."]})
+    assert res.status_code == 200
+    assert [(r["path"], r["status"]) for r in res.json()] == [
+        ("/some_dir/x.vcf", 204),
+        ("/y.vcf", 204),
+        ("/./y.vcf", 404),
+        ("/..", 404),
+    ]
+    assert not s3_client.objects
+
+    changes = client_s3.get("/changes", params={"since": token}).json()["changes"]
+    assert [(c["change"], c["relativePath"]) for c in changes] == [
+        ("removed", "/some_dir/x.vcf"),
+        ("removed", "/y.vcf"),
+    ]
+
+
+def test_delete_s3_unsecured_keys(client_s3: TestClient, s3_client: FakeS3Client):
+    # Objects put in the bucket from outside the service can have keys which uploads would have rewritten
+    s3_client.put("run/My Sample.vcf", b"x")
+    s3_client.put("run/Other Sample.vcf", b"x")
+    assert client_s3.get("/objects/run/My Sample.vcf").status_code == 200
+
+    assert client_s3.delete("/objects/run/My Sample.vcf").status_code == 204
+    res = client_s3.post("/delete", json={"paths": ["/run/Other Sample.vcf"]})
+    assert [(r["path"], r["status"]) for r in res.json()] == [("/run/Other Sample.vcf", 204)]
+    assert not s3_client.objects
+
+    assert client_s3.delete("/objects/run/%2E%2E/x.vcf").status_code == 404
+
+
+def test_search_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    s3_client.put("a.vcf.gz", b"x" * 2000)
+    s3_client.put("a/x.vcf.gz", b"x" * 10)
+    s3_client.put("a/b/y.vcf.gz", b"x" * 3000, last_modified=datetime(2001, 9, 9, tzinfo=UTC))
+    s3_client.put("a/b/z.txt", b"x" * 5)
+    s3_client.put("b.vcf", b"x")
+
+    def _search_all(params: dict) -> list[str]:
+        paths, cursor = [], None
+        while True:
+            res = client_s3.get("/search", params={**params, **({"cursor": cursor} if cursor else {})})
+            assert res.status_code == 200
+            paths.extend(e["relativePath"] for e in res.json())
+            if (cursor := res.headers.get("X-Next-Cursor")) is None:
+                return paths
+
+    # Same results, in the same order, as for the local backend
+    assert _search_all({"suffix": ".vcf.gz", "limit": 1}) == ["/a.vcf.gz", "/a/b/y.vcf.gz", "/a/x.vcf.gz"]
+    assert _search_all({"prefix": "a/", "max_size": 100}) == ["/a/b/z.txt", "/a/x.vcf.gz"]
+    assert _search_all({"modified_before": "2010-01-01T00:00:00Z"}) == ["/a/b/y.vcf.gz"]
+
+    # The literal start of glob patterns is used as the listing prefix
+    s3_client.list_prefixes.clear()
+    res = client_s3.get("/search", params={"glob": "a/b/*", "min_size": 100})
+    assert [e["relativePath"] for e in res.json()] == ["/a/b/y.vcf.gz"]
+    assert s3_client.list_prefixes == ["a/b/"]
+
+
+def test_tree_archive_s3(client_s3: TestClient, s3_client: FakeS3Client):
+    large = os.urandom(3 * MiB)  # larger than the prefetch size, so streamed rather than read ahead of time
+    for i in range(20):
+        s3_client.put(f"run/sample_{i:02d}.vcf", f"sample {i}".encode())
+    s3_client.put("run/reads/reads.bam", large)
+    s3_client.put("other.vcf", b"x")
+
+    res = client_s3.get("/tree/run?format=tar")
+    assert res.status_code == 200
+    assert res.headers["content-disposition"] == 'attachment; filename="run.tar"'
+    with tarfile.open(fileobj=io.BytesIO(res.content)) as tf:
+        assert tf.getnames() == ["run/reads", "run/reads/reads.bam", *(f"run/sample_{i:02d}.vcf" for i in range(20))]
+        assert tf.extractfile("run/reads/reads.bam").read() == large
+        assert tf.extractfile("run/sample_07.vcf").read() == b"sample 7"
+    assert s3_client.calls.count("get_object") == 21
+
+    res = client_s3.get("/tree/run?format=zip&include=.bam")
+    assert res.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(res.content)) as zf:
+        assert zf.namelist() == ["run/reads/", "run/reads/reads.bam"]
+        assert zf.read("run/reads/reads.bam") == large